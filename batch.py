@@ -0,0 +1,408 @@
+"""
+Headless batch conversion for Kommverters.
+
+Converts every file matched by the given globs or directories on a pool of
+worker processes. Does not import PySide6, so it runs on servers without a
+display.
+
+pyvips is optional (pip install pyvips[binary]): when it is installed,
+images from about full HD up are converted with libvips, and
+KOMMVERTERS_IMAGE_BACKEND=pillow or vips overrides the choice.
+
+Example:
+    python batch.py photos/ "scans/**/*.png" --format webp --scale 0.5 --workers 8
+"""
+import argparse
+from contextlib import nullcontext
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from convertions.admission import AdmissionQueue, estimate_memory, no_pixel_limit, set_pixel_limit
+from convertions.cache import DEFAULT_CACHE_DIR, DEFAULT_MAX_BYTES, cached_convert, get_cache
+from convertions.formats import IMAGE_FORMATS, atomic_output, collect_files, unique_output_path
+from convertions.images import PIL_FORMATS
+from convertions.instrument import record
+from convertions.journal import Journal, input_stamp, is_done, job_params
+from convertions.sniff import TARGET_SIZE_FORMATS, canonical_format, detect_format, format_kind
+from convertions.registry import convert_file
+from convertions.renditions import convert_renditions, make_renditions
+from convertions.tiled import TILED_FORMATS, convert_image_tiled
+from convertions.target_size import encode_to_size
+from convertions.vips import image_backend
+from convertions.documents import DEFAULT_DPI, page_output_paths, parse_page_range, pdf_page_count
+
+
+def get_output_path(input_path, target_format, output_directory=""):
+    """Build the output path next to the input, or inside output_directory."""
+    directory = output_directory if output_directory else os.path.dirname(input_path)
+    base_name = os.path.splitext(os.path.basename(input_path))[0]
+    return os.path.join(directory, f"{base_name}.{target_format}")
+
+
+def new_result(input_path, output_path, error=None):
+    """The result of one job, as convert_one, render_one and run_batch report it."""
+    return {
+        'input': input_path,
+        'output': output_path,
+        'input_size': 0,
+        'output_size': 0,
+        'seconds': 0.0,
+        'cached': False,
+        'cache_missed': False,
+        'trials': 0,
+        'stages': [],
+        'error': error
+    }
+
+
+def convert_one(input_path, output_path, target_format, scale, memory_limit=None,
+                page_range="", document_workers=1, cache_dir=None, cache_bytes=DEFAULT_MAX_BYTES,
+                max_bytes=None, stage_log=None, trace_memory=False, profile_path=None, dpi=DEFAULT_DPI):
+    """
+    Convert a single file inside a worker process.
+    Never raises, so one bad file cannot take down the whole batch.
+    With memory_limit (bytes) images are converted band by band.
+    page_range (e.g. "1-3,7") limits which PDF pages are converted.
+    PDFs converted to images are rendered at dpi (times scale), one file
+    per page; 'output' is then the first of them and 'output_size' their
+    total.
+    With cache_dir, outputs already converted with the same settings are
+    copied from the cache instead; 'cached' and 'cache_missed' say how the
+    lookup went.
+    The output is written under a partial name and renamed into place once
+    complete.
+    With max_bytes, JPEG/WEBP outputs are encoded at the highest quality
+    that fits, and 'trials' counts the trial encodes spent.
+    'stages' holds the per-stage timings; they are also appended to
+    stage_log if given, and profile_path saves a cProfile dump.
+    """
+    start = time.perf_counter()
+    result = new_result(input_path, output_path)
+    recorder = None
+    try:
+        result['input_size'] = os.path.getsize(input_path)
+        source_format = detect_format(input_path)
+        # Page images are each renamed into place as they are rendered
+        page_images = source_format == 'pdf' and format_kind(target_format) == 'image'
+        pages = None
+        with nullcontext(output_path) if page_images else atomic_output(output_path) as partial_path:
+            if source_format in IMAGE_FORMATS and max_bytes:
+                options = {'scale': scale, 'max_bytes': max_bytes}
+
+                def convert():
+                    # Files already convert in parallel, so each search stays on one thread
+                    result['trials'] = encode_to_size(input_path, partial_path, target_format, max_bytes,
+                                                      scale, workers=1).trials
+            elif source_format in IMAGE_FORMATS and memory_limit and format_kind(target_format) == 'image':
+                # The band writers encode differently from Pillow, so they get their own entries
+                options = {'scale': scale, 'tiled': True}
+                convert = lambda: convert_image_tiled(input_path, partial_path, target_format, scale, memory_limit)
+            else:
+                if source_format == 'pdf' and page_range:
+                    pages = parse_page_range(page_range, pdf_page_count(input_path))
+                options = {'scale': scale} if source_format in IMAGE_FORMATS else {'pages': pages}
+                if source_format in IMAGE_FORMATS and format_kind(target_format) == 'image':
+                    # Pillow and libvips encode differently, so they get their own entries
+                    options['backend'] = image_backend(input_path, target_format)
+                if page_images:
+                    options.update(scale=scale, dpi=dpi)
+                convert = lambda: convert_file(input_path, partial_path, target_format, source_format,
+                                               scale=scale, pages=pages, workers=document_workers, dpi=dpi)
+            # The cache holds one file per entry
+            cache = get_cache(cache_dir, cache_bytes) if cache_dir and not page_images else None
+
+            def convert_on_miss(convert=convert):
+                # cached_convert only converts once the lookup missed
+                result['cache_missed'] = cache is not None
+                convert()
+            # The pixel limit sizes Pillow's whole-frame path; bands and libvips have their own estimates
+            streamed = ((options.get('tiled') and canonical_format(target_format) in TILED_FORMATS)
+                        or options.get('backend') == 'vips')
+            with record(input_path, stage_log, trace_memory, profile_path, output=output_path,
+                        target_format=target_format, **options) as recorder, \
+                    no_pixel_limit() if streamed else nullcontext():
+                result['cached'] = cached_convert(convert_on_miss, input_path, partial_path, target_format,
+                                                  options, cache)
+        outputs = [output_path]
+        if page_images:
+            page_count = pdf_page_count(input_path)
+            outputs = page_output_paths(output_path, pages or range(page_count), page_count)
+            result['output'] = outputs[0]
+        result['output_size'] = sum(os.path.getsize(output) for output in outputs)
+        if not page_images:
+            print(f"Successfully converted {input_path} to {output_path}")
+    except Exception as e:
+        result['error'] = f"{type(e).__name__}: {e}"
+    if recorder is not None:
+        result['stages'] = [stats.as_dict() for stats in recorder.stages.values()]
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+def render_one(input_path, renditions, workers=1, stage_log=None, trace_memory=False, profile_path=None):
+    """
+    Write every rendition of one image inside a worker process, all from a
+    single decode, with workers encoder threads. Never raises. The result
+    has convert_one's keys: 'output' is the first rendition and
+    'output_size' the total of all of them.
+    """
+    start = time.perf_counter()
+    result = new_result(input_path, renditions[0].output_path)
+    recorder = None
+    try:
+        result['input_size'] = os.path.getsize(input_path)
+        if detect_format(input_path) not in IMAGE_FORMATS:
+            raise ValueError("Renditions need an image source")
+        with record(input_path, stage_log, trace_memory, profile_path, output=result['output'],
+                    renditions=[f"{r.scale:g} {r.target_format}" for r in renditions]) as recorder:
+            convert_renditions(input_path, renditions, workers)
+        result['output_size'] = sum(os.path.getsize(r.output_path) for r in renditions)
+    except Exception as e:
+        result['error'] = f"{type(e).__name__}: {e}"
+    if recorder is not None:
+        result['stages'] = [stats.as_dict() for stats in recorder.stages.values()]
+    result['seconds'] = time.perf_counter() - start
+    return result
+
+
+def format_rate(count, size_bytes, elapsed):
+    """Return throughput as 'files/s, MB/s'."""
+    elapsed = max(elapsed, 1e-9)
+    return f"{count / elapsed:.1f} files/s, {size_bytes / elapsed / (1024 * 1024):.1f} MB/s"
+
+
+def percentile(values, fraction):
+    """The value at fraction (0.5 for the median) of values, or None if empty."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def run_batch(files, target_format, scale=1.0, workers=None, output_directory="",
+              memory_limit=None, page_range="", document_workers=1, cache_dir=None,
+              cache_bytes=DEFAULT_MAX_BYTES, max_bytes=None, stage_log=None, trace_memory=False,
+              profile_path=None, memory_budget=None, journal_path=None, renditions=None, dpi=DEFAULT_DPI,
+              stream=sys.stderr):
+    """
+    Convert files on a process pool and return the list of per-file results.
+    Pass cache_dir=None to bypass the conversion cache. With profile_path
+    the first file is converted under cProfile. With memory_budget (bytes)
+    files only start while their estimated peak memory fits in it, and
+    Pillow refuses images whose decoded frame alone would not. With
+    journal_path every job is recorded in that SQLite journal, and files it
+    shows converted with the same settings, unchanged since, are skipped.
+    With renditions (a list of scales) every image is written at each of
+    them in each format of target_format, a comma-separated list, from one
+    decode; the cache, memory_limit and max_bytes do not apply then.
+    """
+    if output_directory:
+        os.makedirs(output_directory, exist_ok=True)
+
+    results = []
+    done_bytes = 0
+    failed = 0
+    cache_hits = 0
+    cache_misses = 0
+    trials = 0
+    stage_seconds = {}
+    start = time.perf_counter()
+
+    journal = Journal(journal_path) if journal_path else None
+    params = job_params(target_format, scale=renditions or scale, memory_limit=memory_limit, pages=page_range,
+                        max_bytes=max_bytes, dpi=dpi, output_directory=os.path.abspath(output_directory or "."))
+    completed = journal.completed(params) if journal else {}
+    skipped = 0
+
+    claimed = set()
+    queue = AdmissionQueue(memory_budget)
+    for path in files:
+        job_renditions = None
+        if renditions:
+            job_renditions = [r._replace(output_path=unique_output_path(r.output_path, claimed))
+                              for r in make_renditions(path, renditions, target_format.split(','), output_directory)]
+            outputs = [r.output_path for r in job_renditions]
+        else:
+            outputs = [unique_output_path(get_output_path(path, target_format, output_directory), claimed)]
+        output_path = outputs[0]
+        if any(os.path.realpath(output) == os.path.realpath(path) for output in outputs):
+            result = new_result(path, output_path, "Output would overwrite the input file")
+            results.append(result)
+            if journal is not None:
+                journal.finished(path, params, result, input_stamp(path))
+            failed += 1
+            continue
+        stamp = input_stamp(path) if journal else None
+        if journal and is_done(completed, path, stamp):
+            skipped += 1
+            continue
+        cost = 0
+        if memory_budget and renditions:
+            # The largest size is resampled first, while the decode is still alive
+            cost = max(estimate_memory(path, r.target_format, r.scale) for r in job_renditions)
+        elif memory_budget:
+            cost = estimate_memory(path, target_format, scale, memory_limit, page_range)
+        queue.add((path, output_path, stamp, job_renditions), cost)
+
+    total = len(files) - skipped
+    if skipped:
+        print(f"Skipping {skipped} files already converted in an earlier run", file=stream)
+    submitted = 0
+    # Keep every worker busy with one file queued behind it; with a memory
+    # budget only admitted files are handed to the pool, one per worker
+    slots = (workers or os.cpu_count() or 1) * (1 if memory_budget else 2)
+    # Renditions encode on threads, sharing the cores the pool leaves over
+    render_threads = max(1, (os.cpu_count() or 1) // (workers or os.cpu_count() or 1))
+    initializer = set_pixel_limit if memory_budget else None
+    with ProcessPoolExecutor(max_workers=workers, initializer=initializer,
+                             initargs=(memory_budget,) if memory_budget else ()) as executor:
+        running = {}
+        try:
+            while queue or running:
+                for (path, output_path, stamp, job_renditions), cost in queue.admit(slots - len(running)):
+                    if job_renditions:
+                        future = executor.submit(render_one, path, job_renditions, render_threads, stage_log,
+                                                 trace_memory, None if submitted else profile_path)
+                    else:
+                        future = executor.submit(convert_one, path, output_path, target_format, scale,
+                                                 memory_limit, page_range, document_workers,
+                                                 cache_dir, cache_bytes, max_bytes, stage_log, trace_memory,
+                                                 None if submitted else profile_path, dpi)
+                    running[future] = (path, stamp, cost)
+                    submitted += 1
+                    if journal is not None:
+                        journal.started(path, params, output_path, stamp)
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    path, stamp, cost = running.pop(future)
+                    result = future.result()
+                    queue.release(cost, not result['error'])
+                    results.append(result)
+                    if journal is not None:
+                        journal.finished(path, params, result, stamp)
+                    done_bytes += result['input_size']
+                    cache_hits += result['cached']
+                    cache_misses += result['cache_missed']
+                    trials += result['trials']
+                    for stats in result['stages']:
+                        stage_seconds[stats['stage']] = stage_seconds.get(stats['stage'], 0.0) + stats['wall']
+                    if result['error']:
+                        failed += 1
+                        print(f"\nFailed: {result['input']}: {result['error']}", file=stream)
+                    elapsed = time.perf_counter() - start
+                    print(f"\r[{len(results)}/{total}] {format_rate(len(results), done_bytes, elapsed)}, "
+                          f"{failed} failed", end="", file=stream, flush=True)
+        finally:
+            if journal is not None:
+                journal.close()
+
+    elapsed = time.perf_counter() - start
+    converted = len(results) - failed
+    print(file=stream)
+    print(f"Converted {converted} of {total} files in {elapsed:.1f}s "
+          f"({format_rate(len(results), done_bytes, elapsed)}), {failed} failed", file=stream)
+    if max_bytes:
+        print(f"Target size: {trials} trial encodes", file=stream)
+    if cache_dir and not renditions:
+        print(f"Cache: {cache_hits} hits, {cache_misses} misses", file=stream)
+    if memory_budget:
+        print(f"Memory budget: {memory_budget / 2 ** 20:.0f} MB, at most {queue.peak / 2 ** 20:.0f} MB "
+              f"estimated in use, {queue.solo} files over budget ran alone", file=stream)
+    if stage_seconds:
+        print("Stages: " + ", ".join(f"{name} {seconds:.2f}s" for name, seconds in
+                                     sorted(stage_seconds.items(), key=lambda item: -item[1])), file=stream)
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Convert images and documents without the GUI.")
+    parser.add_argument("inputs", nargs="+", help="Files, directories or glob patterns ('**' is recursive)")
+    parser.add_argument("-f", "--format", required=True, help="Target format, e.g. png, jpg, webp, pdf, docx")
+    parser.add_argument("-s", "--scale", type=float, default=1.0, help="Scale factor for images (default: 1)")
+    parser.add_argument("--renditions", default=None,
+                        help="Write every image at each of these comma-separated scales, e.g. 1,0.6,0.2, "
+                             "in each format of a comma-separated --format, from one decode")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("-o", "--output-dir", default="", help="Write outputs here instead of next to the inputs")
+    parser.add_argument("-m", "--memory-limit", type=int, default=None,
+                        help="Convert images in bands using about this many MB per worker")
+    parser.add_argument("--memory-budget", type=int, default=None,
+                        help="Only start files while their estimated peak memory fits in this many MB in total")
+    parser.add_argument("--pages", default="", help="PDF pages to convert, e.g. '1-3,7' (default: all)")
+    parser.add_argument("--dpi", type=float, default=DEFAULT_DPI,
+                        help=f"Resolution PDF pages are rendered at as images (default: {DEFAULT_DPI})")
+    parser.add_argument("--doc-workers", type=int, default=1,
+                        help="Processes used to parse or render the pages of each PDF (default: 1)")
+    parser.add_argument("--max-size", type=int, default=None,
+                        help="Encode JPG/WEBP outputs at the highest quality that fits in this many KB")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR,
+                        help=f"Reuse earlier outputs stored here (default: {DEFAULT_CACHE_DIR})")
+    parser.add_argument("--cache-size", type=int, default=DEFAULT_MAX_BYTES // (1024 * 1024),
+                        help="Evict least recently used cache entries above this many MB (default: 1024)")
+    parser.add_argument("--no-cache", action="store_true", help="Always convert, ignoring the cache")
+    parser.add_argument("--stage-log", default=None,
+                        help="Append per-stage timings of every file to this JSON-lines file")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="Also record peak Python allocations per stage (slower)")
+    parser.add_argument("--profile", default=None, help="Save a cProfile dump of the first file here")
+    parser.add_argument("--journal", default=None,
+                        help="Record every job in this SQLite file; rerunning skips the files it shows done")
+    args = parser.parse_args(argv)
+    if args.scale <= 0:
+        parser.error("--scale must be greater than 0")
+    if args.workers is not None and args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.dpi <= 0:
+        parser.error("--dpi must be greater than 0")
+    if args.doc_workers < 1:
+        parser.error("--doc-workers must be at least 1")
+    if args.memory_limit is not None and args.memory_limit < 1:
+        parser.error("--memory-limit must be at least 1 MB")
+    if args.memory_budget is not None and args.memory_budget < 1:
+        parser.error("--memory-budget must be at least 1 MB")
+    if args.max_size is not None and args.max_size < 1:
+        parser.error("--max-size must be at least 1 KB")
+    if args.max_size and args.format.lower() not in TARGET_SIZE_FORMATS:
+        parser.error("--max-size needs --format jpg or webp")
+    if args.cache_size < 1:
+        parser.error("--cache-size must be at least 1 MB")
+    if args.renditions is not None:
+        try:
+            args.renditions = [float(scale) for scale in args.renditions.split(',')]
+        except ValueError:
+            parser.error("--renditions must be comma-separated numbers")
+        if any(scale <= 0 for scale in args.renditions):
+            parser.error("--renditions scales must be greater than 0")
+        unknown = [fmt for fmt in args.format.lower().split(',') if fmt not in PIL_FORMATS]
+        if unknown:
+            parser.error(f"--renditions writes image formats only, not {', '.join(unknown)}")
+        if args.max_size or args.memory_limit:
+            parser.error("--renditions cannot be combined with --max-size or --memory-limit")
+    elif ',' in args.format:
+        parser.error("several formats need --renditions")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    files = collect_files(args.inputs)
+    if not files:
+        print("No supported files found.", file=sys.stderr)
+        return 1
+    memory_limit = args.memory_limit * 1024 * 1024 if args.memory_limit else None
+    cache_dir = None if args.no_cache else args.cache_dir
+    results = run_batch(files, args.format.lower(), args.scale, args.workers, args.output_dir,
+                        memory_limit, args.pages, args.doc_workers, cache_dir,
+                        args.cache_size * 1024 * 1024,
+                        args.max_size * 1024 if args.max_size else None,
+                        args.stage_log, args.trace_memory, args.profile,
+                        args.memory_budget * 1024 * 1024 if args.memory_budget else None, args.journal,
+                        args.renditions, args.dpi)
+    return 1 if any(r['error'] for r in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
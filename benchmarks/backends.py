@@ -0,0 +1,151 @@
+"""
+Compare the Pillow and libvips image backends on the synthetic corpus.
+
+Every corpus image libvips can take is converted by convert_image() with
+each backend forced in turn, and the report shows per case:
+    pillow / vips    - median seconds end to end
+    peak             - resident memory the conversion adds at its peak, per
+                       backend, measured in a fresh process
+    psnr             - dB between the two outputs
+A case whose PSNR is below VIPS_TOLERANCE_DB fails the run (exit code 1),
+so this doubles as the equivalence check for the libvips backend. The
+crossover in the timings is where VIPS_MIN_PIXELS belongs.
+
+Needs pyvips: pip install pyvips[binary]
+
+Examples:
+    python benchmarks/backends.py
+    python benchmarks/backends.py --sizes medium,large,huge --scales 1,0.5 --json backends.json
+"""
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from corpus import SIZES, build_corpus  # noqa: E402
+from engines import DEFAULT_CORPUS_DIR, comma_list, environment, timed  # noqa: E402
+
+DEFAULT_SIZES = ['small', 'medium', 'large']
+DEFAULT_SCALES = [1.0, 0.5, 0.2]
+BACKENDS = ['pillow', 'vips']
+
+
+def convert_quietly(backend, path, output_path, target_format, scale):
+    from convertions.images import convert_image
+    from convertions.vips import use_backend
+
+    with use_backend(backend), contextlib.redirect_stdout(io.StringIO()):
+        convert_image(path, output_path, target_format, scale)
+
+
+def measure_peak(backend, path, output_path, target_format, scale):
+    """Runs in a fresh process: the memory one conversion adds at its peak, in bytes."""
+    from convertions.instrument import peak_rss
+
+    # Import everything first, so only the conversion itself is measured
+    import convertions.pipeline  # noqa: F401
+    from convertions.vips import load_pyvips
+    load_pyvips()
+    baseline = peak_rss()
+    convert_quietly(backend, path, output_path, target_format, scale)
+    return peak_rss() - baseline
+
+
+def bench_backend(backend, path, output_path, target_format, scale, repeat):
+    """Median seconds and peak memory of convert_image() on one backend."""
+    seconds, _ = timed(lambda: convert_quietly(backend, path, output_path, target_format, scale), repeat)
+    # Freed memory stays in this process's heap, so the peak is taken in a new one
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        peak = executor.submit(measure_peak, backend, path, output_path, target_format, scale).result()
+    return seconds, peak
+
+
+def run(args):
+    from convertions.vips import VIPS_SAVERS, VIPS_TOLERANCE_DB, choose_backend, load_pyvips, output_psnr, use_backend
+
+    if load_pyvips() is None:
+        print("pyvips is not installed. Install it with: pip install pyvips[binary]", file=sys.stderr)
+        return 2
+    targets = [fmt for fmt in ['jpg', 'png', 'webp', 'tiff'] if fmt in VIPS_SAVERS and
+               (not args.targets or fmt in args.targets)]
+
+    entries = build_corpus(args.corpus, sizes=args.sizes, pdf_pages=[])
+    results = {}
+    failures = 0
+    print(f"{'case':40} {'pillow':>9} {'vips':>9} {'speedup':>8} {'peak MB':>13} {'psnr':>7}")
+    with tempfile.TemporaryDirectory() as workdir:
+        for entry in entries:
+            for target_format in targets:
+                width, height = SIZES[entry['size']]
+                with use_backend('vips'):
+                    if choose_backend(entry['mode'], width, height, target_format) != 'vips':
+                        continue
+                for scale in args.scales:
+                    case = f"{entry['name']}->{target_format}@{scale:g}"
+                    outputs = {}
+                    timing = {}
+                    for backend in BACKENDS:
+                        outputs[backend] = os.path.join(workdir, f"{backend}.{target_format}")
+                        timing[backend], timing[f"{backend}_peak_rss"] = bench_backend(
+                            backend, entry['path'], outputs[backend], target_format, scale, args.repeat)
+                    timing['psnr'] = output_psnr(outputs['pillow'], outputs['vips'])
+                    timing['equivalent'] = timing['psnr'] >= VIPS_TOLERANCE_DB
+                    failures += not timing['equivalent']
+                    results[case] = timing
+                    peak = f"{timing['pillow_peak_rss'] / 2 ** 20:.0f}/{timing['vips_peak_rss'] / 2 ** 20:.0f}"
+                    print(f"{case:40} {timing['pillow'] * 1000:7.1f}ms {timing['vips'] * 1000:7.1f}ms "
+                          f"{timing['pillow'] / timing['vips']:7.2f}x {peak:>13} {timing['psnr']:6.1f}"
+                          + ("" if timing['equivalent'] else "  BELOW TOLERANCE"))
+
+    if args.json:
+        report = {
+            'environment': environment(),
+            'repeat': args.repeat,
+            'tolerance_db': VIPS_TOLERANCE_DB,
+            # json has no infinity; identical outputs are reported as None
+            'results': {case: dict(timing, psnr=None if timing['psnr'] == float('inf') else timing['psnr'])
+                        for case, timing in results.items()},
+        }
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print(f"Wrote {len(results)} cases to {args.json}")
+    print(f"{len(results) - failures} of {len(results)} cases within {VIPS_TOLERANCE_DB:g} dB")
+    return 1 if failures else 0
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the Pillow and libvips image backends.")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS_DIR, help="Where the corpus is generated and kept")
+    parser.add_argument("--sizes", type=comma_list(), default=DEFAULT_SIZES,
+                        help=f"Comma-separated sizes from {', '.join(SIZES)} (default: {','.join(DEFAULT_SIZES)})")
+    parser.add_argument("--scales", type=comma_list(float), default=DEFAULT_SCALES,
+                        help="Comma-separated scales (default: 1,0.5,0.2)")
+    parser.add_argument("--targets", type=comma_list(), default=[],
+                        help="Only these target formats (default: jpg,png,webp,tiff)")
+    parser.add_argument("-n", "--repeat", type=int, default=3, help="Runs per timing, the median is kept (default: 3)")
+    parser.add_argument("--json", default="", help="Write the results to this file")
+    args = parser.parse_args(argv)
+    unknown = [size for size in args.sizes if size not in SIZES]
+    if unknown:
+        parser.error(f"unknown sizes: {', '.join(unknown)}")
+    if args.repeat < 1:
+        parser.error("--repeat must be at least 1")
+    if any(not 0 < scale <= 1 for scale in args.scales):
+        parser.error("scales must be between 0 and 1")
+    return args
+
+
+def main(argv=None):
+    return run(parse_args(argv))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
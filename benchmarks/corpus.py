@@ -0,0 +1,174 @@
+"""
+Deterministic synthetic corpus for the engine benchmarks.
+
+Every file is generated from fixed seeds, so two machines (or two runs)
+benchmark byte-identical inputs. The corpus is written once per
+CORPUS_VERSION and reused; manifest.json records a checksum per file.
+
+Images mix a Mandelbrot render (structure), gradients (smooth areas)
+and seeded noise (texture), which compress roughly like photos.
+"""
+import hashlib
+import json
+import os
+import random
+
+from PIL import Image, ImageDraw
+
+# Bump whenever generation changes, so stale corpora are rebuilt
+CORPUS_VERSION = 1
+SEED = 20240301
+
+# Name -> (width, height), from thumbnails to 100 MP
+SIZES = {
+    'thumb': (160, 120),
+    'small': (640, 480),
+    'medium': (1920, 1080),
+    'large': (6000, 4000),
+    'huge': (12000, 8400),
+}
+DEFAULT_SIZES = ['thumb', 'small', 'medium']
+
+# Mode -> source formats the mode is stored in
+MODE_FORMATS = {
+    'RGB': ['jpg', 'png'],
+    'RGBA': ['png', 'webp'],
+    'P': ['gif', 'png'],
+    'CMYK': ['jpg', 'tiff'],
+}
+PIL_SAVE_FORMATS = {'jpg': 'JPEG', 'png': 'PNG', 'webp': 'WEBP', 'gif': 'GIF', 'tiff': 'TIFF'}
+
+# Multi-page PDFs by page count
+PDF_PAGES = [1, 10, 50]
+
+NOISE_TILE = 256
+
+
+def _noise_tile(rng):
+    """A seeded greyscale noise tile; Image.effect_noise cannot be seeded."""
+    return Image.frombytes('L', (NOISE_TILE, NOISE_TILE), rng.randbytes(NOISE_TILE * NOISE_TILE))
+
+
+def synthetic_image(size, mode, seed=SEED):
+    """Return a deterministic photo-like image of the given size and mode."""
+    rng = random.Random(f"{seed}-{size}-{mode}")
+    width, height = size
+
+    # Render the fractal small and scale it up, a full-size render of 100 MP is slow
+    fractal = Image.effect_mandelbrot((min(width, 1024), min(height, 1024)), (-2.2, -1.3, 0.8, 1.3), 64)
+    red = fractal.resize(size, Image.BILINEAR)
+    green = Image.linear_gradient('L').resize(size, Image.BILINEAR)
+    blue = Image.radial_gradient('L').resize(size, Image.BILINEAR)
+    img = Image.merge('RGB', (red, green, blue))
+
+    noise = _noise_tile(rng)
+    texture = Image.new('L', size)
+    for top in range(0, height, NOISE_TILE):
+        for left in range(0, width, NOISE_TILE):
+            texture.paste(noise, (left, top))
+    img = Image.blend(img, Image.merge('RGB', (texture, texture, texture)), 0.15)
+
+    # A few hard edges, placed from the seed
+    draw = ImageDraw.Draw(img)
+    for _ in range(12):
+        x, y = rng.randrange(width), rng.randrange(height)
+        radius = rng.randrange(max(2, min(width, height) // 8))
+        draw.ellipse((x - radius, y - radius, x + radius, y + radius),
+                     fill=(rng.randrange(256), rng.randrange(256), rng.randrange(256)))
+
+    if mode == 'RGBA':
+        alpha = Image.radial_gradient('L').resize(size, Image.BILINEAR).point(lambda v: 255 - v // 2)
+        img.putalpha(alpha)
+    elif mode == 'P':
+        img = img.quantize(256)
+    elif mode == 'CMYK':
+        img = img.convert('CMYK')
+    return img
+
+
+def write_pdf(path, pages, seed=SEED):
+    """Write a deterministic PDF with text, a table-like grid and shapes on every page."""
+    import fitz
+
+    rng = random.Random(f"{seed}-pdf-{pages}")
+    words = ["convert", "image", "document", "page", "format", "scale", "quality", "batch", "queue", "render"]
+    doc = fitz.open()
+    for number in range(pages):
+        page = doc.new_page()
+        page.insert_text((72, 72), f"Benchmark page {number + 1}", fontsize=20)
+        y = 110
+        for _ in range(20):
+            line = " ".join(rng.choice(words) for _ in range(12))
+            page.insert_text((72, y), line, fontsize=10)
+            y += 14
+        for row in range(6):
+            for column in range(4):
+                rect = fitz.Rect(72 + column * 110, y + 10 + row * 20, 182 + column * 110, y + 30 + row * 20)
+                page.draw_rect(rect, color=(0, 0, 0), width=0.5)
+                page.insert_text((rect.x0 + 4, rect.y1 - 6), str(rng.randrange(1000)), fontsize=9)
+        page.draw_circle((450, 700), 40, color=(0.8, 0.2, 0), fill=(1, 0.6, 0))
+    doc.save(path, garbage=0, deflate=True, no_new_id=True)
+    doc.close()
+
+
+def _checksum(path):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def build_corpus(directory, sizes=DEFAULT_SIZES, pdf_pages=PDF_PAGES, log=print):
+    """
+    Generate the corpus under directory (skipping files that already exist)
+    and return the manifest: a list of dicts describing every file.
+    """
+    root = os.path.join(directory, f"v{CORPUS_VERSION}")
+    os.makedirs(root, exist_ok=True)
+    manifest_path = os.path.join(root, "manifest.json")
+    known = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            known = {entry['name']: entry for entry in json.load(f)}
+
+    entries = []
+    for size_name in sizes:
+        size = SIZES[size_name]
+        for mode, formats in MODE_FORMATS.items():
+            img = None
+            for fmt in formats:
+                name = f"{size_name}-{mode.lower()}.{fmt}"
+                path = os.path.join(root, name)
+                if not os.path.exists(path):
+                    if img is None:
+                        log(f"Generating {size_name} {mode} ({size[0]}x{size[1]})")
+                        img = synthetic_image(size, mode)
+                    options = {'quality': 90} if fmt in ('jpg', 'webp') else {}
+                    img.save(path, format=PIL_SAVE_FORMATS[fmt], **options)
+                entries.append({'name': name, 'path': path, 'kind': 'image', 'size': size_name,
+                                'mode': mode, 'format': fmt, 'pixels': size[0] * size[1]})
+
+    for pages in pdf_pages:
+        name = f"document-{pages}p.pdf"
+        path = os.path.join(root, name)
+        if not os.path.exists(path):
+            try:
+                write_pdf(path, pages)
+            except ImportError:
+                log("PyMuPDF is not installed, skipping PDFs. Install it with: pip install pdf2docx")
+                break
+        entries.append({'name': name, 'path': path, 'kind': 'document', 'pages': pages, 'format': 'pdf'})
+
+    for entry in entries:
+        previous = known.get(entry['name'])
+        if previous and previous.get('mtime') == os.path.getmtime(entry['path']):
+            entry['checksum'] = previous['checksum']
+        else:
+            entry['checksum'] = _checksum(entry['path'])
+        entry['mtime'] = os.path.getmtime(entry['path'])
+
+    merged = {**known, **{entry['name']: entry for entry in entries}}
+    with open(manifest_path, 'w') as f:
+        json.dump(sorted(merged.values(), key=lambda entry: entry['name']), f, indent=2)
+    return entries
@@ -0,0 +1,287 @@
+"""
+Benchmark the conversion engines on a deterministic synthetic corpus.
+
+For every source file, target format and scale the image engine is timed
+stage by stage:
+    decode     - open_image() and load, with draft decoding when scaling down
+    resample   - run_pipeline(): resize and mode conversion for the target
+    encode     - save to memory
+    end_to_end - convert_image() to a file, as the GUI and batch run it
+Documents are timed end to end only. Every timing is the median of
+--repeat runs.
+
+Examples:
+    python benchmarks/engines.py run --json baseline.json
+    python benchmarks/engines.py run --sizes thumb,small,medium,large,huge --json big.json
+    python benchmarks/engines.py compare baseline.json current.json --threshold 10
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from corpus import CORPUS_VERSION, DEFAULT_SIZES, PDF_PAGES, SIZES, build_corpus  # noqa: E402
+
+DEFAULT_CORPUS_DIR = os.path.join(os.path.expanduser("~"), ".cache", "kommverters", "benchmark-corpus")
+# The scales offered in the conversion screen
+SCALES = [1.0, 0.8, 0.6, 0.4, 0.2]
+IMAGE_STAGES = ['decode', 'resample', 'encode', 'end_to_end']
+# Timings this close are noise, whatever the ratio
+DEFAULT_MIN_DELTA = 0.002
+
+
+def timed(function, repeat):
+    """Run function repeat times; return the median seconds and the last result."""
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings), result
+
+
+def bench_image(entry, target_format, scale, repeat, workdir):
+    """Time each stage of one image conversion; returns a dict of seconds and the output size."""
+    from convertions.images import PIL_FORMATS, convert_image, open_image, scaled_size
+    from convertions.pipeline import run_pipeline
+
+    def decode():
+        img, original_size = open_image(entry['path'], scale)
+        img.load()
+        return img, original_size
+
+    decode_time, (img, (width, height)) = timed(decode, repeat)
+    size = scaled_size(width, height, scale)
+    resample_time, resized = timed(lambda: run_pipeline(img, size, target_format), repeat)
+
+    def encode():
+        buffer = io.BytesIO()
+        resized.save(buffer, format=PIL_FORMATS[target_format])
+        return buffer.tell()
+
+    encode_time, output_bytes = timed(encode, repeat)
+
+    output_path = os.path.join(workdir, f"output.{target_format}")
+    with contextlib.redirect_stdout(io.StringIO()):
+        end_to_end, _ = timed(lambda: convert_image(entry['path'], output_path, target_format, scale), repeat)
+    return {
+        'decode': decode_time,
+        'resample': resample_time,
+        'encode': encode_time,
+        'end_to_end': end_to_end,
+        'output_bytes': output_bytes,
+    }
+
+
+def bench_document(entry, target_format, repeat, workdir):
+    """Time one document conversion end to end."""
+    from convertions.documents import convert_document
+
+    output_path = os.path.join(workdir, f"output.{target_format}")
+    # pdf2docx logs every page
+    logging.disable(logging.INFO)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            end_to_end, _ = timed(lambda: convert_document(entry['path'], output_path, target_format), repeat)
+    finally:
+        logging.disable(logging.NOTSET)
+    return {'end_to_end': end_to_end, 'output_bytes': os.path.getsize(output_path)}
+
+
+def environment():
+    """Describe the machine and library versions a result set was taken on."""
+    import PIL
+
+    info = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'pillow': PIL.__version__,
+        'corpus_version': CORPUS_VERSION,
+    }
+    try:
+        import fitz
+        info['pymupdf'] = fitz.VersionBind
+    except ImportError:
+        pass
+    from convertions.vips import load_pyvips
+    pyvips = load_pyvips()
+    if pyvips is not None:
+        # Large images go through libvips when it is installed
+        info['libvips'] = f"{pyvips.version(0)}.{pyvips.version(1)}.{pyvips.version(2)}"
+    return info
+
+
+def run(args):
+    from convertions.registry import conversion_targets
+
+    entries = build_corpus(args.corpus, sizes=args.sizes, pdf_pages=[] if args.no_documents else PDF_PAGES)
+    results = {}
+    checksums = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        for entry in entries:
+            checksums[entry['name']] = entry['checksum']
+            targets = [fmt for fmt in conversion_targets(entry['format']) if not args.targets or fmt in args.targets]
+            for target_format in targets:
+                if entry['kind'] == 'document':
+                    case = f"{entry['name']}->{target_format}"
+                    try:
+                        results[case] = bench_document(entry, target_format, args.repeat, workdir)
+                    except Exception as e:
+                        results[case] = {'error': str(e)}
+                        print(f"{case}: failed ({e})")
+                        continue
+                    print(f"{case}: {results[case]['end_to_end'] * 1000:.1f} ms")
+                    continue
+
+                for scale in args.scales:
+                    case = f"{entry['name']}->{target_format}@{scale:g}"
+                    try:
+                        results[case] = timing = bench_image(entry, target_format, scale, args.repeat, workdir)
+                    except Exception as e:
+                        # Kept in the report so a pair that starts failing shows up in compare
+                        results[case] = {'error': str(e)}
+                        print(f"{case}: failed ({e})")
+                        continue
+                    print(f"{case}: " + ", ".join(f"{stage} {timing[stage] * 1000:.1f} ms" for stage in IMAGE_STAGES))
+
+    report = {
+        'environment': environment(),
+        'repeat': args.repeat,
+        'corpus': checksums,
+        'results': results,
+    }
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print(f"Wrote {len(results)} cases to {args.json}")
+    return 0
+
+
+def compare_results(baseline, current, threshold, min_delta=DEFAULT_MIN_DELTA):
+    """
+    Compare two result sets case by case and stage by stage.
+    Returns (regressions, improvements), each a list of
+    (case, stage, baseline seconds, current seconds); a change counts when
+    it is over threshold (a fraction) and over min_delta seconds. A case
+    that now fails is a regression with current seconds None.
+    """
+    regressions, improvements = [], []
+    for case, stages in sorted(current['results'].items()):
+        reference = baseline['results'].get(case)
+        if reference is None or 'error' in reference:
+            continue
+        if 'error' in stages:
+            # A pair that used to work and now fails is the worst regression
+            regressions.append((case, 'error', reference.get('end_to_end', 0.0), None))
+            continue
+        for stage, seconds in stages.items():
+            if stage == 'output_bytes' or stage not in reference:
+                continue
+            before = reference[stage]
+            if abs(seconds - before) < min_delta:
+                continue
+            if seconds > before * (1 + threshold):
+                regressions.append((case, stage, before, seconds))
+            elif seconds < before * (1 - threshold):
+                improvements.append((case, stage, before, seconds))
+    return regressions, improvements
+
+
+def compare(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+
+    # Differences here make the numbers incomparable, say so but still compare
+    for key in ['corpus_version', 'cpu_count', 'machine', 'pillow', 'libvips']:
+        before, after = baseline['environment'].get(key), current['environment'].get(key)
+        if before != after:
+            print(f"Warning: {key} differs ({before} vs {after})")
+    changed = sorted(name for name, checksum in current['corpus'].items()
+                     if name in baseline['corpus'] and baseline['corpus'][name] != checksum)
+    if changed:
+        print(f"Warning: corpus files differ from the baseline: {', '.join(changed)}")
+
+    threshold = args.threshold / 100
+    regressions, improvements = compare_results(baseline, current, threshold, args.min_delta / 1000)
+    for title, rows in [("Regressions", regressions), ("Improvements", improvements)]:
+        if rows:
+            print(f"{title} (over {args.threshold:g}%):")
+            for case, stage, before, after in rows:
+                if after is None:
+                    print(f"  {case}: now fails ({current['results'][case]['error']})")
+                    continue
+                print(f"  {case} {stage}: {before * 1000:.1f} ms -> {after * 1000:.1f} ms "
+                      f"({(after / before - 1) * 100:+.0f}%)")
+
+    missing = sorted(set(baseline['results']) - set(current['results']))
+    if missing:
+        print(f"{len(missing)} baseline cases were not run")
+    print(f"{len(regressions)} regressions, {len(improvements)} improvements "
+          f"in {len(set(baseline['results']) & set(current['results']))} common cases")
+    return 1 if regressions else 0
+
+
+def comma_list(convert=str):
+    return lambda text: [convert(item.strip()) for item in text.split(",") if item.strip()]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the Kommverters conversion engines.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Time every format pair and scale on the synthetic corpus")
+    run_parser.add_argument("--corpus", default=DEFAULT_CORPUS_DIR, help="Where the corpus is generated and kept")
+    run_parser.add_argument("--sizes", type=comma_list(), default=DEFAULT_SIZES,
+                            help=f"Comma-separated sizes from {', '.join(SIZES)} (default: {','.join(DEFAULT_SIZES)})")
+    run_parser.add_argument("--scales", type=comma_list(float), default=SCALES,
+                            help="Comma-separated scales (default: the ones the GUI offers)")
+    run_parser.add_argument("--targets", type=comma_list(), default=[],
+                            help="Only these target formats (default: all)")
+    run_parser.add_argument("-n", "--repeat", type=int, default=3, help="Runs per timing, the median is kept (default: 3)")
+    run_parser.add_argument("--no-documents", action="store_true", help="Skip the PDF cases")
+    run_parser.add_argument("--json", default="", help="Write the results to this file")
+
+    compare_parser = commands.add_parser("compare", help="Flag regressions against a baseline run")
+    compare_parser.add_argument("baseline", help="JSON written by 'run' on the reference build")
+    compare_parser.add_argument("current", help="JSON written by 'run' on the build under test")
+    compare_parser.add_argument("--threshold", type=float, default=10.0,
+                                help="Slowdown in percent that counts as a regression (default: 10)")
+    compare_parser.add_argument("--min-delta", type=float, default=DEFAULT_MIN_DELTA * 1000,
+                                help="Ignore changes smaller than this many ms (default: 2)")
+
+    args = parser.parse_args(argv)
+    if args.command == "run":
+        unknown = [size for size in args.sizes if size not in SIZES]
+        if unknown:
+            parser.error(f"unknown sizes: {', '.join(unknown)}")
+        if args.repeat < 1:
+            parser.error("--repeat must be at least 1")
+        if any(not 0 < scale <= 1 for scale in args.scales):
+            parser.error("scales must be between 0 and 1")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.command == "run":
+        return run(args)
+    return compare(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
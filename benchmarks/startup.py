@@ -0,0 +1,87 @@
+"""
+Cold-start benchmark for the Kommverters window.
+
+Launches main.py in a fresh interpreter several times and reports, from
+process launch:
+    first_paint  - the drop screen has painted for the first time
+    interactive  - the converters are imported and the event loop is idle
+
+Example:
+    python benchmarks/startup.py --runs 10 --json startup.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+METRICS = ['first_paint', 'interactive']
+
+
+def launch_once(timeout=60.0, offscreen=False):
+    """Start main.py once and return its startup timings in seconds."""
+    env = dict(os.environ)
+    env['KOMMVERTERS_STARTUP_BENCHMARK'] = "1"
+    env['KOMMVERTERS_LAUNCH_TIME'] = repr(time.time())
+    if offscreen:
+        env['QT_QPA_PLATFORM'] = "offscreen"
+    completed = subprocess.run(
+        [sys.executable, os.path.join(ROOT, "main.py")],
+        cwd=ROOT, env=env, capture_output=True, text=True, timeout=timeout
+    )
+    for line in reversed(completed.stdout.splitlines()):
+        line = line.strip()
+        if line.startswith("{"):
+            return json.loads(line)
+    raise RuntimeError(f"main.py exited with {completed.returncode} without reporting timings:\n{completed.stderr}")
+
+
+def summarize(runs):
+    """Return min/median/max per metric, in milliseconds."""
+    summary = {}
+    for metric in METRICS:
+        values = [run[metric] * 1000 for run in runs if metric in run]
+        if values:
+            summary[metric] = {
+                'min_ms': round(min(values), 1),
+                'median_ms': round(statistics.median(values), 1),
+                'max_ms': round(max(values), 1),
+            }
+    return summary
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Measure Kommverters time to first paint and time to interactive.")
+    parser.add_argument("-n", "--runs", type=int, default=5, help="Number of launches (default: 5)")
+    parser.add_argument("--offscreen", action="store_true", help="Use Qt's offscreen platform (no display needed)")
+    parser.add_argument("--json", default="", help="Also write the raw runs and summary to this file")
+    args = parser.parse_args(argv)
+    if args.runs < 1:
+        parser.error("--runs must be at least 1")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    runs = []
+    for index in range(args.runs):
+        timings = launch_once(offscreen=args.offscreen)
+        runs.append(timings)
+        print(f"run {index + 1}: " + ", ".join(f"{metric} {timings[metric] * 1000:.0f} ms"
+                                              for metric in METRICS if metric in timings))
+
+    summary = summarize(runs)
+    for metric, values in summary.items():
+        print(f"{metric}: median {values['median_ms']} ms (min {values['min_ms']}, max {values['max_ms']})")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'runs': runs, 'summary': summary}, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
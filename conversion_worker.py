@@ -0,0 +1,225 @@
+from PySide6.QtCore import QObject, QRunnable, Signal
+from PySide6.QtGui import QImage
+from contextlib import nullcontext
+import os
+import threading
+import time
+
+from convertions.formats import IMAGE_FORMATS, atomic_output
+from convertions.instrument import claim_profile_path, record
+from convertions.progress import ConversionCancelled
+
+
+class WorkerSignals(QObject):
+    """Signals emitted by a ConversionWorker, delivered on the GUI thread."""
+    progress = Signal(int)        # percent complete
+    finished = Signal(str)        # output path
+    failed = Signal(str, bool)    # error message, True if a library is missing
+    cancelled = Signal()
+
+
+class ConversionWorker(QRunnable):
+    """Run a single image or document conversion on a QThreadPool thread."""
+
+    def __init__(self, input_path: str, output_path: str, source_format: str,
+                 target_format: str, scale: float = 1.0, page_range: str = "", workers: int = 1,
+                 use_cache: bool = True, max_bytes: int = 0):
+        super().__init__()
+        self.input_path = input_path
+        self.output_path = output_path
+        self.source_format = source_format
+        self.target_format = target_format
+        self.scale = scale
+        self.page_range = page_range
+        self.workers = workers
+        self.use_cache = use_cache
+        self.max_bytes = max_bytes
+        self.summary = ""  # Details of the finished conversion, e.g. the quality search
+        self.stages = None  # Recorder with the per-stage timings, once the conversion ran
+        self.signals = WorkerSignals()
+        self._cancel_event = threading.Event()
+        # The screen keeps the worker to cancel it, so Python owns it rather
+        # than the pool deleting the C++ object behind the wrapper
+        self.setAutoDelete(False)
+
+    def cancel(self) -> None:
+        """Ask the worker to stop at the next stage boundary."""
+        self._cancel_event.set()
+
+    def is_cancelled(self) -> bool:
+        return self._cancel_event.is_set()
+
+    def _report(self, fraction: float) -> None:
+        self.signals.progress.emit(int(fraction * 100))
+
+    def _encode_to_size(self, output_path: str) -> None:
+        from convertions.target_size import encode_to_size
+
+        result = encode_to_size(self.input_path, output_path, self.target_format, self.max_bytes,
+                                self.scale, progress=self._report, is_cancelled=self.is_cancelled)
+        self.summary = (f"Quality {result.quality} at scale {result.scale:.2f}, "
+                        f"{result.trials} trial encodes")
+
+    def run(self) -> None:
+        # Imported here so the heavy converters load on the worker thread
+        from convertions.registry import convert_file
+        from convertions.documents import parse_page_range, pdf_page_count
+        from convertions.cache import cached_convert, get_cache
+        from convertions.vips import image_backend
+
+        try:
+            # A cancelled or failed conversion leaves no half-written output behind;
+            # PDF page images are each renamed into place as they are rendered
+            page_images = self.source_format == 'pdf' and self.target_format.lower() in IMAGE_FORMATS
+            with nullcontext(self.output_path) if page_images else atomic_output(self.output_path) as partial_path:
+                if self.source_format in IMAGE_FORMATS and self.max_bytes:
+                    options = {'scale': self.scale, 'max_bytes': self.max_bytes}
+                    convert = lambda: self._encode_to_size(partial_path)
+                else:
+                    pages = None
+                    if self.source_format == 'pdf' and self.page_range.strip():
+                        pages = parse_page_range(self.page_range, pdf_page_count(self.input_path))
+                    options = {'scale': self.scale} if self.source_format in IMAGE_FORMATS else {'pages': pages}
+                    if self.source_format in IMAGE_FORMATS and self.target_format.lower() in IMAGE_FORMATS:
+                        # Pillow and libvips encode differently, so they get their own entries
+                        options['backend'] = image_backend(self.input_path, self.target_format)
+                    # The registry picks the converter, or a chain of them
+                    convert = lambda: convert_file(self.input_path, partial_path, self.target_format,
+                                                   self.source_format, self._report, self.is_cancelled,
+                                                   scale=self.scale, pages=pages, workers=self.workers)
+                cache = get_cache() if self.use_cache and not page_images else None
+                with record(self.input_path, profile_path=claim_profile_path(), output=self.output_path,
+                            target_format=self.target_format, **options) as recorder:
+                    self.stages = recorder
+                    if cached_convert(convert, self.input_path, partial_path, self.target_format,
+                                      options, cache):
+                        self.summary = "Copied from the conversion cache"
+                        self._report(1.0)
+            if not page_images:
+                print(f"Successfully converted {self.input_path} to {self.output_path}")
+            self.summary = "\n".join(filter(None, [self.summary, recorder.summary()]))
+        except ConversionCancelled:
+            self.signals.cancelled.emit()
+        except ImportError as e:
+            self.signals.failed.emit(str(e), True)
+        except Exception as e:
+            self.signals.failed.emit(str(e), False)
+        else:
+            self.signals.finished.emit(self.output_path)
+
+
+class EstimateSignals(QObject):
+    """Signals emitted by an EstimateWorker."""
+    estimated = Signal(int, object)   # generation, SizeEstimate
+    failed = Signal(int, str)         # generation, error message
+
+
+class EstimateWorker(QRunnable):
+    """Estimate an image's output size on a QThreadPool thread."""
+
+    def __init__(self, generation: int, file_path: str, scale: float, target_format: str):
+        super().__init__()
+        self.generation = generation
+        self.file_path = file_path
+        self.scale = scale
+        self.target_format = target_format
+        self.signals = EstimateSignals()
+        self._cancel_event = threading.Event()
+        self.setAutoDelete(False)
+
+    def cancel(self) -> None:
+        self._cancel_event.set()
+
+    def is_cancelled(self) -> bool:
+        return self._cancel_event.is_set()
+
+    def run(self) -> None:
+        from convertions.estimate import estimate_output_size
+
+        try:
+            estimate = estimate_output_size(self.file_path, self.target_format, self.scale,
+                                            is_cancelled=self.is_cancelled)
+        except ConversionCancelled:
+            return
+        except Exception as e:
+            self.signals.failed.emit(self.generation, str(e))
+        else:
+            self.signals.estimated.emit(self.generation, estimate)
+
+
+class ScanSignals(QObject):
+    """Signals emitted by a ScanWorker."""
+    found = Signal(int, list)   # generation, [(path, source format, size in bytes)]
+    finished = Signal(int)      # generation
+
+
+class ScanWorker(QRunnable):
+    """
+    Expand dropped files and folders and sniff every file on a QThreadPool
+    thread, handing the results on in batches as the walk goes.
+    """
+
+    # A batch goes out when it has this many files or is this many seconds old
+    BATCH_SIZE = 500
+    BATCH_SECONDS = 0.1
+
+    def __init__(self, generation: int, paths):
+        super().__init__()
+        self.generation = generation
+        self.paths = list(paths)
+        self.signals = ScanSignals()
+        self._cancel_event = threading.Event()
+        self.setAutoDelete(False)
+
+    def cancel(self) -> None:
+        self._cancel_event.set()
+
+    def run(self) -> None:
+        from convertions.formats import iter_files
+        from convertions.sniff import detect_format
+
+        batch = []
+        sent = time.monotonic()
+        for path in iter_files(self.paths):
+            if self._cancel_event.is_set():
+                return
+            try:
+                batch.append((path, detect_format(path), os.path.getsize(path)))
+            except OSError as e:
+                print(f"Skipping {path}: {e}")
+            if batch and (len(batch) >= self.BATCH_SIZE or time.monotonic() - sent >= self.BATCH_SECONDS):
+                self.signals.found.emit(self.generation, batch)
+                batch = []
+                sent = time.monotonic()
+        if batch:
+            self.signals.found.emit(self.generation, batch)
+        self.signals.finished.emit(self.generation)
+
+
+class ThumbnailSignals(QObject):
+    """Signals emitted by a ThumbnailWorker."""
+    ready = Signal(str, QImage)   # source path, thumbnail (null if there is no preview)
+
+
+class ThumbnailWorker(QRunnable):
+    """Render or load a cached thumbnail on a QThreadPool thread."""
+
+    def __init__(self, file_path: str, size: int):
+        super().__init__()
+        self.file_path = file_path
+        self.size = size
+        self.signals = ThumbnailSignals()
+        self.setAutoDelete(False)
+
+    def run(self) -> None:
+        from convertions.thumbnails import get_thumbnail
+
+        image = QImage()
+        try:
+            thumbnail_path = get_thumbnail(self.file_path, self.size)
+            if thumbnail_path:
+                # QImage, unlike QPixmap, may be created off the GUI thread
+                image = QImage(thumbnail_path)
+        except Exception as e:
+            print(f"Thumbnail failed for {self.file_path}: {e}")
+        self.signals.ready.emit(self.file_path, image)
@@ -1,19 +1,99 @@
 from PySide6.QtWidgets import (
     QWidget, QVBoxLayout, QHBoxLayout, QLabel, QPushButton,
-    QComboBox, QLineEdit, QFileDialog, QMessageBox
+    QComboBox, QLineEdit, QFileDialog, QMessageBox, QProgressBar
 )
-from PySide6.QtCore import Qt
-from PySide6.QtGui import QPixmap
-from PIL import Image
+from PySide6.QtCore import Qt, QThreadPool, QTimer
+from PySide6.QtGui import QIntValidator, QPixmap
 import os
-import imghdr
-from io import BytesIO
 
-from convertions.documents import convert_document, DOCUMENT_FORMATS
-from convertions.images import convert_image
+from conversion_worker import ConversionWorker, EstimateWorker
+from convertions.registry import TARGET_FORMATS, conversion_targets
+from convertions.sniff import TARGET_SIZE_FORMATS, extension_format, format_kind, sniff_file
+from thumbnail_service import thumbnail_service
+
+CONVERSION_FORMATS = [fmt.upper() for fmt in TARGET_FORMATS]
+PREVIEW_SIZE = 100
+# Processes used to parse PDF pages in parallel
+DOCUMENT_WORKERS = min(4, os.cpu_count() or 1)
+# Wait this long after the last option change before estimating
+ESTIMATE_DEBOUNCE_MS = 250
+
+
+class ConversionProgressRow(QWidget):
+    """A single in-flight conversion: file name, progress bar and cancel button."""
+
+    def __init__(self, worker: ConversionWorker, parent=None):
+        super().__init__(parent)
+        self.worker = worker
+
+        layout = QHBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+
+        self.name_label = QLabel(os.path.basename(worker.output_path))
+        self.name_label.setStyleSheet("color: #FFFFFF; font-size: 13px; background-color: transparent;")
+
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setRange(0, 100)
+        self.progress_bar.setStyleSheet("""
+            QProgressBar {
+                background-color: #333;
+                color: white;
+                border-radius: 5px;
+                text-align: center;
+            }
+            QProgressBar::chunk {
+                background-color: #FF8800;
+                border-radius: 5px;
+            }
+        """)
+
+        self.status_label = QLabel("Queued")
+        self.status_label.setStyleSheet("color: #888; font-size: 13px; background-color: transparent;")
+
+        self.cancel_button = QPushButton("Cancel")
+        self.cancel_button.setStyleSheet("background-color: #333; color: #FF8800; padding: 3px 10px; border-radius: 5px;")
+        self.cancel_button.setCursor(Qt.CursorShape.PointingHandCursor)
+        self.cancel_button.clicked.connect(self.cancel)
+
+        layout.addWidget(self.name_label, 2)
+        layout.addWidget(self.progress_bar, 3)
+        layout.addWidget(self.status_label, 2)
+        layout.addWidget(self.cancel_button)
+
+        worker.signals.progress.connect(self.on_progress)
+        worker.signals.finished.connect(self.on_finished)
+        worker.signals.failed.connect(self.on_failed)
+        worker.signals.cancelled.connect(self.on_cancelled)
+
+    def cancel(self) -> None:
+        self.worker.cancel()
+        self.cancel_button.setEnabled(False)
+        self.status_label.setText("Cancelling...")
+
+    def on_progress(self, percent: int) -> None:
+        self.progress_bar.setValue(percent)
+        if not self.worker.is_cancelled():
+            self.status_label.setText("Converting...")
+
+    def on_finished(self, output_path: str) -> None:
+        self.progress_bar.setValue(100)
+        self.status_label.setText("Done")
+        tooltip = f"{output_path}\n{self.worker.summary}" if self.worker.summary else output_path
+        self.status_label.setToolTip(tooltip)
+        self.cancel_button.setVisible(False)
+
+    def on_failed(self, message: str, missing_library: bool) -> None:
+        if missing_library:
+            message = f"{message}\nPlease install the required library."
+        self.status_label.setText("Missing library" if missing_library else "Failed")
+        self.status_label.setStyleSheet("color: #FF4444; font-size: 13px; background-color: transparent;")
+        self.status_label.setToolTip(message)
+        self.cancel_button.setVisible(False)
+
+    def on_cancelled(self) -> None:
+        self.status_label.setText("Cancelled")
+        self.cancel_button.setVisible(False)
 
-SUPPORTED_FORMATS = ['png', 'jpg', 'jpeg', 'gif', 'bmp', 'webp', 'pdf', 'doc', 'docx']
-CONVERSION_FORMATS = ['PNG', 'JPG', 'WEBP', 'GIF', 'BMP', 'PDF', 'DOCX']
 
 class ConversionScreen(QWidget):
     def __init__(self, go_back_callback=None):
@@ -25,6 +105,7 @@ class ConversionScreen(QWidget):
         # File attributes
         self.file_path: str = ""
         self.file_format: str = ""
+        self.file_kind: str = ""
         self.file_size: int = 0
         self.output_directory: str = ""
 
@@ -121,9 +202,34 @@ class ConversionScreen(QWidget):
         self.size_layout.addWidget(self.size_label)
         self.size_layout.addWidget(self.size_combo)
 
+        # Page selection, only shown for PDF sources
+        self.pages_layout = QVBoxLayout()
+        self.pages_label = QLabel("Pages:")
+        self.pages_label.setStyleSheet("color: #3c83cf; font-size: 15px; margin-bottom: -14px; margin-left: -10px;")
+        self.pages_input = QLineEdit()
+        self.pages_input.setPlaceholderText("All (e.g. 1-3, 7)")
+        self.pages_input.setStyleSheet("background-color: #333; color: white;")
+        self.pages_layout.addWidget(self.pages_label)
+        self.pages_layout.addWidget(self.pages_input)
+        self.pages_label.setVisible(False)
+        self.pages_input.setVisible(False)
+
+        # Target file size, only used for JPG and WEBP outputs
+        self.max_size_layout = QVBoxLayout()
+        self.max_size_label = QLabel("Max Size (KB):")
+        self.max_size_label.setStyleSheet("color: #3c83cf; font-size: 15px; margin-bottom: -14px; margin-left: -10px;")
+        self.max_size_input = QLineEdit()
+        self.max_size_input.setPlaceholderText("Any")
+        self.max_size_input.setValidator(QIntValidator(1, 10 ** 9, self))
+        self.max_size_input.setStyleSheet("background-color: #333; color: white;")
+        self.max_size_layout.addWidget(self.max_size_label)
+        self.max_size_layout.addWidget(self.max_size_input)
+
         self.output_layout.addLayout(self.format_layout)
         self.output_layout.addLayout(self.output_name_layout)
         self.output_layout.addLayout(self.size_layout)
+        self.output_layout.addLayout(self.pages_layout)
+        self.output_layout.addLayout(self.max_size_layout)
         self.wrapper_layout.addLayout(self.output_layout)
 
         self.layout.addWidget(self.wrapper_container)
@@ -191,8 +297,28 @@ class ConversionScreen(QWidget):
         self.convert_layout.addWidget(self.file_source, 1)
         self.layout.addLayout(self.convert_layout)
 
-        # Update estimated file size when the size selection changes
+        # One progress row per conversion in flight
+        self.jobs_layout = QVBoxLayout()
+        self.jobs_layout.setSpacing(5)
+        self.layout.addLayout(self.jobs_layout)
+        self.thread_pool = QThreadPool.globalInstance()
+
+        # Estimates run in the background, debounced, and only the newest one is shown
+        self.estimate_generation = 0
+        self.estimate_worker = None
+        self.estimate_timer = QTimer(self)
+        self.estimate_timer.setSingleShot(True)
+        self.estimate_timer.setInterval(ESTIMATE_DEBOUNCE_MS)
+        self.estimate_timer.timeout.connect(self.start_estimate)
+
+        # Previews are rendered in the background and shown when ready
+        self.thumbnails = thumbnail_service()
+        self.thumbnails.thumbnail_ready.connect(self.on_thumbnail_ready)
+
+        # Update estimated file size when the size or format selection changes
         self.size_combo.currentIndexChanged.connect(self.update_estimated_file_size)
+        self.desired_format.currentIndexChanged.connect(self.update_estimated_file_size)
+        self.desired_format.currentIndexChanged.connect(self.update_max_size_input)
 
     def _combo_box_style(self) -> str:
         """Return the common style for combo boxes."""
@@ -224,46 +350,69 @@ class ConversionScreen(QWidget):
 
     def set_file(self, file_path: str) -> None:
         """Set the file path and update UI elements accordingly."""
+        self.reset()
         self.file_path = file_path
-        self.file_format = self.detect_file_format(file_path)
+        info = self.detect_file_format(file_path)
         file_name = os.path.basename(file_path)
         self.file_size = os.path.getsize(file_path)
-        formatted_size = self.format_file_size(self.file_size)
-        self.file_name_label.setText(f"{file_name}\n{formatted_size}")
+        details = self.format_file_size(self.file_size)
+        if info is not None and info.width and info.height:
+            details = f"{details} - {info.width} x {info.height}"
+        self.file_name_label.setText(f"{file_name}\n{details}")
         self.update_format_options()
         self.show_preview()
         self.update_output_name()
         self.update_estimated_file_size()
 
-    def detect_file_format(self, file_path: str) -> str:
-        """Detect file format using the file extension and imghdr."""
-        _, ext = os.path.splitext(file_path)
-        ext = ext.lower().lstrip('.')
-        if ext in SUPPORTED_FORMATS:
-            detected = imghdr.what(file_path)
-            return detected if detected else ext
-        return ext
+    def reset(self) -> None:
+        """Put the options back to their defaults so the screen can be reused for another file."""
+        self.cancel_estimate()
+        self.output_directory = ""
+        self.max_size_input.clear()
+        for combo in (self.file_source, self.size_combo):
+            combo.blockSignals(True)
+            combo.setCurrentIndex(0)
+            combo.blockSignals(False)
+        # Rows of conversions still running stay visible
+        for index in reversed(range(self.jobs_layout.count())):
+            row = self.jobs_layout.itemAt(index).widget()
+            if row is not None and row.cancel_button.isHidden():
+                self.jobs_layout.removeWidget(row)
+                row.deleteLater()
+
+    def detect_file_format(self, file_path: str):
+        """
+        Detect the file format from its content, falling back to the extension.
+        Returns the sniffed info (with image dimensions), or None if unknown.
+        """
+        try:
+            info = sniff_file(file_path)
+        except OSError:
+            info = None
+        self.file_format = info.format if info else extension_format(file_path)
+        self.file_kind = format_kind(self.file_format) or ""
+        return info
 
     def update_format_options(self) -> None:
         """Update the desired format options based on the file type."""
         self.desired_format.clear()
         
-        # Handle image formats
-        if self.file_format in ['png', 'jpg', 'jpeg', 'gif', 'bmp', 'webp']:
-            current_format = 'jpg' if self.file_format in ['jpg', 'jpeg'] else self.file_format
-            formats = [fmt.upper() for fmt in ['png', 'jpg', 'webp', 'gif', 'bmp'] 
-                      if fmt.lower() != current_format]
-            self.desired_format.addItems(formats)
-        
-        # Handle document formats
-        elif self.file_format in ['pdf', 'doc', 'docx']:
-            if self.file_format == 'pdf':
-                self.desired_format.addItems(['DOCX'])
-            elif self.file_format in ['doc', 'docx']:
-                self.desired_format.addItems(['PDF'])
+        self.desired_format.addItems([fmt.upper() for fmt in conversion_targets(self.file_format)])
+
+        is_pdf = self.file_format == 'pdf'
+        self.pages_label.setVisible(is_pdf)
+        self.pages_input.setVisible(is_pdf)
+        self.pages_input.clear()
+        self.update_max_size_input()
         
         self.update_output_name()
 
+    def update_max_size_input(self) -> None:
+        """Only formats with a quality setting can be encoded to a target size."""
+        supported = self.desired_format.currentText().lower() in TARGET_SIZE_FORMATS
+        self.max_size_label.setVisible(supported)
+        self.max_size_input.setVisible(supported)
+
     def update_output_name(self) -> None:
         """Update the output name field based on selected options."""
         if not self.file_path:
@@ -275,13 +424,14 @@ class ConversionScreen(QWidget):
 
     def show_preview(self) -> None:
         """Display a preview of the file if supported."""
-        if self.file_format in ['png', 'jpg', 'jpeg', 'gif', 'bmp', 'webp']:
-            # Handle image preview
-            pixmap = QPixmap(self.file_path)
-            pixmap = pixmap.scaled(100, 100, Qt.AspectRatioMode.KeepAspectRatio, 
-                                Qt.TransformationMode.SmoothTransformation)
-            self.image_preview.setPixmap(pixmap)
-        elif self.file_format in ['pdf', 'doc', 'docx']:
+        if self.file_kind == 'image' or self.file_format == 'pdf':
+            # Handle image and PDF first-page previews, decoded off the GUI thread
+            pixmap = self.thumbnails.request(self.file_path)
+            if pixmap is not None:
+                self.set_preview(pixmap)
+            else:
+                self.image_preview.clear()
+        elif self.file_kind == 'document':
             # Show document icon instead of preview
             document_icon = QPixmap("document-icon.png")  # Create this icon file
             if not document_icon.isNull():
@@ -296,6 +446,18 @@ class ConversionScreen(QWidget):
         else:
             self.image_preview.clear()
 
+    def set_preview(self, pixmap: QPixmap) -> None:
+        pixmap = pixmap.scaled(PREVIEW_SIZE, PREVIEW_SIZE, Qt.AspectRatioMode.KeepAspectRatio,
+                               Qt.TransformationMode.SmoothTransformation)
+        self.image_preview.setPixmap(pixmap)
+
+    def on_thumbnail_ready(self, file_path: str) -> None:
+        if file_path != self.file_path:
+            return
+        pixmap = self.thumbnails.request(file_path)
+        if pixmap is not None:
+            self.set_preview(pixmap)
+
     def format_file_size(self, size_bytes: int) -> str:
         """Return a human-readable file size."""
         if size_bytes < 1024:
@@ -306,70 +468,84 @@ class ConversionScreen(QWidget):
 
     def update_estimated_file_size(self) -> None:
         """
-        Estimate the output file size and update the file size label.
+        Schedule an output size estimate and update the file size label.
         For documents, show actual file size only.
         """
         if not self.file_path:
             return
-        
-        if self.file_format in ['png', 'jpg', 'jpeg', 'gif', 'bmp', 'webp']:
-            try:
-                scale = float(self.size_combo.currentText())
-                img = Image.open(self.file_path)
-                new_width = int(img.width * scale)
-                new_height = int(img.height * scale)
-                resized_img = img.resize((new_width, new_height), Image.LANCZOS)
-                buffer = BytesIO()
-                target_format = self.desired_format.currentText().lower() if self.desired_format.currentText() else self.file_format
-                save_format = target_format.upper()
-                resized_img.save(buffer, format=save_format)
-                estimated_size = buffer.tell()
-                formatted_size = self.format_file_size(estimated_size)
-                self.file_size_label.setText(f"Estimated File Size: {formatted_size}")
-            except Exception as e:
-                self.file_size_label.setText("Estimated File Size: N/A")
-                print("Error estimating file size:", e)
+
+        self.cancel_estimate()
+        # The estimator samples image encodes; other targets show the input size
+        if self.file_kind == 'image' and format_kind(self.desired_format.currentText().lower()) == 'image':
+            self.file_size_label.setText("Estimated File Size: ...")
+            self.estimate_timer.start()
         else:
             # For document files, just show the original size
             formatted_size = self.format_file_size(self.file_size)
             self.file_size_label.setText(f"File Size: {formatted_size}")
 
+    def cancel_estimate(self) -> None:
+        """Drop any pending or running estimate, its result is stale now."""
+        self.estimate_timer.stop()
+        self.estimate_generation += 1
+        if self.estimate_worker is not None:
+            self.estimate_worker.cancel()
+            self.thread_pool.tryTake(self.estimate_worker)
+            self.estimate_worker = None
+
+    def start_estimate(self) -> None:
+        """Run the estimate for the current options on the thread pool."""
+        target_format = self.desired_format.currentText().lower()
+        if not self.file_path or not target_format:
+            return
+        scale = float(self.size_combo.currentText())
+        worker = EstimateWorker(self.estimate_generation, self.file_path, scale, target_format)
+        worker.signals.estimated.connect(self.on_estimate_ready)
+        worker.signals.failed.connect(self.on_estimate_failed)
+        self.estimate_worker = worker
+        self.thread_pool.start(worker)
+
+    def on_estimate_ready(self, generation: int, estimate) -> None:
+        if generation != self.estimate_generation:
+            return
+        self.estimate_worker = None
+        if estimate.exact:
+            self.file_size_label.setText(f"Estimated File Size: {self.format_file_size(estimate.size)}")
+            self.file_size_label.setToolTip("")
+        else:
+            self.file_size_label.setText(f"Estimated File Size: ~{self.format_file_size(estimate.size)}")
+            self.file_size_label.setToolTip(
+                f"Likely between {self.format_file_size(estimate.low)} and {self.format_file_size(estimate.high)}"
+            )
+
+    def on_estimate_failed(self, generation: int, message: str) -> None:
+        if generation != self.estimate_generation:
+            return
+        self.estimate_worker = None
+        self.file_size_label.setText("Estimated File Size: N/A")
+        self.file_size_label.setToolTip(message)
+
     def convert_file(self) -> None:
-        """Perform the file conversion based on file type."""
+        """Start the conversion on a worker thread and track it in a progress row."""
         if not self.file_path:
             QMessageBox.warning(self, "No File", "Please select a file to convert.")
             return
 
-        try:
-            target_format = self.desired_format.currentText().lower()
-            output_path = self.get_output_path(target_format)
-            
-            # Handle image conversion
-            if self.file_format in ['png', 'jpg', 'jpeg', 'gif', 'bmp', 'webp']:
-                scale = float(self.size_combo.currentText())
-                img = Image.open(self.file_path)
-                new_width = int(img.width * scale)
-                new_height = int(img.height * scale)
-                resized_img = img.resize((new_width, new_height), Image.LANCZOS)
-                
-                # Convert mode if needed for JPEG output
-                if resized_img.mode == 'RGBA' and target_format in ['jpg', 'jpeg']:
-                    resized_img = resized_img.convert('RGB')
-                    
-                resized_img.save(output_path)
-            
-            # Handle document conversion
-            elif self.file_format in ['pdf', 'doc', 'docx']:
-                # Use the imported document conversion function
-                convert_document(self.file_path, output_path, target_format)
-            
-            QMessageBox.information(self, "Success", f"Conversion successful:\n{output_path}")
-        
-        except ImportError as e:
-            QMessageBox.warning(self, "Missing Library", 
-                               f"{str(e)}\n\nPlease install the required library.")
-        except Exception as e:
-            QMessageBox.critical(self, "Error", f"Conversion failed: {str(e)}")
+        target_format = self.desired_format.currentText().lower()
+        if not target_format:
+            QMessageBox.warning(self, "No Format", "No conversion is available for this file.")
+            return
+        output_path = self.get_output_path(target_format)
+        scale = float(self.size_combo.currentText())
+        max_size = self.max_size_input.text().strip()
+        max_bytes = int(max_size) * 1024 if max_size and target_format in TARGET_SIZE_FORMATS else 0
+
+        worker = ConversionWorker(self.file_path, output_path, self.file_format, target_format, scale,
+                                  page_range=self.pages_input.text(), workers=DOCUMENT_WORKERS,
+                                  max_bytes=max_bytes)
+        row = ConversionProgressRow(worker)
+        self.jobs_layout.addWidget(row)
+        self.thread_pool.start(worker)
 
     def get_output_path(self, target_format: str) -> str:
         """
@@ -405,6 +581,6 @@ class ConversionScreen(QWidget):
         else:
             # Fallback: try to get the main window from the widget tree.
             main_window = self.window()
-            if hasattr(main_window, 'drop_label'):
-                main_window.setCentralWidget(main_window.drop_label)
+            if hasattr(main_window, 'show_drop_screen'):
+                main_window.show_drop_screen()
 
@@ -0,0 +1,267 @@
+"""
+Memory-budget admission control for concurrent conversions.
+
+Before a job starts, its peak memory is estimated from the file header
+alone: dimensions and mode for images (sniff_file), the frame count of
+animations and the page count of PDFs. The estimate follows what the
+engine will actually allocate: draft decoding for JPEG, the frames of the
+cheapest resize/flatten plan, the band budget of tiled conversion, the
+streaming pipeline of libvips and the frame window of animations.
+
+AdmissionQueue admits waiting jobs while their estimates fit under a
+global budget, first-fit in submission order, so small jobs are packed
+around large ones. A large job that does not fit yet is bypassed by
+smaller ones at most max_bypass times before it holds the queue until it
+fits, and a job larger than the whole budget runs alone. The queue is
+driven from one dispatching thread (or event loop) and does no locking.
+
+set_pixel_limit() derives Pillow's decompression-bomb limit from the same
+budget, so an image whose decoded frame alone would not fit is refused by
+Image.open() instead of being decoded. Band conversion and libvips hold
+far less than Pillow's whole-frame pipeline, and a job over the budget
+runs alone anyway, so they run under no_pixel_limit().
+"""
+from collections import deque
+from contextlib import contextmanager
+import os
+import warnings
+
+from PIL import Image
+
+from convertions.images import OPAQUE_FORMATS, REDUCING_GAP, scaled_size
+from convertions.pipeline import frame_bytes, plan_pipeline
+from convertions.sniff import canonical_format, format_kind, sniff_file
+from convertions.textdocs import streams
+
+# Interpreter scratch, codec buffers and the like, per job
+JOB_BASE_BYTES = 16 * 1024 * 1024
+# Working memory per output pixel of encoders that take the whole frame at
+# once, on either backend (measured): libwebp's ARGB and YUV pictures, and
+# with alpha its lossless coder for the alpha plane; GIF quantization; the
+# compressed PDF image stream
+ENCODER_PIXEL_BYTES = {'webp': 11, 'gif': 11, 'pdf': 4}
+ALPHA_ENCODER_PIXEL_BYTES = {'webp': 28}
+# libvips holds a few strips per thread; its WEBP loader decodes whole frames
+VIPS_PIPELINE_BYTES = 64 * 1024 * 1024
+# pdf2docx: measured about 16 MB plus 2 MB per text page, doubled for
+# pages with images, plus the file itself several times over
+PDF_BASE_BYTES = 32 * 1024 * 1024
+PDF_PAGE_BYTES = 4 * 1024 * 1024
+PDF_FILE_COPIES = 4
+# Word and LibreOffice run in their own processes; only the hand-off counts
+DOCUMENT_BASE_BYTES = 32 * 1024 * 1024
+# The streaming converters of convertions.textdocs peak at about 25 MB
+# (measured on a 195 MB log and a 79 MB RTF), whatever the input size
+TEXT_STREAM_BYTES = 32 * 1024 * 1024
+
+# Sources that stream band by band in tiled conversion
+STREAMED_BAND_FORMATS = ['bmp']
+
+# How often a job that does not fit may be overtaken by smaller ones
+DEFAULT_MAX_BYPASS = 8
+
+
+def _frame_count(input_path, source_format, target_format):
+    """Frames that will be converted: 1 unless an animation stays animated."""
+    from convertions.animation import ANIMATION_FORMATS
+    if source_format not in ('gif', 'webp', 'png') or target_format not in ANIMATION_FORMATS:
+        return 1
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', Image.DecompressionBombWarning)
+            with Image.open(input_path) as img:
+                return getattr(img, 'n_frames', 1)
+    except (OSError, Image.DecompressionBombError):
+        return 1
+
+
+def _draft_size(source_format, size, output_size, scale):
+    """The size a JPEG decodes at with draft(), as open_image() requests it."""
+    if source_format != 'jpg' or scale >= 1.0:
+        return size
+    width, height = size
+    for factor in (8, 4, 2):
+        if width // factor >= output_size[0] * REDUCING_GAP and height // factor >= output_size[1] * REDUCING_GAP:
+            return -(-width // factor), -(-height // factor)
+    return size
+
+
+def _encoder_bytes(target_format, output_size, alpha):
+    pixel_bytes = ALPHA_ENCODER_PIXEL_BYTES if alpha else ENCODER_PIXEL_BYTES
+    return output_size[0] * output_size[1] * pixel_bytes.get(target_format, ENCODER_PIXEL_BYTES.get(target_format, 0))
+
+
+def _pillow_bytes(mode, source_format, size, output_size, target_format, scale):
+    """Peak of convert_image on Pillow: the decoded frame stays alive while the pipeline runs."""
+    decoded_size = _draft_size(source_format, size, output_size, scale)
+    # A palette or grey image may carry a transparent colour, plan for it
+    transparent = mode in ('RGBA', 'LA', 'PA', 'P')
+    plan = plan_pipeline(mode, transparent, decoded_size, output_size, target_format)
+    frames = [frame_bytes(step.mode, step.size) for step in plan.steps]
+    pipeline = max([frames[0]] + [frames[0] + frames[index] + (frames[index - 1] if index > 1 else 0)
+                                  for index in range(1, len(frames))])
+    encode = frames[0] + frames[-1] + _encoder_bytes(target_format, output_size, 'A' in plan.steps[-1].mode)
+    return max(pipeline, encode)
+
+
+def _image_bytes(input_path, info, target_format, scale, memory_limit):
+    from convertions.animation import FRAMES_PER_WORKER
+    from convertions.tiled import TILED_FORMATS
+    from convertions.vips import choose_backend
+
+    width, height, mode = info.width, info.height, info.mode or 'RGBA'
+    if width is None:
+        # The header did not say; let Pillow read it
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', Image.DecompressionBombWarning)
+                with Image.open(input_path) as img:
+                    (width, height), mode = img.size, img.mode
+        except (OSError, Image.DecompressionBombError):
+            return 0
+    size = (width, height)
+    output_size = scaled_size(width, height, scale)
+    source_frame = frame_bytes(mode, size)
+
+    frames = _frame_count(input_path, info.format, target_format)
+    if frames > 1:
+        # convert_animation keeps a window of RGBA frames in flight per worker thread
+        window = (os.cpu_count() or 1) * FRAMES_PER_WORKER
+        return (window + 2) * frame_bytes('RGBA', size) + window * frame_bytes('RGBA', output_size)
+    if choose_backend(mode, width, height, target_format) == 'vips':
+        alpha = mode in ('LA', 'RGBA') and target_format not in OPAQUE_FORMATS
+        return (VIPS_PIPELINE_BYTES + (2 * source_frame if info.format == 'webp' else 0)
+                + _encoder_bytes(target_format, output_size, alpha))
+    if memory_limit and target_format in TILED_FORMATS:
+        # Bands fit in memory_limit; sources that cannot stream are decoded whole first
+        return memory_limit + (0 if info.format in STREAMED_BAND_FORMATS else source_frame)
+    return _pillow_bytes(mode, info.format, size, output_size, target_format, scale)
+
+
+def _pdf_bytes(input_path, page_range=""):
+    from convertions.documents import parse_page_range, pdf_page_count
+    try:
+        page_count = pdf_page_count(input_path)
+        if page_range:
+            page_count = len(parse_page_range(page_range, page_count))
+    except (ImportError, OSError, ValueError, RuntimeError):
+        # Unreadable here means unreadable in the worker too, it will fail fast
+        page_count = 1
+    return PDF_BASE_BYTES + page_count * PDF_PAGE_BYTES + PDF_FILE_COPIES * os.path.getsize(input_path)
+
+
+def estimate_memory(input_path, target_format, scale=1.0, memory_limit=None, page_range=""):
+    """
+    Estimate the peak memory in bytes of converting input_path to
+    target_format, from its header. memory_limit is the band budget of
+    tiled conversion, page_range the PDF pages converted.
+    """
+    target_format = canonical_format(target_format)
+    try:
+        info = sniff_file(input_path)
+    except OSError:
+        info = None
+    if info is None:
+        return JOB_BASE_BYTES
+
+    if info.kind == 'image':
+        if format_kind(target_format) == 'image':
+            return JOB_BASE_BYTES + _image_bytes(input_path, info, target_format, scale, memory_limit)
+        # Routed through a PDF page; a DOCX is then parsed from that page,
+        # whose image PyMuPDF decodes again
+        estimate = _image_bytes(input_path, info, 'pdf', scale, None)
+        if target_format != 'pdf':
+            estimate = PDF_BASE_BYTES + PDF_PAGE_BYTES + estimate
+        return JOB_BASE_BYTES + estimate
+    if info.format == 'pdf':
+        return JOB_BASE_BYTES + _pdf_bytes(input_path, page_range)
+    if streams(info.format, target_format):
+        return JOB_BASE_BYTES + TEXT_STREAM_BYTES
+    return JOB_BASE_BYTES + DOCUMENT_BASE_BYTES + PDF_FILE_COPIES * os.path.getsize(input_path)
+
+
+def set_pixel_limit(budget):
+    """
+    Set Pillow's decompression-bomb limits from a memory budget in bytes:
+    Image.open() warns when a decoded RGBA frame would take half the
+    budget and refuses it when it would take all of it.
+    """
+    # Pillow warns above MAX_IMAGE_PIXELS and raises above twice that
+    Image.MAX_IMAGE_PIXELS = max(1, budget // (2 * 4))
+
+
+@contextmanager
+def no_pixel_limit():
+    """Lift Pillow's pixel limit, for the engines it does not describe (bands, libvips)."""
+    limit = Image.MAX_IMAGE_PIXELS
+    Image.MAX_IMAGE_PIXELS = None
+    try:
+        yield
+    finally:
+        Image.MAX_IMAGE_PIXELS = limit
+
+
+class AdmissionQueue:
+    """Jobs waiting for memory, admitted while their estimates fit in budget bytes."""
+
+    def __init__(self, budget=None, max_bypass=DEFAULT_MAX_BYPASS):
+        # None admits everything, so callers need no separate path without a budget
+        self.budget = budget
+        self.max_bypass = max_bypass
+        self.in_use = 0
+        self.running = 0
+        self.peak = 0
+        self.solo = 0   # jobs over the whole budget that ran alone and succeeded
+        # [job, cost, times bypassed]
+        self._waiting = deque()
+
+    def __len__(self):
+        return len(self._waiting)
+
+    def add(self, job, cost):
+        self._waiting.append([job, cost, 0])
+
+    def _fits(self, cost):
+        if self.budget is None or self.in_use + cost <= self.budget:
+            return True
+        # Larger than the whole budget: it runs, alone
+        return cost > self.budget and self.running == 0
+
+    def admit(self, slots=None):
+        """
+        Remove and return [(job, cost)] for the waiting jobs that may start
+        now, at most slots of them.
+        """
+        admitted = []
+        blocked = None
+        for entry in list(self._waiting):
+            if slots is not None and len(admitted) >= slots:
+                break
+            job, cost, _ = entry
+            if not self._fits(cost):
+                if blocked is None:
+                    blocked = entry
+                continue
+            if blocked is not None:
+                if blocked[2] >= self.max_bypass:
+                    # Hold the queue until the blocked job fits
+                    break
+                blocked[2] += 1
+            self._waiting.remove(entry)
+            self.in_use += cost
+            self.running += 1
+            self.peak = max(self.peak, self.in_use)
+            admitted.append((job, cost))
+            if self.budget is not None and cost > self.budget:
+                break
+        return admitted
+
+    def release(self, cost, succeeded=False):
+        """
+        A job admitted with cost finished. Jobs over the whole budget are
+        counted in solo once they succeeded.
+        """
+        self.in_use -= cost
+        self.running -= 1
+        if succeeded and self.budget is not None and cost > self.budget:
+            self.solo += 1
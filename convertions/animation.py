@@ -0,0 +1,281 @@
+"""
+Frame-by-frame conversion of animated GIF, WEBP and APNG.
+
+Pillow's multi-frame writers collect every frame before writing, so a long
+animation would be materialised in memory. Here frames are decoded one at
+a time, prepared on a thread pool with at most a small window of frames in
+flight, and handed to a writer that streams them to disk:
+
+    GIF  - each frame is resized, quantized to its own palette and
+           LZW-encoded on the pool, then written as it arrives
+    APNG - each frame is resized and PNG-encoded on the pool, and its
+           IDAT data is rewrapped as an fdAT chunk
+    WEBP - frames are resized on the pool; libwebp's animation encoder
+           is sequential, so it pulls them one by one
+
+Frame durations and the loop count of the source are kept.
+"""
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+import os
+import struct
+import zlib
+
+from PIL import GifImagePlugin, Image
+
+from convertions.images import resize_image, scaled_size
+from convertions.instrument import stage
+from convertions.progress import report_progress
+
+# Targets that can hold an animation ('png' is written as APNG)
+ANIMATION_FORMATS = ['gif', 'webp', 'png']
+# Frames in flight per worker; bounds memory to a few frames
+FRAMES_PER_WORKER = 2
+# GIF palette index reserved for transparent pixels
+GIF_TRANSPARENT_INDEX = 255
+
+
+def is_animated(input_path):
+    """True if input_path has more than one frame."""
+    with Image.open(input_path) as img:
+        return getattr(img, 'is_animated', False)
+
+
+def _source_frames(img):
+    """Yield (RGBA frame, duration in ms) for every frame, decoding one at a time."""
+    for index in range(img.n_frames):
+        img.seek(index)
+        # convert() copies, so the frame stays valid after the next seek
+        yield img.convert('RGBA'), img.info.get('duration', 0)
+
+
+def _pipelined(frames, work, executor, window):
+    """
+    Run work(frame, duration) on executor for each frame and yield
+    (result, duration) in order, with at most window frames in flight.
+    """
+    pending = deque()
+    for frame, duration in frames:
+        pending.append((executor.submit(work, frame, duration), duration))
+        if len(pending) >= window:
+            future, duration = pending.popleft()
+            yield future.result(), duration
+    while pending:
+        future, duration = pending.popleft()
+        yield future.result(), duration
+
+
+def _gif_palette_frame(frame):
+    """Quantize an RGBA frame to a palette, with one index kept for transparency."""
+    transparent = frame.getchannel('A').point(lambda a: 255 if a < 128 else 0)
+    if transparent.getbbox() is None:
+        return frame.convert('RGB').quantize(256)
+    paletted = frame.convert('RGB').quantize(GIF_TRANSPARENT_INDEX)
+    palette = paletted.getpalette()[:GIF_TRANSPARENT_INDEX * 3]
+    paletted.putpalette(palette + [0] * (768 - len(palette)))
+    paletted.paste(GIF_TRANSPARENT_INDEX, mask=transparent)
+    paletted.info['transparency'] = GIF_TRANSPARENT_INDEX
+    return paletted
+
+
+def _png_idat_data(img):
+    """Encode img as PNG and return the concatenated payload of its IDAT chunks."""
+    buffer = BytesIO()
+    img.save(buffer, format='PNG')
+    data = buffer.getvalue()
+    payload = []
+    offset = 8
+    while offset < len(data):
+        length, kind = struct.unpack('>I4s', data[offset:offset + 8])
+        if kind == b'IDAT':
+            payload.append(data[offset + 8:offset + 8 + length])
+        offset += 12 + length
+    return b''.join(payload)
+
+
+class _GifWriter:
+    """Write GIF frames as they arrive, each with its own local colour table."""
+
+    def __init__(self, output_path, size, loop):
+        self.size = size
+        self.fp = open(output_path, 'wb')
+        # No global colour table, background index 0, square pixels
+        self.fp.write(b'GIF89a' + struct.pack('<HH', *size) + b'\x00\x00\x00')
+        if loop is not None:
+            self.fp.write(b'!\xff\x0bNETSCAPE2.0\x03\x01' + struct.pack('<H', loop) + b'\x00')
+
+    def prepare(self, frame, duration):
+        """Quantize and LZW-encode one frame; safe to run on a worker thread."""
+        if frame.size != self.size:
+            frame = resize_image(frame, self.size)
+        paletted = _gif_palette_frame(frame)
+        # Every frame covers the whole canvas, so restoring to background is always right
+        params = {'duration': duration, 'disposal': 2, 'include_color_table': True}
+        if 'transparency' in paletted.info:
+            params['transparency'] = paletted.info['transparency']
+        return b''.join(GifImagePlugin.getdata(paletted, (0, 0), **params))
+
+    def write(self, data, duration):
+        # The duration is already in the frame's graphic control extension
+        self.fp.write(data)
+
+    def abort(self):
+        self.fp.close()
+        os.remove(self.fp.name)
+
+    def close(self):
+        self.fp.write(b';')
+        self.fp.close()
+
+
+class _ApngWriter:
+    """Write APNG frames as they arrive; the frame count is needed up front."""
+
+    def __init__(self, output_path, size, frame_count, loop):
+        self.size = size
+        self.sequence = 0
+        self.fp = open(output_path, 'wb')
+        self.fp.write(b'\x89PNG\r\n\x1a\n')
+        self._chunk(b'IHDR', struct.pack('>IIBBBBB', size[0], size[1], 8, 6, 0, 0, 0))
+        # A loop count of None means play once
+        self._chunk(b'acTL', struct.pack('>II', frame_count, 1 if loop is None else loop))
+
+    def _chunk(self, kind, data):
+        self.fp.write(struct.pack('>I', len(data)))
+        self.fp.write(kind)
+        self.fp.write(data)
+        self.fp.write(struct.pack('>I', zlib.crc32(data, zlib.crc32(kind)) & 0xffffffff))
+
+    def prepare(self, frame, duration):
+        """Resize and PNG-encode one frame; safe to run on a worker thread."""
+        if frame.size != self.size:
+            frame = resize_image(frame, self.size)
+        return _png_idat_data(frame)
+
+    def write(self, data, duration):
+        # fcTL: full-canvas frame, delay in milliseconds, no disposal, replace the canvas
+        self._chunk(b'fcTL', struct.pack('>IIIIIHHBB', self.sequence, self.size[0], self.size[1],
+                                         0, 0, min(int(duration), 0xffff), 1000, 0, 0))
+        self.sequence += 1
+        if self.sequence == 1:
+            # The first frame doubles as the still image for non-APNG viewers
+            self._chunk(b'IDAT', data)
+        else:
+            self._chunk(b'fdAT', struct.pack('>I', self.sequence) + data)
+            self.sequence += 1
+
+    def abort(self):
+        self.fp.close()
+        os.remove(self.fp.name)
+
+    def close(self):
+        self._chunk(b'IEND', b'')
+        self.fp.close()
+
+
+class _FrameDurations(list):
+    """Durations that are only known once their frame has been pulled."""
+
+    def __init__(self, frames):
+        super().__init__()
+        self.frames = frames
+
+    def __getitem__(self, index):
+        return self.frames.durations[index]
+
+
+class _LazyFrames(Image.Image):
+    """
+    A multi-frame image whose frames are pulled from an iterator on seek(),
+    so Pillow's animated WEBP writer never holds more than one of them.
+    Only forward seeks are possible.
+    """
+
+    def __init__(self, frames, size, n_frames):
+        super().__init__()
+        self._frames = frames
+        self._mode = 'RGBA'
+        self._size = size
+        self.n_frames = n_frames
+        self.is_animated = n_frames > 1
+        self.durations = []
+        self.position = -1
+        self.seek(0)
+
+    def seek(self, frame):
+        # Pillow seeks back to the first frame when done; nothing to restore
+        if frame <= self.position:
+            return
+        if frame != self.position + 1:
+            raise EOFError("frames can only be read in order")
+        image, duration = next(self._frames)
+        self.im = image.im
+        self.durations.append(duration)
+        self.position = frame
+
+    def tell(self):
+        return self.position
+
+
+def convert_animation(input_path, output_path, target_format, scale=1.0, workers=None,
+                      progress=None, is_cancelled=None):
+    """
+    Convert an animated GIF, WEBP or APNG to target_format ('gif', 'webp'
+    or 'png' for APNG), optionally scaling every frame.
+    progress is called after every frame and is_cancelled is polled
+    between frames.
+    """
+    target_format = target_format.lower()
+    if target_format not in ANIMATION_FORMATS:
+        raise ValueError(f"Unsupported animation format: {target_format}")
+
+    writer = None
+    try:
+        report_progress(progress, 0.0, is_cancelled)
+        with stage('open'):
+            img = Image.open(input_path)
+            frame_count = img.n_frames
+        size = scaled_size(img.width, img.height, scale)
+        # GIF without a NETSCAPE block plays once; WEBP and APNG store 0 for forever
+        loop = img.info.get('loop')
+
+        workers = workers or os.cpu_count() or 1
+        window = workers * FRAMES_PER_WORKER
+        frames = _source_frames(img)
+
+        # Decoding, resizing and encoding overlap frame by frame, so they are one stage
+        with stage('frames'), ThreadPoolExecutor(max_workers=workers) as executor:
+            if target_format == 'webp':
+                resized = _pipelined(frames, lambda frame, _: resize_image(frame, size), executor, window)
+
+                def counted():
+                    for index, item in enumerate(resized):
+                        report_progress(progress, index / frame_count, is_cancelled)
+                        yield item
+
+                sequence = _LazyFrames(counted(), size, frame_count)
+                sequence.save(output_path, format='WEBP', save_all=True,
+                              duration=_FrameDurations(sequence), loop=1 if loop is None else loop)
+            else:
+                if target_format == 'gif':
+                    writer = _GifWriter(output_path, size, loop)
+                else:
+                    writer = _ApngWriter(output_path, size, frame_count, loop)
+                encoded = _pipelined(frames, writer.prepare, executor, window)
+                for index, (data, duration) in enumerate(encoded):
+                    report_progress(progress, index / frame_count, is_cancelled)
+                    writer.write(data, duration)
+                writer.close()
+                writer = None
+
+        report_progress(progress, 1.0)
+        print(f"Converted {frame_count} frames of {input_path}")
+        return True
+
+    except Exception as e:
+        # Pillow removes its own partial WEBP file
+        if writer is not None:
+            writer.abort()
+        print(f"Conversion failed: {e}")
+        raise
@@ -0,0 +1,225 @@
+"""
+Content-addressed cache of conversion outputs.
+
+Entries are keyed by a hash of the input bytes plus the target format and
+every option that changes the output, so renamed or duplicated inputs hit
+the same entry. A hit copies the stored output into place (a reflink on
+filesystems that support it) instead of decoding and encoding again.
+The directory can be shared by several processes: entries are written
+atomically and eviction tolerates files that vanish under it.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+from convertions.instrument import stage
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "kommverters", "conversions")
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+
+# Bump when converters change in a way that changes their output
+# (2: animated sources stay animated, 3: shared resize and flatten pipeline,
+# 4: the image backend is part of the key, 5: band conversion keeps opaque palettes opaque)
+CACHE_VERSION = 5
+
+HASH_CHUNK = 1024 * 1024
+
+# ioctl request that asks the filesystem to share extents (btrfs, XFS)
+FICLONE = 0x40049409
+
+# (realpath, size, mtime_ns) -> content hash, so re-runs skip re-reading inputs
+_hash_memo = {}
+_hash_lock = threading.Lock()
+
+# One ConversionCache per (directory, max_bytes) in each process
+_caches = {}
+
+
+def content_hash(path):
+    """Return the BLAKE2b hex digest of a file's bytes, memoized per (path, size, mtime)."""
+    stat = os.stat(path)
+    memo_key = (os.path.realpath(path), stat.st_size, stat.st_mtime_ns)
+    with _hash_lock:
+        if memo_key in _hash_memo:
+            return _hash_memo[memo_key]
+
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(HASH_CHUNK)
+            if not chunk:
+                break
+            digest.update(chunk)
+    value = digest.hexdigest()
+
+    with _hash_lock:
+        _hash_memo[memo_key] = value
+    return value
+
+
+def copy_file(source, destination):
+    """Copy source to destination, sharing extents with a reflink when possible."""
+    try:
+        import fcntl
+        with open(source, 'rb') as src, open(destination, 'wb') as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+        return
+    except (ImportError, OSError):
+        pass
+    shutil.copyfile(source, destination)
+
+
+class ConversionCache:
+    """A size-bounded, least-recently-used cache of converted files on disk."""
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._total_bytes = sum(size for _, size, _ in self._entries())
+
+    def key(self, input_path, target_format, **options):
+        """Build the cache key for converting input_path with these settings."""
+        settings = json.dumps(
+            {'version': CACHE_VERSION, 'format': target_format.lower(), 'options': options},
+            sort_keys=True, default=str
+        )
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(content_hash(input_path).encode())
+        digest.update(settings.encode())
+        return digest.hexdigest()
+
+    def _path(self, key):
+        # Two-level fan-out keeps directories small
+        return os.path.join(self.directory, key[:2], key)
+
+    def _entries(self):
+        """Yield (path, size, last_used) for every stored entry."""
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                if name.startswith('.'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield path, stat.st_size, stat.st_mtime
+
+    def fetch(self, key, output_path):
+        """Copy a cached output to output_path. Returns True on a hit."""
+        path = self._path(key)
+        try:
+            copy_file(path, output_path)
+            # mtime doubles as the last-used time for LRU eviction
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return False
+        with self._lock:
+            self.hits += 1
+        return True
+
+    def lookup(self, key):
+        """Return the path of the stored entry for key, or None on a miss."""
+        path = self._path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return path
+
+    def store(self, key, output_path):
+        """Add a freshly converted output to the cache and return the stored path."""
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        os.close(fd)
+        try:
+            copy_file(output_path, temp_path)
+            try:
+                replaced = os.path.getsize(path)
+            except FileNotFoundError:
+                replaced = 0
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        with self._lock:
+            self._total_bytes += os.path.getsize(path) - replaced
+            over_budget = self._total_bytes > self.max_bytes
+        if over_budget:
+            self.evict()
+        return path
+
+    def evict(self):
+        """Delete least recently used entries until the cache fits in max_bytes."""
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        with self._lock:
+            self._total_bytes = total
+
+    def clear(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+        os.makedirs(self.directory, exist_ok=True)
+        with self._lock:
+            self._total_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'bytes': self._total_bytes,
+                'max_bytes': self.max_bytes,
+            }
+
+
+def get_cache(directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+    """Return this process's ConversionCache for directory, creating it on first use."""
+    key = (os.path.abspath(directory), max_bytes)
+    with _hash_lock:
+        if key not in _caches:
+            _caches[key] = ConversionCache(directory, max_bytes)
+        return _caches[key]
+
+
+def cached_convert(convert, input_path, output_path, target_format, options=None,
+                   cache=None, bypass=False):
+    """
+    Run convert() unless the cache already holds the output for this input
+    and these settings. Returns True if the output came from the cache.
+    options must contain every setting that changes the output.
+    """
+    if cache is None or bypass:
+        convert()
+        return False
+
+    with stage('cache'):
+        key = cache.key(input_path, target_format, **(options or {}))
+        if cache.fetch(key, output_path):
+            return True
+    convert()
+    with stage('cache'):
+        cache.store(key, output_path)
+    return False
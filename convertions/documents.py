@@ -2,66 +2,321 @@ import os
 import subprocess
 import platform
 import tempfile
+import time
 from pathlib import Path
 
-# Dictionary mapping file extensions to their document types
-DOCUMENT_FORMATS = {
-    'doc': 'word',
-    'docx': 'word',
-    'pdf': 'pdf',
-    'txt': 'text',
-    'rtf': 'rtf',
-    'odt': 'odt'
-}
-
-def convert_document(input_path, output_path, target_format):
+from convertions.instrument import stage
+from convertions.progress import ConversionCancelled, report_progress
+from convertions.registry import convert_file
+from convertions.sniff import DOCUMENT_FORMATS, detect_format, format_kind
+
+# Resolution PDF pages are rendered to images at, unless asked otherwise
+DEFAULT_DPI = 150
+
+def convert_document(input_path, output_path, target_format, progress=None, is_cancelled=None,
+                     pages=None, workers=1, dpi=DEFAULT_DPI):
     """
-    Convert documents between various formats using appropriate libraries
-    - PDF to DOCX conversion using pdf2docx
-    - DOCX/DOC to PDF conversion using docx2pdf
+    Convert documents between various formats, along the cheapest route of
+    the converters in convertions.registry, for example
+    - PDF to DOCX conversion using pdf2docx, limited to pages (0-based
+      indexes) if given and parsed on workers processes
+    - DOCX/DOC to PDF conversion using docx2pdf (Windows and macOS), or
+      DOC/DOCX/ODT/RTF to PDF with LibreOffice elsewhere (convertions.office)
+    - PDF to PNG/JPG/WEBP/... page images rendered at dpi with PyMuPDF,
+      on workers processes (see pdf_to_images for the file names)
+    - TXT to PDF, and TXT/RTF/ODT/DOCX to DOCX/ODT, streamed in pure
+      Python (convertions.textdocs)
+    PDF to DOCX and to images report progress and check is_cancelled after
+    every page, the streaming converters as they read; docx2pdf and
+    LibreOffice cannot be interrupted, so they are only checked before
+    they start.
     """
-    input_ext = os.path.splitext(input_path)[1].lower().lstrip('.')
+    input_ext = detect_format(input_path)
     target_format = target_format.lower()
     
     # Validate formats
     if input_ext not in DOCUMENT_FORMATS:
         raise ValueError(f"Unsupported input format: {input_ext}")
     
-    if target_format not in DOCUMENT_FORMATS:
+    if target_format not in DOCUMENT_FORMATS and format_kind(target_format) != 'image':
         raise ValueError(f"Unsupported target format: {target_format}")
     
-    # Handle different conversion scenarios
     try:
-        # PDF to DOCX conversion
-        if input_ext == 'pdf' and target_format == 'docx':
-            return pdf_to_docx(input_path, output_path)
-        
-        # DOCX/DOC to PDF conversion
-        elif input_ext in ['docx', 'doc'] and target_format == 'pdf':
-            return doc_to_pdf(input_path, output_path)
-        
-        # Other conversions can be added here
-        else:
-            raise ValueError(f"Conversion from {input_ext} to {target_format} not supported yet")
-    
+        # New conversions are added by registering a converter
+        return convert_file(input_path, output_path, target_format, input_ext, progress, is_cancelled,
+                            pages=pages, workers=workers, dpi=dpi)
+
     except Exception as e:
         print(f"Conversion failed: {e}")
         raise
 
-def pdf_to_docx(input_path, output_path):
-    """Convert PDF to DOCX using pdf2docx"""
+def parse_page_range(text, page_count):
+    """
+    Turn a page range such as "1-3, 7, 10-" (1-based, inclusive) into a sorted
+    list of 0-based page indexes. An empty string selects every page.
+    """
+    text = text.strip()
+    if not text:
+        return list(range(page_count))
+    pages = set()
+    for part in text.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if '-' in part:
+            first, last = part.split('-', 1)
+            first = int(first) if first.strip() else 1
+            last = int(last) if last.strip() else page_count
+        else:
+            first = last = int(part)
+        if first < 1 or last > page_count or first > last:
+            raise ValueError(f"Page range {part} is outside 1-{page_count}")
+        pages.update(range(first - 1, last))
+    return sorted(pages)
+
+def pdf_page_count(input_path):
+    """Return the number of pages in a PDF (uses PyMuPDF, installed with pdf2docx)."""
+    try:
+        import fitz
+    except ImportError:
+        raise ImportError("pdf2docx package is required. Install it with: pip install pdf2docx")
+    with fitz.open(input_path) as doc:
+        return len(doc)
+
+def _parse_pdf_pages(input_path, page_indexes, json_path, on_page=None, is_cancelled=None):
+    """
+    Parse a subset of PDF pages with pdf2docx and store the result as JSON.
+    on_page is called with the page index after each page. Returns False
+    if is_cancelled() turned true before all pages were parsed.
+    """
+    from pdf2docx import Converter
+
+    cv = Converter(input_path)
+    try:
+        settings = cv.default_settings
+        cv.load_pages(pages=page_indexes)
+        cv.parse_document(**settings)
+        for page in cv.pages:
+            if page.skip_parsing:
+                continue
+            if is_cancelled is not None and is_cancelled():
+                return False
+            try:
+                page.parse(**settings)
+            except Exception as e:
+                # Same policy as pdf2docx: skip pages that fail to parse
+                print(f"Ignoring page {page.id + 1}: {e}")
+            if on_page is not None:
+                on_page(page.id)
+        cv.serialize(json_path)
+        return True
+    finally:
+        cv.close()
+
+def pdf_to_docx(input_path, output_path, start=0, end=None, pages=None, workers=1,
+                progress=None, is_cancelled=None):
+    """
+    Convert PDF to DOCX using pdf2docx.
+    Only the pages in [start, end) are parsed, or the 0-based indexes in
+    pages if given. With workers > 1 the pages are split into contiguous
+    chunks that are parsed in separate processes. progress is called with
+    a 0.0 - 1.0 fraction after every parsed page.
+    """
     try:
         # Import here to avoid dependency issues if not needed
         from pdf2docx import Converter
-        
-        # Convert PDF to DOCX
+    except ImportError:
+        # Provide instructions if pdf2docx is not installed
+        raise ImportError("pdf2docx package is required. Install it with: pip install pdf2docx")
+
+    with stage('open'):
         cv = Converter(input_path)
-        cv.convert(output_path)
-        cv.close()
+    try:
+        page_count = len(cv.fitz_doc)
+        if pages is None:
+            pages = list(range(page_count))[start:end]
+        pages = sorted(set(pages))
+        if not pages:
+            raise ValueError("No pages selected")
+        if pages[0] < 0 or pages[-1] >= page_count:
+            raise ValueError(f"Page index out of range for a {page_count}-page document")
+
+        workers = max(1, min(workers or 1, len(pages)))
+        chunk_size = -(-len(pages) // workers)
+        chunks = [pages[i:i + chunk_size] for i in range(0, len(pages), chunk_size)]
+
+        with tempfile.TemporaryDirectory(prefix="kommverters-") as temp_dir:
+            json_paths = [os.path.join(temp_dir, f"pages-{i}.json") for i in range(len(chunks))]
+            parsed = 0
+
+            def page_done(_):
+                nonlocal parsed
+                parsed += 1
+                # Parsing is most of the work, writing the DOCX is the rest
+                report_progress(progress, 0.9 * parsed / len(pages), is_cancelled)
+
+            # With several workers the parsing CPU time is spent in the child processes
+            with stage('parse'):
+                if len(chunks) == 1:
+                    # page_done raises ConversionCancelled itself
+                    _parse_pdf_pages(input_path, chunks[0], json_paths[0], page_done)
+                else:
+                    _parse_in_processes(input_path, chunks, json_paths, page_done, is_cancelled)
+
+            # Merge the parsed pages and write the document once
+            with stage('write'):
+                cv.load_pages(pages=pages)
+                for json_path in json_paths:
+                    cv.deserialize(json_path)
+                cv.make_docx(output_path, **cv.default_settings)
+
+        report_progress(progress, 1.0)
         return True
+    finally:
+        cv.close()
+
+def _parse_in_processes(input_path, chunks, json_paths, page_done, is_cancelled):
+    """Parse page chunks on a process pool, forwarding per-page events."""
+    import queue
+    from concurrent.futures import ProcessPoolExecutor, wait, FIRST_EXCEPTION
+    from multiprocessing import Manager
+
+    with Manager() as manager, ProcessPoolExecutor(max_workers=len(chunks)) as executor:
+        events = manager.Queue()
+        cancel_event = manager.Event()
+        futures = [
+            executor.submit(_parse_pdf_pages, input_path, chunk, json_path, events.put, cancel_event.is_set)
+            for chunk, json_path in zip(chunks, json_paths)
+        ]
+        try:
+            pending = set(futures)
+            while pending:
+                done, pending = wait(pending, timeout=0.1, return_when=FIRST_EXCEPTION)
+                for future in done:
+                    future.result()
+                while True:
+                    try:
+                        page_done(events.get_nowait())
+                    except queue.Empty:
+                        break
+            # Drain events that arrived after the last worker finished
+            while True:
+                try:
+                    page_done(events.get_nowait())
+                except queue.Empty:
+                    break
+        except BaseException:
+            cancel_event.set()
+            raise
+        if not all(future.result() for future in futures):
+            raise ConversionCancelled("Conversion cancelled")
+
+def page_output_paths(output_path, pages, page_count):
+    """
+    The files PDF pages are rendered to: output_path itself for a single
+    page, otherwise 'name-07.png' style names numbered from 1 and padded to
+    the digits of page_count.
+    """
+    if len(pages) == 1:
+        return [output_path]
+    base, ext = os.path.splitext(output_path)
+    digits = len(str(page_count))
+    return [f"{base}-{page + 1:0{digits}d}{ext}" for page in pages]
+
+def _save_page(doc, page, output_path, target_format, dpi):
+    import fitz
+    from PIL import Image
+    from convertions.formats import atomic_output
+    from convertions.images import PIL_FORMATS
+
+    # PDF units are 1/72 inch
+    zoom = dpi / 72
+    pix = doc[page].get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+    img = Image.frombytes('RGB', (pix.width, pix.height), pix.samples, 'raw', 'RGB', pix.stride)
+    del pix
+    # Pillow encodes, with the same settings as image conversions
+    with atomic_output(output_path) as partial_path:
+        img.save(partial_path, format=PIL_FORMATS[target_format])
+
+# (path, document) each rendering process keeps open between its pages
+_open_pdf = None
+
+def _render_page(input_path, page, output_path, target_format, dpi):
+    """Render one page on a pool process, opening the PDF once per process."""
+    import fitz
+    global _open_pdf
+
+    if _open_pdf is None or _open_pdf[0] != input_path:
+        if _open_pdf is not None:
+            _open_pdf[1].close()
+        _open_pdf = (input_path, fitz.open(input_path))
+    _save_page(_open_pdf[1], page, output_path, target_format, dpi)
+
+def pdf_to_images(input_path, output_path, target_format, dpi=DEFAULT_DPI, pages=None, workers=1,
+                  progress=None, is_cancelled=None):
+    """
+    Render PDF pages to images with PyMuPDF, one file per page named by
+    page_output_paths(), limited to pages (0-based indexes) if given.
+    With workers > 1 the pages are rendered on that many processes. Each
+    page is written as soon as it is rendered, so only the pages being
+    rendered are in memory. progress is called after every page and
+    is_cancelled is checked between pages. Returns the paths written.
+    """
+    try:
+        import fitz
     except ImportError:
-        # Provide instructions if pdf2docx is not installed
         raise ImportError("pdf2docx package is required. Install it with: pip install pdf2docx")
+    from convertions.instrument import current_recorder
+
+    with stage('open'):
+        doc = fitz.open(input_path)
+    try:
+        page_count = len(doc)
+        pages = sorted(set(pages)) if pages is not None else list(range(page_count))
+        if not pages:
+            raise ValueError("No pages selected")
+        if pages[0] < 0 or pages[-1] >= page_count:
+            raise ValueError(f"Page index out of range for a {page_count}-page document")
+        outputs = page_output_paths(output_path, pages, page_count)
+        workers = max(1, min(workers or 1, len(pages)))
+
+        start = time.perf_counter()
+        with stage('render'):
+            if workers == 1:
+                for done, (page, path) in enumerate(zip(pages, outputs), 1):
+                    _save_page(doc, page, path, target_format, dpi)
+                    report_progress(progress, done / len(pages), is_cancelled)
+            else:
+                _render_in_processes(input_path, list(zip(pages, outputs)), target_format, dpi, workers,
+                                     progress, is_cancelled)
+        seconds = time.perf_counter() - start
+    finally:
+        doc.close()
+
+    recorder = current_recorder()
+    if recorder is not None:
+        recorder.details['pages'] = len(pages)
+        recorder.details['pages_per_second'] = len(pages) / max(seconds, 1e-9)
+    print(f"Rendered {len(pages)} pages at {dpi:g} dpi in {seconds:.2f}s "
+          f"({len(pages) / max(seconds, 1e-9):.1f} pages/s)")
+    return outputs
+
+def _render_in_processes(input_path, jobs, target_format, dpi, workers, progress, is_cancelled):
+    """Render [(page, output path)] on a process pool, one task per page."""
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_render_page, input_path, page, path, target_format, dpi)
+                   for page, path in jobs]
+        try:
+            for done, future in enumerate(as_completed(futures), 1):
+                future.result()
+                report_progress(progress, done / len(jobs), is_cancelled)
+        except BaseException:
+            # Pages not started are dropped; the ones rendering finish their files
+            for future in futures:
+                future.cancel()
+            raise
 
 def doc_to_pdf(input_path, output_path):
     """Convert DOC/DOCX to PDF using docx2pdf"""
@@ -70,7 +325,8 @@ def doc_to_pdf(input_path, output_path):
         from docx2pdf import convert
         
         # Convert DOCX to PDF
-        convert(input_path, output_path)
+        with stage('convert'):
+            convert(input_path, output_path)
         return True
     except ImportError:
         # Provide instructions if docx2pdf is not installed
@@ -80,7 +336,7 @@ def get_document_info(file_path):
     """Get basic information about the document file"""
     info = {
         'file_size': os.path.getsize(file_path),
-        'format': os.path.splitext(file_path)[1].lower().lstrip('.'),
+        'format': detect_format(file_path),
         'filename': os.path.basename(file_path)
     }
     return info
\ No newline at end of file
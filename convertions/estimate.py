@@ -0,0 +1,133 @@
+from collections import OrderedDict, namedtuple
+from io import BytesIO
+import math
+import os
+import threading
+
+from PIL import Image
+
+from convertions.images import PIL_FORMATS, flatten_for_format, has_transparency, open_image, scaled_size
+from convertions.pipeline import plan_pipeline, run_pipeline
+from convertions.progress import report_progress
+from convertions.sniff import canonical_format
+
+# Edge of the square tiles sampled at output resolution
+TILE_SIZE = 128
+# Tiles sampled per estimate, spread over a regular grid
+TILE_COUNT = 16
+# Outputs up to this many pixels are cheap enough to encode exactly
+EXACT_PIXEL_LIMIT = 512 * 512
+CACHE_SIZE = 256
+# Real size over the tile estimate as (lowest, median, highest), measured
+# with the Pillow backend on the benchmark corpus (small and medium at
+# scales 1, 0.6 and 0.2, large at 0.2; every source mode). Tiles encode
+# worse than the whole image, GIF most of all: each tile gets its own
+# palette. The median corrects the estimate, the extremes are its bounds.
+TILE_BIAS = {
+    'png': (0.62, 0.94, 1.07),
+    'jpg': (0.81, 0.95, 1.05),
+    'webp': (0.62, 0.89, 1.00),
+    'gif': (0.29, 0.57, 1.19),
+    'bmp': (0.94, 1.00, 1.01),
+    'tiff': (0.99, 1.00, 1.01),
+}
+
+# size is the best guess in bytes, low/high bound the results seen on the corpus
+SizeEstimate = namedtuple('SizeEstimate', ['size', 'low', 'high', 'exact'])
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _encoded_size(img, target_format):
+    buffer = BytesIO()
+    flatten_for_format(img, target_format).save(buffer, format=PIL_FORMATS[target_format])
+    return buffer.tell()
+
+
+def _tile_boxes(width, height, tile, count):
+    """Return up to count tile boxes spread evenly over a width x height image."""
+    columns = max(1, round(math.sqrt(count * width / height)))
+    rows = max(1, math.ceil(count / columns))
+    boxes = []
+    for row in range(rows):
+        for column in range(columns):
+            left = (width - tile) * (column + 0.5) / columns
+            top = (height - tile) * (row + 0.5) / rows
+            boxes.append((int(left), int(top), int(left) + tile, int(top) + tile))
+    return boxes[:count]
+
+
+def _estimate(file_path, target_format, scale, is_cancelled=None):
+    img, (width, height) = open_image(file_path, scale)
+    target_width, target_height = scaled_size(width, height, scale)
+    target_pixels = target_width * target_height
+
+    # Small outputs: encode the real thing, the number is exact
+    if target_pixels <= EXACT_PIXEL_LIMIT or min(target_width, target_height) < TILE_SIZE:
+        img = run_pipeline(img, (target_width, target_height), target_format)
+        size = _encoded_size(img, target_format)
+        return SizeEstimate(size, size, size, True)
+
+    # Large outputs: encode tiles sampled at output resolution and
+    # extrapolate their bytes per pixel to the whole image. Detail and
+    # noise survive, which a downsampled proxy would average away.
+    img.load()
+    # Run the steps the real pipeline takes before its resize, so the tiles
+    # are resampled in the same mode (a palette kept at scale 1 stays one)
+    plan = plan_pipeline(img.mode, has_transparency(img), img.size, (target_width, target_height), target_format)
+    resized = False
+    for step in plan.steps[1:]:
+        if step.name == 'resize':
+            resized = True
+            break
+        img = img.convert(step.mode) if step.name == 'prepare' else flatten_for_format(img, target_format)
+    # Source pixels per output pixel, after any decode-time reduction
+    x_ratio = img.width / target_width
+    y_ratio = img.height / target_height
+    header = _encoded_size(Image.new(img.mode, (1, 1)), target_format)
+    samples = []
+    for left, top, right, bottom in _tile_boxes(target_width, target_height, TILE_SIZE, TILE_COUNT):
+        report_progress(None, 0.0, is_cancelled)
+        # Map the output tile back to source coordinates and resample only that
+        box = (left * x_ratio, top * y_ratio, right * x_ratio, bottom * y_ratio)
+        if resized:
+            tile = img.resize((TILE_SIZE, TILE_SIZE), Image.LANCZOS, box=box)
+        else:
+            tile = img.crop((left, top, right, bottom))
+        samples.append(max(_encoded_size(tile, target_format) - header, 0) / (TILE_SIZE * TILE_SIZE))
+
+    body = sum(samples) / len(samples) * target_pixels
+    low, median, high = TILE_BIAS[canonical_format(target_format)]
+    return SizeEstimate(int(header + body * median), int(header + body * low), int(header + body * high), False)
+
+
+def estimate_output_size(file_path, target_format, scale, is_cancelled=None):
+    """
+    Estimate the encoded size of file_path saved as target_format and
+    scaled by scale, without encoding the full-size image.
+    Results are cached by (path, mtime, scale, format).
+    """
+    target_format = target_format.lower()
+    if target_format not in PIL_FORMATS:
+        raise ValueError(f"Unsupported target format: {target_format}")
+
+    key = (os.path.abspath(file_path), os.stat(file_path).st_mtime_ns, scale, target_format)
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+
+    estimate = _estimate(file_path, target_format, scale, is_cancelled)
+
+    with _cache_lock:
+        _cache[key] = estimate
+        _cache.move_to_end(key)
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return estimate
+
+
+def clear_estimate_cache():
+    with _cache_lock:
+        _cache.clear()
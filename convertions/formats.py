@@ -0,0 +1,100 @@
+from contextlib import contextmanager
+import glob
+import os
+
+from convertions.sniff import DOCUMENT_FORMATS, IMAGE_FORMATS, sniff_file
+
+# Edge of the square previews, in pixels; here so the GUI can read it without importing PIL
+THUMBNAIL_SIZE = 128
+
+
+def iter_files(patterns):
+    """
+    Expand files, directories (recursively) and glob patterns into
+    de-duplicated files with a supported extension, in a stable order,
+    yielding each one as soon as it is found.
+    Files without an extension are kept if their content is a supported
+    image or binary document format.
+    """
+    supported = set(IMAGE_FORMATS) | set(DOCUMENT_FORMATS)
+    seen = set()
+
+    def accept(path):
+        ext = os.path.splitext(path)[1].lower().lstrip('.')
+        real = os.path.realpath(path)
+        if real in seen or not os.path.isfile(path):
+            return False
+        if not ext:
+            try:
+                info = sniff_file(path)
+            except OSError:
+                return False
+            # Any file without a NUL byte sniffs as text, so only trust binary formats
+            if info is None or info.format == 'txt':
+                return False
+        elif ext not in supported:
+            return False
+        seen.add(real)
+        return True
+
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for root, dirs, names in os.walk(pattern):
+                dirs.sort()
+                for name in sorted(names):
+                    path = os.path.join(root, name)
+                    if accept(path):
+                        yield path
+        elif glob.has_magic(pattern):
+            for path in sorted(glob.glob(pattern, recursive=True)):
+                if accept(path):
+                    yield path
+        elif accept(pattern):
+            yield pattern
+
+
+def collect_files(patterns):
+    """The files iter_files() finds, as a list."""
+    return list(iter_files(patterns))
+
+
+def unique_output_path(output_path, claimed):
+    """
+    Return output_path, or 'name_1.ext', 'name_2.ext', ... if another job in
+    the same run already claimed it. The returned path is added to claimed.
+    """
+    base, ext = os.path.splitext(output_path)
+    candidate = output_path
+    counter = 1
+    while os.path.realpath(candidate) in claimed:
+        candidate = f"{base}_{counter}{ext}"
+        counter += 1
+    claimed.add(os.path.realpath(candidate))
+    return candidate
+
+
+def partial_path_for(output_path):
+    """Hidden name the output is written to before it is renamed into place."""
+    directory, name = os.path.split(output_path)
+    base_name, ext = os.path.splitext(name)
+    # Keep the extension last, some converters go by it
+    return os.path.join(directory, f".{base_name}.part{ext}")
+
+
+@contextmanager
+def atomic_output(output_path):
+    """
+    Yield the partial path to write output_path under. It is renamed to
+    output_path when the with block completes and removed if it raises, so
+    a crashed or failed conversion never leaves a file that looks complete.
+    """
+    partial_path = partial_path_for(output_path)
+    try:
+        yield partial_path
+    except BaseException:
+        try:
+            os.remove(partial_path)
+        except OSError:
+            pass
+        raise
+    os.replace(partial_path, output_path)
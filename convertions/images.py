@@ -1,29 +1,173 @@
-from PIL import Image
+from PIL import Image, ImageChops, ImageStat
+import math
 import os
 
-def convert_image(input_path, output_path, target_format):
+from convertions.instrument import stage
+from convertions.progress import report_progress
+
+# Pillow registers JPEG under a single format name, so map the aliases
+PIL_FORMATS = {
+    'jpg': 'JPEG',
+    'jpeg': 'JPEG',
+    'png': 'PNG',
+    'bmp': 'BMP',
+    'gif': 'GIF',
+    'tiff': 'TIFF',
+    'webp': 'WEBP'
+}
+
+def scaled_size(width, height, scale):
+    """Return the output dimensions for a scale factor, never below 1x1."""
+    return max(1, int(width * scale)), max(1, int(height * scale))
+
+# Oversampling kept before the final LANCZOS pass. At 2.0 the shortcut
+# stays well above 50 dB PSNR against a full-resolution resample on
+# photos; resample_quality() measures it for a given file.
+REDUCING_GAP = 2.0
+
+def open_image(input_path, scale=1.0):
+    """
+    Open an image, letting the decoder skip detail a downscale would drop.
+    For JPEG sources draft() decodes directly at 1/2, 1/4 or 1/8 size,
+    but never below REDUCING_GAP times the requested output size.
+    Returns the image and its full-resolution (width, height).
+    """
+    img = Image.open(input_path)
+    original_size = img.size
+    if scale < 1.0 and img.format == 'JPEG':
+        width, height = scaled_size(img.width, img.height, scale)
+        img.draft(img.mode, (int(width * REDUCING_GAP), int(height * REDUCING_GAP)))
+    return img, original_size
+
+def resize_image(img, size):
+    """
+    LANCZOS resize that first shrinks by an integer factor with reduce()
+    when the image is much larger than size.
+    """
+    if img.size == size:
+        return img
+    return img.resize(size, Image.LANCZOS, reducing_gap=REDUCING_GAP)
+
+def resample_quality(input_path, scale):
+    """
+    Compare the fast decode-and-resize path with a full-resolution decode
+    followed by a plain LANCZOS resize. Returns the PSNR in dB (higher is
+    closer, inf means identical).
+    """
+    reference = Image.open(input_path)
+    size = scaled_size(reference.width, reference.height, scale)
+    reference = reference.convert('RGB').resize(size, Image.LANCZOS)
+
+    img, _ = open_image(input_path, scale)
+    fast = resize_image(img.convert('RGB'), size)
+
+    diff = ImageChops.difference(reference, fast)
+    mse = sum(v * v for v in ImageStat.Stat(diff).rms) / 3
+    if mse == 0:
+        return math.inf
+    return 10 * math.log10(255 ** 2 / mse)
+
+# Targets without transparency; alpha is composited on white for them
+OPAQUE_FORMATS = ['jpg', 'jpeg', 'pdf']
+# Modes a PDF page can hold as they are
+PDF_MODES = ('1', 'L', 'RGB', 'CMYK')
+
+def has_transparency(img):
+    """True if img has an alpha band or a transparent palette entry or colour."""
+    return img.mode in ('RGBA', 'LA', 'PA', 'RGBa', 'La') or 'transparency' in img.info
+
+def output_mode(mode, transparent, target_format):
+    """The mode an image of this mode is saved in as target_format."""
+    if target_format in OPAQUE_FORMATS:
+        if target_format == 'pdf' and mode in PDF_MODES and not transparent:
+            return mode
+        return 'RGB'
+    # Only TIFF stores CMYK among the other targets
+    if mode == 'CMYK' and target_format not in ['tif', 'tiff']:
+        return 'RGB'
+    return mode
+
+def resample_mode(mode, transparent):
+    """The mode to resample in; Pillow quietly uses NEAREST for '1' and 'P'."""
+    if mode == '1':
+        return 'L'
+    if mode in ('P', 'PA'):
+        return 'RGBA' if transparent else 'RGB'
+    if transparent and mode in ('L', 'RGB'):
+        # A transparent colour becomes an alpha band, or resampling would smear it
+        return 'RGBA'
+    return mode
+
+def flatten_for_format(img, target_format):
+    """
+    Convert img to a mode the target format can store. Where transparency
+    cannot be kept (JPEG, PDF) it is composited on white.
+    """
+    target_format = target_format.lower()
+    transparent = has_transparency(img)
+    mode = output_mode(img.mode, transparent, target_format)
+    if mode == img.mode:
+        return img
+
+    if transparent and mode == 'RGB':
+        if img.mode not in ('RGBA', 'LA'):
+            img = img.convert('RGBA')
+        # Paste through the alpha band: one RGB allocation instead of an RGBA
+        # background, an alpha_composite result and its RGB conversion
+        background = Image.new('RGB', img.size, (255, 255, 255))
+        background.paste(img, mask=img)
+        return background
+
+    return img.convert(mode)
+
+def convert_image(input_path, output_path, target_format, scale=1.0, progress=None, is_cancelled=None):
+    """
+    Convert an image to target_format, optionally scaling it.
+    Animated sources stay animated when the target is GIF, WEBP or PNG (APNG).
+    progress is called with a 0.0 - 1.0 fraction after each stage and
+    is_cancelled is polled between stages to stop early.
+    """
     try:
-        img = Image.open(input_path)
+        report_progress(progress, 0.0, is_cancelled)
+        with stage('open'):
+            img, (width, height) = open_image(input_path, scale)
+
+        # Imported here, the animation, pipeline and vips modules build on this one
+        from convertions.animation import ANIMATION_FORMATS, convert_animation
+        from convertions.pipeline import run_pipeline
+        from convertions.vips import choose_backend, convert_image_vips
+        animated = getattr(img, 'is_animated', False)
+        if animated and target_format.lower() in ANIMATION_FORMATS:
+            img.close()
+            return convert_animation(input_path, output_path, target_format, scale,
+                                     progress=progress, is_cancelled=is_cancelled)
+        if choose_backend(img.mode, width, height, target_format, animated) == 'vips':
+            # Large images stream through libvips instead of being decoded whole
+            img.close()
+            return convert_image_vips(input_path, output_path, target_format, scale,
+                                      progress=progress, is_cancelled=is_cancelled)
+
+        with stage('decode'):
+            img.load()
+        report_progress(progress, 0.3, is_cancelled)
 
         # Ensure proper format for output file extension
         target_format = target_format.lower()
-        valid_formats = ['jpeg', 'jpg', 'png', 'bmp', 'gif', 'tiff', 'webp']
-        
+        valid_formats = list(PIL_FORMATS)
+
         if target_format not in valid_formats:
             raise ValueError(f"Unsupported target format: {target_format}")
 
-        # Handle transparency issues when converting RGBA to JPG
-        if img.mode == 'RGBA' and target_format in ['jpg', 'jpeg']:
-            background = Image.new('RGB', img.size, (255, 255, 255))  # White background
-            img = Image.alpha_composite(background, img.convert('RGBA')).convert('RGB')
+        # Resize and mode conversion, in whichever order touches fewer pixels
+        img = run_pipeline(img, scaled_size(width, height, scale), target_format)
+        report_progress(progress, 0.7, is_cancelled)
 
-        elif img.mode != 'RGB' and target_format in ['jpg', 'jpeg']:
-            img = img.convert('RGB')
-
-        # Save with appropriate format
-        img.save(output_path, format=target_format.upper())
-        print(f"Successfully converted {input_path} to {output_path}")
+        # Save with appropriate format; Pillow encodes and writes in one pass
+        with stage('encode'):
+            img.save(output_path, format=PIL_FORMATS[target_format])
+        report_progress(progress, 1.0)
+        return True
 
     except Exception as e:
         print(f"Conversion failed: {e}")
-
+        raise
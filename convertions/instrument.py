@@ -0,0 +1,267 @@
+"""
+Per-stage timing and memory instrumentation for conversions.
+
+A conversion runs inside record(), and the engines mark their stages with
+stage('decode'), stage('resize') and so on. Outside record() stage() does
+nothing, so the engines pay for it only when someone is listening.
+
+For every stage the recorder keeps:
+    wall        - elapsed seconds
+    cpu         - CPU seconds of the converting thread; work the engine
+                  hands to helper threads or processes is not included
+    peak_rss    - peak resident set size in bytes while the stage ran
+    peak_traced - peak Python allocations in bytes (only with trace_memory)
+A stage entered several times (once per band, say) is summed, and its
+peaks are the highest seen.
+
+Peak RSS is process-wide. On Linux the high-water mark is reset when a
+stage starts while no other stage is running, on any thread; elsewhere it
+is the peak since the process started. With several conversions running
+at once (GUI workers on a thread pool) a stage's peak therefore covers
+every stage that overlapped it, but none of them wipes another's. The
+Python allocation peak and tracemalloc itself are shared the same way.
+
+Finished records can be appended to a JSON-lines file, one object per
+conversion, with log_path or the KOMMVERTERS_STAGE_LOG environment
+variable. Passing profile_path saves a cProfile dump of that conversion.
+"""
+from contextlib import contextmanager
+import json
+import os
+import sys
+import threading
+import time
+
+STAGE_LOG_ENV = 'KOMMVERTERS_STAGE_LOG'
+PROFILE_ENV = 'KOMMVERTERS_PROFILE'
+
+_local = threading.local()
+_log_lock = threading.Lock()
+_profile_claimed = False
+# Stages running and records tracing memory, on all threads; the peaks are
+# only reset, and tracing only stopped, when nobody else is measuring
+_memory_lock = threading.Lock()
+_active_stages = 0
+_tracing_records = 0
+_started_tracing = False
+
+
+def _reset_peak_rss():
+    """Reset the kernel's peak RSS counter; False where that is not possible."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss():
+    """Peak resident set size of this process in bytes, or None if unknown."""
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux and the BSDs kilobytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class StageStats:
+    """Totals for one named stage of a conversion."""
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.peak_rss = None
+        self.peak_traced = None
+
+    def as_dict(self):
+        return {
+            'stage': self.name,
+            'calls': self.calls,
+            'wall': round(self.wall, 6),
+            'cpu': round(self.cpu, 6),
+            'peak_rss': self.peak_rss,
+            'peak_traced': self.peak_traced,
+        }
+
+
+class Recorder:
+    """Collects the stages of one conversion, in the order they first ran."""
+
+    def __init__(self, job="", trace_memory=False, **details):
+        self.job = job
+        self.details = details
+        self.trace_memory = trace_memory
+        self.stages = {}
+        self.started = time.time()
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.peak_rss = None
+        self.error = None
+
+    def _peak(self, current, value):
+        return value if current is None else max(current, value if value is not None else current)
+
+    @contextmanager
+    def stage(self, name):
+        """Time the body as stage name."""
+        import tracemalloc
+
+        global _active_stages
+        stats = self.stages.get(name)
+        if stats is None:
+            stats = self.stages[name] = StageStats(name)
+        with _memory_lock:
+            if _active_stages == 0:
+                _reset_peak_rss()
+                if tracemalloc.is_tracing():
+                    tracemalloc.reset_peak()
+            _active_stages += 1
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            yield stats
+        finally:
+            stats.calls += 1
+            stats.wall += time.perf_counter() - wall
+            stats.cpu += time.thread_time() - cpu
+            # Read the peaks before another stage may reset them
+            with _memory_lock:
+                rss = peak_rss()
+                if self.trace_memory:
+                    stats.peak_traced = self._peak(stats.peak_traced, tracemalloc.get_traced_memory()[1])
+                _active_stages -= 1
+            stats.peak_rss = self._peak(stats.peak_rss, rss)
+            self.peak_rss = self._peak(self.peak_rss, rss)
+
+    def as_dict(self):
+        """The record as written to the JSON-lines log."""
+        return {
+            'job': self.job,
+            **self.details,
+            'started': round(self.started, 3),
+            'wall': round(self.wall, 6),
+            'cpu': round(self.cpu, 6),
+            'peak_rss': self.peak_rss,
+            'error': self.error,
+            'stages': [stats.as_dict() for stats in self.stages.values()],
+        }
+
+    def summary(self):
+        """One line per stage, e.g. 'decode 120 ms (cpu 118 ms, peak 310 MB)'."""
+        lines = []
+        for stats in self.stages.values():
+            line = f"{stats.name} {stats.wall * 1000:.0f} ms (cpu {stats.cpu * 1000:.0f} ms"
+            if stats.peak_rss is not None:
+                line += f", peak {stats.peak_rss / (1024 * 1024):.0f} MB"
+            if stats.peak_traced is not None:
+                line += f", Python {stats.peak_traced / (1024 * 1024):.1f} MB"
+            lines.append(line + ")")
+        lines.append(f"total {self.wall * 1000:.0f} ms")
+        return "\n".join(lines)
+
+
+def current_recorder():
+    """The Recorder of the conversion running on this thread, or None."""
+    return getattr(_local, 'recorder', None)
+
+
+@contextmanager
+def stage(name):
+    """Mark the body as a stage of the current conversion; a no-op outside record()."""
+    recorder = current_recorder()
+    if recorder is None:
+        yield None
+        return
+    with recorder.stage(name) as stats:
+        yield stats
+
+
+def append_record(log_path, record):
+    """Append one record as a line of JSON. Lines stay whole with several writers."""
+    line = json.dumps(record, separators=(',', ':')) + "\n"
+    with _log_lock:
+        # One O_APPEND write per line, so processes sharing the log do not interleave
+        fd = os.open(log_path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line.encode())
+        finally:
+            os.close(fd)
+
+
+def claim_profile_path():
+    """
+    Return the KOMMVERTERS_PROFILE path the first time it is asked for and
+    None afterwards, so only one conversion of the process is profiled.
+    """
+    global _profile_claimed
+    with _log_lock:
+        if _profile_claimed or not os.environ.get(PROFILE_ENV):
+            return None
+        _profile_claimed = True
+        return os.environ[PROFILE_ENV]
+
+
+@contextmanager
+def record(job="", log_path=None, trace_memory=False, profile_path=None, **details):
+    """
+    Instrument the conversion run in the body and yield its Recorder.
+    details (output path, target format...) are copied into the log record.
+    log_path defaults to $KOMMVERTERS_STAGE_LOG; the record is logged even
+    if the conversion fails.
+    """
+    import tracemalloc
+
+    global _tracing_records, _started_tracing
+    log_path = log_path or os.environ.get(STAGE_LOG_ENV)
+    recorder = Recorder(job, trace_memory, **details)
+    if trace_memory:
+        with _memory_lock:
+            if _tracing_records == 0 and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                _started_tracing = True
+            _tracing_records += 1
+    profiler = None
+    if profile_path:
+        import cProfile
+        profiler = cProfile.Profile()
+
+    previous = current_recorder()
+    _local.recorder = recorder
+    wall, cpu = time.perf_counter(), time.thread_time()
+    try:
+        if profiler is not None:
+            profiler.enable()
+        yield recorder
+    except BaseException as e:
+        recorder.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(profile_path)
+        recorder.wall = time.perf_counter() - wall
+        recorder.cpu = time.thread_time() - cpu
+        recorder.peak_rss = recorder._peak(recorder.peak_rss, peak_rss())
+        _local.recorder = previous
+        if trace_memory:
+            with _memory_lock:
+                _tracing_records -= 1
+                if _tracing_records == 0 and _started_tracing:
+                    tracemalloc.stop()
+                    _started_tracing = False
+        if log_path:
+            try:
+                append_record(log_path, recorder.as_dict())
+            except OSError as e:
+                print(f"Could not write stage log {log_path}: {e}")
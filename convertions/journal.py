@@ -0,0 +1,158 @@
+"""
+SQLite journal of batch conversion jobs, so an interrupted batch resumes.
+
+Every job is one row keyed by its input path and its parameters (target
+format, output directory and every option that changes the output), with
+its state, output path (the first file, for PDF pages), input size and
+mtime, timing, error and number of attempts. A job is 'running' from the
+moment it is handed to a worker until it is 'done' or 'failed'; a row
+left 'running' belongs to a run that died.
+
+Rerunning the same batch skips the jobs that are done, as long as their
+input is unchanged and their output is still there, and converts the rest
+again, failed and interrupted ones included. Outputs are renamed into place
+only once complete (formats.atomic_output), so an output the journal calls
+done is never half-written.
+
+Rows are buffered and written in one transaction per JOURNAL_BATCH_SIZE
+rows or JOURNAL_BATCH_SECONDS, whichever comes first, in WAL mode without
+a sync per commit: a crash loses at most the last batch of state changes,
+and those jobs are simply converted again.
+"""
+import json
+import os
+import sqlite3
+import time
+
+JOURNAL_BATCH_SIZE = 500
+JOURNAL_BATCH_SECONDS = 1.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    input TEXT NOT NULL,
+    params TEXT NOT NULL,
+    state TEXT NOT NULL,
+    output TEXT,
+    input_size INTEGER,
+    input_mtime_ns INTEGER,
+    output_size INTEGER,
+    seconds REAL,
+    error TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    updated REAL NOT NULL,
+    PRIMARY KEY (input, params)
+)
+"""
+
+# A 'running' row counts one more attempt; later rows for the job keep the count
+UPSERT = """
+INSERT INTO jobs (input, params, state, output, input_size, input_mtime_ns, output_size, seconds,
+                  error, attempts, updated)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (input, params) DO UPDATE SET
+    state = excluded.state, output = excluded.output, input_size = excluded.input_size,
+    input_mtime_ns = excluded.input_mtime_ns, output_size = excluded.output_size,
+    seconds = excluded.seconds, error = excluded.error,
+    attempts = jobs.attempts + excluded.attempts, updated = excluded.updated
+"""
+
+STATES = ('running', 'done', 'failed')
+
+
+def job_params(target_format, **options):
+    """The journal key for a job's parameters: canonical JSON of everything that changes the output."""
+    return json.dumps(dict(options, format=target_format), sort_keys=True)
+
+
+def input_stamp(path):
+    """(size, mtime in ns) of an input, to tell whether it changed since it was converted."""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None, None
+    return stat.st_size, stat.st_mtime_ns
+
+
+def is_done(completed, input_path, stamp):
+    """
+    True if completed (from Journal.completed()) shows input_path converted,
+    with the input unchanged since and the output it recorded still there.
+    """
+    entry = completed.get(os.path.abspath(input_path))
+    return entry is not None and tuple(entry[1:]) == stamp and os.path.exists(entry[0])
+
+
+class Journal:
+    """Job states of batch runs in a SQLite file, written in batched transactions."""
+
+    def __init__(self, path, batch_size=JOURNAL_BATCH_SIZE, batch_seconds=JOURNAL_BATCH_SECONDS):
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.batch_size = batch_size
+        self.batch_seconds = batch_seconds
+        # Transactions are managed here, not by the sqlite3 module
+        self._db = sqlite3.connect(path, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(SCHEMA)
+        self._pending = []
+        self._last_flush = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def completed(self, params):
+        """{input: (output, input size, input mtime ns)} of the jobs done with these parameters."""
+        self.flush()
+        rows = self._db.execute("SELECT input, output, input_size, input_mtime_ns FROM jobs "
+                                "WHERE params = ? AND state = 'done'", (params,))
+        return {row[0]: tuple(row[1:]) for row in rows}
+
+    def started(self, input_path, params, output_path, stamp):
+        self._add(input_path, params, 'running', output_path, stamp, attempts=1)
+
+    def finished(self, input_path, params, result, stamp):
+        """Record a result dict of batch.convert_one."""
+        state = 'failed' if result['error'] else 'done'
+        self._add(input_path, params, state, result['output'], stamp, result['output_size'],
+                  result['seconds'], result['error'])
+
+    def _add(self, input_path, params, state, output_path, stamp, output_size=None, seconds=None,
+             error=None, attempts=0):
+        size, mtime_ns = stamp
+        # Absolute paths, so a rerun from another directory finds the same jobs
+        self._pending.append((os.path.abspath(input_path), params, state, os.path.abspath(output_path),
+                              size, mtime_ns, output_size, seconds, error, attempts, time.time()))
+        if (len(self._pending) >= self.batch_size
+                or time.monotonic() - self._last_flush >= self.batch_seconds):
+            self.flush()
+
+    def flush(self):
+        """Write the buffered rows in one transaction."""
+        self._last_flush = time.monotonic()
+        if not self._pending:
+            return
+        with self._db:
+            self._db.execute("BEGIN")
+            self._db.executemany(UPSERT, self._pending)
+        self._pending = []
+
+    def counts(self, params=None):
+        """{state: number of jobs}, for all parameters or just these."""
+        self.flush()
+        query = "SELECT state, COUNT(*) FROM jobs"
+        rows = (self._db.execute(query + " WHERE params = ? GROUP BY state", (params,)) if params
+                else self._db.execute(query + " GROUP BY state"))
+        counts = dict.fromkeys(STATES, 0)
+        counts.update(rows)
+        return counts
+
+    def close(self):
+        if self._db is not None:
+            self.flush()
+            self._db.close()
+            self._db = None
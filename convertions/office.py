@@ -0,0 +1,215 @@
+"""
+Document conversion through a headless LibreOffice kept running between jobs.
+
+Starting LibreOffice takes seconds, far longer than converting a typical
+document, so the first conversion in a process starts one soffice
+listening on a private pipe and later conversions reuse it over UNO. Each
+instance has its own throwaway profile, so the pool processes of batch.py
+and server.py each get their own office and none of them clashes with a
+LibreOffice the user has open. The office is restarted if it dies or a
+conversion takes longer than CONVERT_TIMEOUT, and stopped when the
+process exits.
+
+Talking to a running office needs LibreOffice's Python bridge (the 'uno'
+module: the python3-uno package on Debian and Ubuntu, bundled with
+LibreOffice elsewhere). Without it every conversion runs
+'soffice --convert-to', paying the start-up each time.
+"""
+import glob
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+# Where LibreOffice lives when it is not on the PATH
+SOFFICE_PATHS = [
+    '/usr/lib/libreoffice/program/soffice',
+    '/opt/libreoffice*/program/soffice',
+    '/Applications/LibreOffice.app/Contents/MacOS/soffice',
+    r'C:\Program Files\LibreOffice\program\soffice.exe',
+]
+# Export filters by target format
+FILTERS = {'pdf': 'writer_pdf_Export'}
+START_TIMEOUT = 60
+CONVERT_TIMEOUT = 300
+
+_office = None
+_office_lock = threading.Lock()
+
+
+def find_soffice():
+    """Path of the LibreOffice executable, or None."""
+    for name in ('soffice', 'libreoffice'):
+        path = shutil.which(name)
+        if path:
+            return path
+    for pattern in SOFFICE_PATHS:
+        matches = sorted(glob.glob(pattern))
+        if matches:
+            return matches[-1]
+    return None
+
+
+def _import_uno(soffice):
+    """The uno module, from the Python path or LibreOffice's program directory, or None."""
+    try:
+        import uno
+        return uno
+    except ImportError:
+        pass
+    sys.path.append(os.path.dirname(os.path.realpath(soffice)))
+    try:
+        import uno
+        return uno
+    except ImportError:
+        sys.path.pop()
+        return None
+
+
+def _office_args(soffice, profile_dir):
+    return [soffice, '--headless', '--invisible', '--nologo', '--norestore', '--nodefault', '--nolockcheck',
+            f"-env:UserInstallation={Path(profile_dir).as_uri()}"]
+
+
+class Office:
+    """One headless soffice process and the UNO connection to it."""
+
+    def __init__(self, soffice, uno):
+        self.uno = uno
+        self.timed_out = False
+        self.profile_dir = tempfile.mkdtemp(prefix="kommverters-office-")
+        pipe_name = f"kommverters-{os.getpid()}-{id(self)}"
+        accept = f"--accept=pipe,name={pipe_name};urp;StarOffice.ComponentContext"
+        self.process = subprocess.Popen(_office_args(soffice, self.profile_dir) + [accept], stdin=subprocess.DEVNULL,
+                                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            self.desktop = self._connect(pipe_name)
+        except BaseException:
+            self.close()
+            raise
+
+    def _connect(self, pipe_name):
+        local = self.uno.getComponentContext()
+        resolver = local.ServiceManager.createInstanceWithContext("com.sun.star.bridge.UnoUrlResolver", local)
+        deadline = time.monotonic() + START_TIMEOUT
+        while True:
+            try:
+                context = resolver.resolve(f"uno:pipe,name={pipe_name};urp;StarOffice.ComponentContext")
+                return context.ServiceManager.createInstanceWithContext("com.sun.star.frame.Desktop", context)
+            except Exception:
+                # Not listening yet
+                if self.process.poll() is not None:
+                    raise RuntimeError(f"LibreOffice exited with code {self.process.returncode} on start-up")
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"LibreOffice did not start within {START_TIMEOUT}s")
+                time.sleep(0.1)
+
+    def _properties(self, **values):
+        properties = []
+        for name, value in values.items():
+            prop = self.uno.createUnoStruct('com.sun.star.beans.PropertyValue')
+            prop.Name, prop.Value = name, value
+            properties.append(prop)
+        return tuple(properties)
+
+    def alive(self):
+        return self.process.poll() is None
+
+    def kill(self):
+        """Stop a hung office; the UNO call waiting on it then fails."""
+        self.timed_out = True
+        self.process.kill()
+
+    def convert(self, input_path, output_path, target_format):
+        document = self.desktop.loadComponentFromURL(
+            self.uno.systemPathToFileUrl(os.path.abspath(input_path)), "_blank", 0,
+            self._properties(Hidden=True, ReadOnly=True))
+        if document is None:
+            raise ValueError(f"LibreOffice could not open {input_path}")
+        try:
+            document.storeToURL(self.uno.systemPathToFileUrl(os.path.abspath(output_path)),
+                                self._properties(FilterName=FILTERS[target_format]))
+        finally:
+            document.close(True)
+
+    def close(self):
+        try:
+            if self.alive() and getattr(self, 'desktop', None) is not None:
+                self.desktop.terminate()
+        except Exception:
+            # The connection drops as the office quits
+            pass
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        shutil.rmtree(self.profile_dir, ignore_errors=True)
+
+
+def _close_office():
+    global _office
+    with _office_lock:
+        if _office is not None:
+            _office.close()
+            _office = None
+
+
+def _convert_once(soffice, input_path, output_path, target_format):
+    """Convert with a LibreOffice started for this file alone."""
+    with tempfile.TemporaryDirectory(prefix="kommverters-office-") as temp_dir:
+        profile_dir = os.path.join(temp_dir, 'profile')
+        out_dir = os.path.join(temp_dir, 'out')
+        result = subprocess.run(_office_args(soffice, profile_dir) + ['--convert-to', target_format,
+                                                                      '--outdir', out_dir, input_path],
+                                stdin=subprocess.DEVNULL, capture_output=True, timeout=CONVERT_TIMEOUT)
+        converted = os.path.join(out_dir, f"{os.path.splitext(os.path.basename(input_path))[0]}.{target_format}")
+        if not os.path.exists(converted):
+            message = result.stderr.decode(errors='replace').strip() or f"exit code {result.returncode}"
+            raise RuntimeError(f"LibreOffice could not convert {input_path}: {message}")
+        shutil.move(converted, output_path)
+
+
+def office_convert(input_path, output_path, target_format='pdf'):
+    """Convert a document with LibreOffice, reusing this process's running office."""
+    global _office
+    if target_format not in FILTERS:
+        raise ValueError(f"LibreOffice conversion to {target_format} not supported")
+    soffice = find_soffice()
+    if soffice is None:
+        raise ImportError("LibreOffice is required. Install it with: sudo apt install libreoffice-writer")
+    uno = _import_uno(soffice)
+    if uno is None:
+        _convert_once(soffice, input_path, output_path, target_format)
+        return True
+
+    # One document at a time per office; GUI conversions share the process
+    with _office_lock:
+        if _office is not None and not _office.alive():
+            _office.close()
+            _office = None
+        if _office is None:
+            from multiprocessing.util import Finalize
+            _office = Office(soffice, uno)
+            # Runs at exit in the main process and in pool workers, which skip atexit
+            Finalize(None, _close_office, exitpriority=10)
+        # A document that hangs the office would block every later conversion
+        watchdog = threading.Timer(CONVERT_TIMEOUT, _office.kill)
+        watchdog.daemon = True
+        watchdog.start()
+        try:
+            _office.convert(input_path, output_path, target_format)
+        except Exception:
+            if not _office.timed_out:
+                raise
+            # Started again by the next conversion
+            _office.close()
+            _office = None
+            raise RuntimeError(f"LibreOffice did not convert {input_path} within {CONVERT_TIMEOUT}s")
+        finally:
+            watchdog.cancel()
+    return True
@@ -0,0 +1,105 @@
+"""
+The resize and mode-conversion pipeline shared by every image path.
+
+Between decoding and encoding an image may need up to three steps:
+    prepare - a mode LANCZOS can resample in (palettes become RGB/RGBA)
+    resize  - to the output size
+    flatten - to a mode the target can store, compositing alpha on white
+Each step allocates one new full frame, so the plan leaves out steps that
+change nothing and orders the rest by cost: flattening RGBA for a JPEG
+before a resize, for example, saves Pillow's premultiply passes, while a
+CMYK image that is shrunk is cheaper to convert after the resize. Only the
+current frame is kept alive, so the peak is two frames at a time.
+
+convert_image, target-size encoding, the size estimator and the image to
+PDF converter all run their images through run_pipeline().
+"""
+from collections import namedtuple
+
+from PIL import Image
+
+from convertions.images import flatten_for_format, has_transparency, output_mode, resample_mode, resize_image
+from convertions.instrument import current_recorder, stage
+
+# Modes Pillow premultiplies around a resize, two extra passes over the pixels
+PREMULTIPLIED_MODES = ('RGBA', 'LA')
+
+# The image after a step: its mode and size
+Step = namedtuple('Step', ['name', 'mode', 'size'])
+# steps start with the decoded image; cost is in pixel passes; peak_bytes
+# is the most memory two consecutive frames take
+Plan = namedtuple('Plan', ['steps', 'cost', 'peak_bytes'])
+
+
+def frame_bytes(mode, size):
+    """Bytes Pillow allocates for a frame; bands are padded to four bytes per pixel."""
+    bytes_per_pixel = 1 if mode in ('1', 'L', 'P') else 2 if mode.startswith('I;16') else 4
+    return size[0] * size[1] * bytes_per_pixel
+
+
+def _step_cost(before, after):
+    pixels = before.size[0] * before.size[1]
+    if after.name != 'resize':
+        return pixels * Image.getmodebands(after.mode)
+    passes = (pixels + after.size[0] * after.size[1]) * Image.getmodebands(before.mode)
+    if before.mode in PREMULTIPLIED_MODES:
+        passes += pixels + after.size[0] * after.size[1]
+    return passes
+
+
+def _build(order, mode, transparent, source_size, output_size, target_format):
+    steps = [Step('decode', mode, source_size)]
+    for name in order:
+        current = steps[-1]
+        if name == 'resize':
+            if current.size == output_size:
+                continue
+            work_mode = resample_mode(current.mode, transparent)
+            if work_mode != current.mode:
+                steps.append(Step('prepare', work_mode, current.size))
+            steps.append(Step('resize', work_mode, output_size))
+        else:
+            flat_mode = output_mode(current.mode, transparent, target_format)
+            if flat_mode != current.mode:
+                steps.append(Step('flatten', flat_mode, current.size))
+                # Flattening for an opaque target composites the alpha away
+                transparent = transparent and flat_mode in ('RGBA', 'LA', 'PA', 'P')
+    cost = sum(_step_cost(before, after) for before, after in zip(steps, steps[1:]))
+    peak = max([frame_bytes(steps[0].mode, steps[0].size)] +
+               [frame_bytes(before.mode, before.size) + frame_bytes(after.mode, after.size)
+                for before, after in zip(steps, steps[1:])])
+    return Plan(steps, cost, peak)
+
+
+def plan_pipeline(mode, transparent, source_size, output_size, target_format):
+    """Return the cheapest Plan that turns a decoded image into the target's mode and size."""
+    target_format = target_format.lower()
+    plans = [_build(order, mode, transparent, source_size, output_size, target_format)
+             for order in (['resize', 'flatten'], ['flatten', 'resize'])]
+    return min(plans, key=lambda plan: (plan.cost, plan.peak_bytes))
+
+
+def run_pipeline(img, output_size, target_format):
+    """
+    Resize img to output_size and convert it for target_format along the
+    cheapest plan. The plan and its expected peak are added to the record
+    of an instrumented conversion.
+    """
+    plan = plan_pipeline(img.mode, has_transparency(img), img.size, output_size, target_format)
+    recorder = current_recorder()
+    if recorder is not None:
+        recorder.details['pipeline'] = [f"{step.name} {step.mode} {step.size[0]}x{step.size[1]}"
+                                        for step in plan.steps]
+        recorder.details['pipeline_peak_bytes'] = plan.peak_bytes
+
+    for step in plan.steps[1:]:
+        if step.name == 'resize':
+            with stage('resize'):
+                img = resize_image(img, step.size)
+        elif step.name == 'prepare':
+            with stage('flatten'):
+                img = img.convert(step.mode)
+        else:
+            with stage('flatten'):
+                img = flatten_for_format(img, target_format)
+    return img
@@ -0,0 +1,13 @@
+class ConversionCancelled(Exception):
+    """Raised when a conversion is cancelled before it finished."""
+
+
+def report_progress(progress, fraction, is_cancelled=None):
+    """
+    Report progress (0.0 - 1.0) to an optional callback and stop the
+    conversion if the caller asked to cancel it.
+    """
+    if is_cancelled is not None and is_cancelled():
+        raise ConversionCancelled("Conversion cancelled")
+    if progress is not None:
+        progress(fraction)
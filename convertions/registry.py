@@ -0,0 +1,276 @@
+"""
+Registry of converters and routing between formats.
+
+Each converter declares the formats it reads, the formats it writes and
+its cost. A conversion that no single converter offers is routed through
+the cheapest chain of converters (Dijkstra over formats), so adding one
+converter makes every format it connects to reachable from everywhere
+else. The target lists in the GUI are derived from the registry.
+
+Between hops the intermediate file is handed on by path: every hop but
+the last writes to a temporary directory that is removed once the route
+is done, and the next hop reads that file where it is. Only the last hop
+writes to the output path.
+
+This module must stay cheap to import (the GUI imports it at startup),
+so the converters import their libraries when they run.
+"""
+from collections import namedtuple
+import heapq
+import os
+import sys
+import tempfile
+
+from convertions.progress import report_progress
+from convertions.sniff import IMAGE_FORMATS, canonical_format, detect_format
+
+# Cost is milliseconds per MB of input, measured with benchmarks/engines.py
+# on the default corpus. HOP_COST is added per hop for the hand-off.
+HOP_COST = 10
+
+# Image formats Pillow writes for us, in menu order
+IMAGE_TARGETS = ['png', 'jpg', 'webp', 'gif', 'bmp', 'tiff']
+# Targets in the order menus list them; formats not listed here come after, sorted
+MENU_ORDER = IMAGE_TARGETS + ['pdf', 'docx', 'odt']
+
+# function(source_path, output_path, source_format, target_format, options)
+# converts source_path and writes output_path, or when output_path is None
+# writes a file in options['temp_dir'] and returns its path. A first_hop converter
+# only runs on the input file itself, e.g. because it writes a file per page
+# and the pages option only applies to the first hop.
+Converter = namedtuple('Converter', ['name', 'sources', 'targets', 'cost', 'function', 'first_hop'])
+
+
+def hop_output(output_path, target_format, options):
+    """The path a hop writes: output_path, or a file in the route's temporary directory."""
+    return output_path or os.path.join(options['temp_dir'], f"output.{target_format}")
+
+
+class Registry:
+    """Converters by name, with cached cheapest routes between formats."""
+
+    def __init__(self):
+        self.converters = {}
+        self._routes = {}
+
+    def register(self, name, sources, targets, cost, function, first_hop=False):
+        """Add a converter, replacing any converter registered under the same name."""
+        self.converters[name] = Converter(name, [canonical_format(fmt) for fmt in sources],
+                                          [canonical_format(fmt) for fmt in targets], cost, function, first_hop)
+        self._routes.clear()
+
+    def _edges(self, source_format, first):
+        for converter in self.converters.values():
+            if source_format in converter.sources and (first or not converter.first_hop):
+                for target_format in converter.targets:
+                    yield converter, target_format
+
+    def routes_from(self, source_format):
+        """
+        Return {target: (cost, [(converter, hop target), ...])} for every
+        reachable format. Images can also be converted to their own format.
+        """
+        source_format = canonical_format(source_format)
+        if source_format in self._routes:
+            return self._routes[source_format]
+
+        best = {source_format: (0, [])}
+        queue = [(0, 0, source_format)]
+        counter = 1   # breaks cost ties in insertion order, so routes are deterministic
+        while queue:
+            cost, _, fmt = heapq.heappop(queue)
+            if cost > best[fmt][0]:
+                continue
+            for converter, target_format in self._edges(fmt, fmt == source_format):
+                if target_format == source_format:
+                    continue
+                new_cost = cost + converter.cost + HOP_COST
+                if target_format not in best or new_cost < best[target_format][0]:
+                    best[target_format] = (new_cost, best[fmt][1] + [(converter, target_format)])
+                    heapq.heappush(queue, (new_cost, counter, target_format))
+                    counter += 1
+        del best[source_format]
+        if source_format in IMAGE_FORMATS:
+            # Re-encoding an image as its own format still applies the scale
+            same = [(converter.cost + HOP_COST, [(converter, target_format)])
+                    for converter, target_format in self._edges(source_format, True) if target_format == source_format]
+            if same:
+                best[source_format] = min(same, key=lambda route: route[0])
+        self._routes[source_format] = best
+        return best
+
+    def find_route(self, source_format, target_format):
+        """Return the cheapest list of (converter, hop target), or raise ValueError."""
+        source_format, target_format = canonical_format(source_format), canonical_format(target_format)
+        route = self.routes_from(source_format).get(target_format)
+        if route is None:
+            raise ValueError(f"Conversion from {source_format} to {target_format} not supported yet")
+        return route[1]
+
+    def targets(self, source_format):
+        """Every format source_format can be converted to, in menu order."""
+        return sort_formats(self.routes_from(source_format))
+
+    def all_targets(self):
+        """Every format some converter writes, in menu order."""
+        return sort_formats({fmt for converter in self.converters.values() for fmt in converter.targets})
+
+    def convert(self, input_path, output_path, target_format, source_format=None,
+                progress=None, is_cancelled=None, **options):
+        """
+        Convert input_path to target_format along the cheapest route.
+        options (scale, pages, workers...) go to every converter, which use
+        the ones that apply to them. Progress is split evenly over the hops.
+        """
+        source_format = canonical_format(source_format or detect_format(input_path))
+        route = self.find_route(source_format, target_format)
+        with tempfile.TemporaryDirectory(prefix="kommverters-") as temp_dir:
+            source = input_path
+            for index, (converter, hop_target) in enumerate(route):
+                report_progress(progress, index / len(route), is_cancelled)
+                last = index == len(route) - 1
+                hop_options = dict(options, temp_dir=temp_dir, is_cancelled=is_cancelled,
+                                   progress=_hop_progress(progress, index, len(route)))
+                if index:
+                    # Scale and page selection describe the source, the first hop applies them
+                    hop_options.pop('scale', None)
+                    hop_options.pop('pages', None)
+                source = converter.function(source, output_path if last else None,
+                                            source_format, hop_target, hop_options)
+                source_format = hop_target
+        report_progress(progress, 1.0)
+        return True
+
+
+def _hop_progress(progress, index, count):
+    """Map a hop's 0.0 - 1.0 progress into its share of the whole route."""
+    if progress is None:
+        return None
+    return lambda fraction: progress((index + fraction) / count)
+
+
+def sort_formats(formats):
+    """Sort format names in menu order."""
+    return sorted(formats, key=lambda fmt: (MENU_ORDER.index(fmt) if fmt in MENU_ORDER else len(MENU_ORDER), fmt))
+
+
+def _convert_image(source, output_path, source_format, target_format, options):
+    from convertions.images import convert_image
+
+    target = hop_output(output_path, target_format, options)
+    convert_image(source, target, target_format, options.get('scale', 1.0),
+                  progress=options['progress'], is_cancelled=options['is_cancelled'])
+    return target
+
+
+def _image_to_pdf(source, output_path, source_format, target_format, options):
+    from convertions.instrument import stage
+    from convertions.images import open_image, scaled_size
+    from convertions.pipeline import run_pipeline
+
+    scale = options.get('scale', 1.0)
+    with stage('open'):
+        img, (width, height) = open_image(source, scale)
+    with stage('decode'):
+        img.load()
+    # PDF pages hold RGB, grayscale or CMYK; transparency is composited on white
+    img = run_pipeline(img, scaled_size(width, height, scale), 'pdf')
+    target = hop_output(output_path, target_format, options)
+    with stage('encode'):
+        img.save(target, format='PDF')
+    return target
+
+
+def _pdf_to_docx(source, output_path, source_format, target_format, options):
+    from convertions.documents import pdf_to_docx
+
+    target = hop_output(output_path, target_format, options)
+    pdf_to_docx(source, target, pages=options.get('pages'), workers=options.get('workers', 1),
+                progress=options['progress'], is_cancelled=options['is_cancelled'])
+    return target
+
+
+def _pdf_to_image(source, output_path, source_format, target_format, options):
+    from convertions.documents import DEFAULT_DPI, pdf_to_images
+
+    # One file per page; scale makes the pages smaller like it does images
+    outputs = pdf_to_images(source, hop_output(output_path, target_format, options), target_format,
+                            options.get('dpi', DEFAULT_DPI) * options.get('scale', 1.0), options.get('pages'),
+                            options.get('workers', 1), options['progress'], options['is_cancelled'])
+    if output_path is None and len(outputs) > 1:
+        raise ValueError("Only a single PDF page can be converted on to another format")
+    return outputs[0]
+
+
+def _doc_to_pdf(source, output_path, source_format, target_format, options):
+    from convertions.documents import doc_to_pdf
+
+    target = hop_output(output_path, target_format, options)
+    doc_to_pdf(source, target)
+    return target
+
+
+def _office_to_pdf(source, output_path, source_format, target_format, options):
+    from convertions.instrument import stage
+    from convertions.office import office_convert
+
+    target = hop_output(output_path, target_format, options)
+    with stage('convert'):
+        office_convert(source, target, target_format)
+    return target
+
+
+def _text_to_pdf(source, output_path, source_format, target_format, options):
+    from convertions.instrument import stage
+    from convertions.textdocs import text_to_pdf
+
+    target = hop_output(output_path, target_format, options)
+    with stage('convert'):
+        text_to_pdf(source, target, options['progress'], options['is_cancelled'])
+    return target
+
+
+def _text_document(source, output_path, source_format, target_format, options):
+    from convertions.instrument import stage
+    from convertions.textdocs import convert_text_document
+
+    target = hop_output(output_path, target_format, options)
+    with stage('convert'):
+        convert_text_document(source, target, source_format, target_format,
+                              options['progress'], options['is_cancelled'])
+    return target
+
+
+registry = Registry()
+registry.register('image', IMAGE_FORMATS, IMAGE_TARGETS, 300, _convert_image)
+registry.register('image-pdf', IMAGE_FORMATS, ['pdf'], 20, _image_to_pdf)
+registry.register('pdf2docx', ['pdf'], ['docx'], 15000, _pdf_to_docx)
+registry.register('pdf-raster', ['pdf'], IMAGE_TARGETS, 3500, _pdf_to_image, first_hop=True)
+# Streaming converters of convertions.textdocs, measured on a 195 MB log,
+# a 79 MB RTF and the 39 MB DOCX and ODT made from the log
+registry.register('text-pdf', ['txt'], ['pdf'], 35, _text_to_pdf)
+registry.register('text-office', ['txt'], ['docx', 'odt'], 55, _text_document)
+registry.register('rtf-office', ['rtf'], ['docx', 'odt'], 180, _text_document)
+registry.register('odt-docx', ['odt', 'docx'], ['docx', 'odt'], 430, _text_document)
+if sys.platform in ('win32', 'darwin'):
+    # docx2pdf drives Word, whose start-up dominates; it cannot be benchmarked on Linux
+    registry.register('docx2pdf', ['doc', 'docx'], ['pdf'], 20000, _doc_to_pdf)
+else:
+    # Word does not run here. A LibreOffice kept running between jobs
+    # instead; not installed on the benchmark machine, so an estimate
+    registry.register('libreoffice', ['doc', 'docx', 'odt', 'rtf'], ['pdf'], 10000, _office_to_pdf)
+
+# Every target format, in menu order
+TARGET_FORMATS = registry.all_targets()
+
+
+def conversion_targets(source_format):
+    """Return the formats source_format can be converted to, in menu order."""
+    return registry.targets(source_format)
+
+
+def convert_file(input_path, output_path, target_format, source_format=None,
+                 progress=None, is_cancelled=None, **options):
+    """Convert input_path to target_format with the default registry."""
+    return registry.convert(input_path, output_path, target_format, source_format,
+                            progress, is_cancelled, **options)
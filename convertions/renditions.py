@@ -0,0 +1,156 @@
+"""
+One decode, many outputs: an image at several scales in several formats.
+
+convert_renditions() opens and decodes the source once (JPEG drafted for
+the largest scale asked for), resamples it to every distinct output size
+and encodes each size in every requested format. Sizes are made largest
+first, and each is resampled from the smallest size already made that is
+still at least REDUCING_GAP times larger: the final LANCZOS pass then sees
+as much detail as resize_image()'s reduce() shortcut would leave it, at a
+fraction of the pixels. The flatten for each format runs on the resized
+frame, and the flatten and encode of every output run on a thread pool,
+Pillow releasing the GIL in both, while the next size is being resampled.
+
+Animated sources are converted one rendition at a time by convert_image,
+which keeps them animated. Every output is renamed into place only once
+complete.
+"""
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+import os
+
+from convertions.formats import atomic_output
+from convertions.images import (PIL_FORMATS, REDUCING_GAP, flatten_for_format, has_transparency, open_image,
+                                resample_mode, resize_image, scaled_size)
+from convertions.instrument import current_recorder, stage
+from convertions.progress import report_progress
+
+# One output: the scale of the source it is made at, its format and path
+Rendition = namedtuple('Rendition', ['scale', 'target_format', 'output_path'])
+
+
+def rendition_path(input_path, scale, target_format, output_directory=""):
+    """'photo@0.5x.webp' next to the input, or inside output_directory."""
+    directory = output_directory if output_directory else os.path.dirname(input_path)
+    base_name = os.path.splitext(os.path.basename(input_path))[0]
+    return os.path.join(directory, f"{base_name}@{scale:g}x.{target_format}")
+
+
+def make_renditions(input_path, scales, target_formats, output_directory=""):
+    """Every scale-by-format combination of input_path, as Renditions."""
+    return [Rendition(scale, target_format.lower(),
+                      rendition_path(input_path, scale, target_format.lower(), output_directory))
+            for scale in scales for target_format in target_formats]
+
+
+def plan_renditions(source_size, sizes):
+    """
+    Return [(size, parent size)] for the distinct sizes, largest first.
+    parent is the size each one is resampled from, None for the decoded image.
+    """
+    made = []
+    plan = []
+    for size in sorted(set(sizes), key=lambda s: s[0] * s[1], reverse=True):
+        parent = None
+        if size != source_size:
+            parents = [m for m in made if m[0] >= size[0] * REDUCING_GAP and m[1] >= size[1] * REDUCING_GAP]
+            if parents:
+                parent = min(parents, key=lambda m: m[0] * m[1])
+            made.append(size)
+        plan.append((size, parent))
+    return plan
+
+
+def _encode(frame, target_format, output_path, shared):
+    img = flatten_for_format(frame, target_format)
+    if img is frame and shared:
+        # save() keeps per-call state on the image, so concurrent encodes need their own
+        img = frame.copy()
+    with atomic_output(output_path) as partial_path:
+        img.save(partial_path, format=PIL_FORMATS[target_format])
+
+
+def convert_renditions(input_path, renditions, workers=None, progress=None, is_cancelled=None):
+    """
+    Write every Rendition of input_path from a single decode. Encodes run on
+    workers threads (default: one per CPU, at most one per output).
+    progress is called with a 0.0 - 1.0 fraction as outputs complete and
+    is_cancelled is polled between sizes.
+    """
+    try:
+        for rendition in renditions:
+            if rendition.target_format not in PIL_FORMATS:
+                raise ValueError(f"Unsupported target format: {rendition.target_format}")
+            if rendition.scale <= 0:
+                raise ValueError(f"Scale must be greater than 0: {rendition.scale}")
+        report_progress(progress, 0.0, is_cancelled)
+        with stage('open'):
+            img, (width, height) = open_image(input_path, max(r.scale for r in renditions))
+
+        if getattr(img, 'is_animated', False):
+            from convertions.images import convert_image
+            img.close()
+            for index, rendition in enumerate(renditions):
+                with atomic_output(rendition.output_path) as partial_path:
+                    convert_image(input_path, partial_path, rendition.target_format, rendition.scale)
+                print(f"Successfully converted {input_path} to {rendition.output_path}")
+                report_progress(progress, (index + 1) / len(renditions), is_cancelled)
+            return True
+
+        with stage('decode'):
+            img.load()
+        report_progress(progress, 0.2, is_cancelled)
+
+        by_size = {}
+        for rendition in renditions:
+            by_size.setdefault(scaled_size(width, height, rendition.scale), []).append(rendition)
+        plan = plan_renditions(img.size, by_size)
+        recorder = current_recorder()
+        if recorder is not None:
+            recorder.details['renditions'] = [
+                f"{size[0]}x{size[1]} from " + (f"{parent[0]}x{parent[1]}" if parent else "decode")
+                for size, parent in plan]
+
+        # Sizes are resampled from a mode LANCZOS works in; the decoded image
+        # itself is only encoded at full size, so e.g. a palette GIF stays one
+        work_mode = resample_mode(img.mode, has_transparency(img))
+        prepared = None
+        frames = {}
+        futures = []
+        done = 0
+        with ThreadPoolExecutor(max_workers=min(len(renditions), workers or os.cpu_count() or 1)) as executor:
+            try:
+                for size, parent in plan:
+                    if size == img.size:
+                        frame = img
+                    else:
+                        if parent is None and prepared is None:
+                            with stage('flatten'):
+                                prepared = img.convert(work_mode) if img.mode != work_mode else img
+                        with stage('resize'):
+                            frame = resize_image(frames[parent] if parent else prepared, size)
+                        frames[size] = frame
+                    shared = len(by_size[size]) > 1
+                    for rendition in by_size[size]:
+                        futures.append(executor.submit(_encode, frame, rendition.target_format,
+                                                       rendition.output_path, shared))
+                    report_progress(progress, 0.2 + 0.3 * len(futures) / len(renditions), is_cancelled)
+
+                with stage('encode'):
+                    for future in futures:
+                        future.result()
+                        done += 1
+                        report_progress(progress, 0.5 + 0.5 * done / len(renditions), is_cancelled)
+            except BaseException:
+                # Outputs not started yet are dropped; running ones are left to finish
+                for future in futures:
+                    future.cancel()
+                raise
+
+        for rendition in renditions:
+            print(f"Successfully converted {input_path} to {rendition.output_path}")
+        return True
+
+    except Exception as e:
+        print(f"Conversion failed: {e}")
+        raise
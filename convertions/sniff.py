@@ -0,0 +1,285 @@
+"""
+Identify file formats from their leading bytes.
+
+One small read per file is enough to tell every supported format apart and,
+for images, to read the dimensions and mode from the header without
+decoding any pixels. The only extra reads are seeks to structures the
+header points at: a TIFF's first IFD and JPEG segments past the buffer.
+"""
+from collections import namedtuple
+import os
+import struct
+import zipfile
+
+# Input extensions handled by convert_image
+IMAGE_FORMATS = ['png', 'jpg', 'jpeg', 'gif', 'bmp', 'webp', 'tif', 'tiff']
+
+# Dictionary mapping document extensions to their document types
+DOCUMENT_FORMATS = {
+    'doc': 'word',
+    'docx': 'word',
+    'pdf': 'pdf',
+    'txt': 'text',
+    'rtf': 'rtf',
+    'odt': 'odt'
+}
+
+# Extensions that name the same format as a canonical one
+FORMAT_ALIASES = {'jpeg': 'jpg', 'tif': 'tiff'}
+
+# Targets with a quality setting, which can be encoded to a file size
+TARGET_SIZE_FORMATS = ['jpg', 'jpeg', 'webp']
+
+HEADER_SIZE = 4096
+
+# format: canonical name ('jpg', 'docx', ...), kind: 'image' or 'document',
+# width/height/mode: image header fields, None for documents or if unknown.
+# mode is what Pillow reports, except grayscale palettes, which read as 'P'.
+FileInfo = namedtuple('FileInfo', ['format', 'kind', 'width', 'height', 'mode'])
+
+OLE2_MAGIC = b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1'
+ODT_MIMETYPE = b'application/vnd.oasis.opendocument.text'
+
+# PNG colour type -> Pillow mode, for 8 bit samples
+PNG_MODES = {0: 'L', 2: 'RGB', 3: 'P', 4: 'LA', 6: 'RGBA'}
+# JPEG components -> Pillow mode
+JPEG_MODES = {1: 'L', 3: 'RGB', 4: 'CMYK'}
+
+
+def canonical_format(fmt):
+    """Return the canonical lower-case name for a format or extension."""
+    fmt = fmt.lower().lstrip('.')
+    return FORMAT_ALIASES.get(fmt, fmt)
+
+
+def extension_format(path):
+    """Return the canonical format implied by path's extension."""
+    return canonical_format(os.path.splitext(path)[1])
+
+
+def format_kind(fmt):
+    """Return 'image', 'document' or None for a format name."""
+    if fmt in IMAGE_FORMATS:
+        return 'image'
+    if fmt in DOCUMENT_FORMATS:
+        return 'document'
+    return None
+
+
+def _png(header):
+    if header[12:16] != b'IHDR':
+        return None, None, None
+    width, height, depth, colour = struct.unpack('>IIBB', header[16:26])
+    mode = PNG_MODES.get(colour)
+    if depth == 1 and colour == 0:
+        mode = '1'
+    elif depth == 16 and colour == 0:
+        mode = 'I;16'
+    return width, height, mode
+
+
+def _jpeg(f, header):
+    """Walk JPEG segments to the first SOF marker, seeking past the buffer if needed."""
+    # header holds the file's bytes from buffer_start on
+    buffer_start = 0
+    position = 2
+    while True:
+        offset = position - buffer_start
+        if offset + 10 > len(header):
+            # The segment lies beyond the buffer, jump straight to it
+            f.seek(position)
+            header = f.read(HEADER_SIZE)
+            buffer_start = position
+            offset = 0
+            if len(header) < 4:
+                return None, None, None
+        if header[offset] != 0xFF:
+            return None, None, None
+        marker = header[offset + 1]
+        if marker == 0xFF:
+            position += 1
+            continue
+        # SOF0-SOF15, except DHT (C4), JPG (C8) and DAC (CC)
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height, width, components = struct.unpack('>HHB', header[offset + 5:offset + 10])
+            return width, height, JPEG_MODES.get(components)
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+            position += 2
+            continue
+        length = struct.unpack('>H', header[offset + 2:offset + 4])[0]
+        position += 2 + length
+
+
+def _gif(header):
+    width, height = struct.unpack('<HH', header[6:10])
+    return width, height, 'P'
+
+
+def _bmp(header):
+    dib_size, width, height = struct.unpack('<Iii', header[14:26])
+    if dib_size == 12:
+        width, height, bits = struct.unpack('<HHxxH', header[18:26])
+    else:
+        bits = struct.unpack('<H', header[28:30])[0]
+    mode = {1: '1', 4: 'P', 8: 'P', 16: 'RGB', 24: 'RGB', 32: 'RGB'}.get(bits)
+    # V3 headers and later carry an alpha mask
+    if bits == 32 and dib_size >= 56 and len(header) >= 70 and struct.unpack('<I', header[66:70])[0]:
+        mode = 'RGBA'
+    return width, abs(height), mode
+
+
+def _webp(header):
+    chunk = header[12:16]
+    if chunk == b'VP8 ':
+        width, height = struct.unpack('<HH', header[26:30])
+        return width & 0x3FFF, height & 0x3FFF, 'RGB'
+    if chunk == b'VP8L':
+        bits = struct.unpack('<I', header[21:25])[0]
+        width = (bits & 0x3FFF) + 1
+        height = ((bits >> 14) & 0x3FFF) + 1
+        has_alpha = (bits >> 28) & 1
+        return width, height, 'RGBA' if has_alpha else 'RGB'
+    if chunk == b'VP8X':
+        flags = header[20]
+        width = int.from_bytes(header[24:27], 'little') + 1
+        height = int.from_bytes(header[27:30], 'little') + 1
+        return width, height, 'RGBA' if flags & 0x10 else 'RGB'
+    return None, None, None
+
+
+def _tiff(f, header):
+    """Read the size and mode from the first IFD, wherever it is in the file."""
+    order = '<' if header[:2] == b'II' else '>'
+    ifd_offset = struct.unpack(order + 'I', header[4:8])[0]
+    f.seek(ifd_offset)
+    count_bytes = f.read(2)
+    if len(count_bytes) < 2:
+        return None, None, None
+    count = struct.unpack(order + 'H', count_bytes)[0]
+    entries = f.read(count * 12)
+    tags = {}
+    for index in range(len(entries) // 12):
+        tag, kind, _ = struct.unpack(order + 'HHI', entries[index * 12:index * 12 + 8])
+        value = entries[index * 12 + 8:index * 12 + 12]
+        if kind == 3:  # SHORT, the first value is inline
+            tags[tag] = struct.unpack(order + 'H', value[:2])[0]
+        elif kind == 4:  # LONG
+            tags[tag] = struct.unpack(order + 'I', value)[0]
+    width, height = tags.get(256), tags.get(257)
+    samples = tags.get(277, 1)
+    # With several samples BitsPerSample is an offset to a list, assume 8 bits
+    bits = tags.get(258, 1) if samples == 1 else 8
+    photometric = tags.get(262)
+    mode = None
+    if photometric in (0, 1) and samples == 2:
+        mode = 'LA'
+    elif photometric in (0, 1):
+        mode = {1: '1', 8: 'L', 16: 'I;16'}.get(bits)
+    elif photometric in (2, 6):
+        mode = 'RGBA' if samples == 4 else 'RGB'
+    elif photometric == 3:
+        mode = 'P'
+    elif photometric == 5:
+        mode = 'CMYK'
+    return width, height, mode
+
+
+def _zip_document(path, header):
+    """Tell DOCX and ODT apart by their first entries, or the central directory."""
+    if header[30:38] == b'mimetype' and header[38:38 + len(ODT_MIMETYPE)] == ODT_MIMETYPE:
+        return 'odt'
+    if b'word/' in header:
+        return 'docx'
+    try:
+        with zipfile.ZipFile(path) as archive:
+            names = archive.namelist()
+    except zipfile.BadZipFile:
+        return None
+    if 'word/document.xml' in names:
+        return 'docx'
+    if 'content.xml' in names and 'mimetype' in names:
+        return 'odt'
+    return None
+
+
+def _is_text(header):
+    """Plain text has no NUL bytes and few control characters."""
+    if not header or b'\x00' in header:
+        return False
+    control = sum(1 for byte in header if byte < 0x20 and byte not in b'\t\n\r\f\b\x1b')
+    return control <= len(header) // 100
+
+
+def _image_format(header):
+    """Return the image format whose magic bytes start header, or None."""
+    if header.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'png'
+    if header.startswith(b'\xff\xd8\xff'):
+        return 'jpg'
+    if header[:6] in (b'GIF87a', b'GIF89a'):
+        return 'gif'
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'webp'
+    if header[:2] == b'BM' and len(header) >= 30:
+        return 'bmp'
+    if header[:4] in (b'II*\x00', b'MM\x00*'):
+        return 'tiff'
+    return None
+
+
+def _document_format(path, header):
+    """Return the document format whose magic bytes start header, or None."""
+    # Only a BOM or whitespace may come before the header; text merely mentioning it stays text
+    if header.removeprefix(b'\xef\xbb\xbf').lstrip()[:5] == b'%PDF-':
+        return 'pdf'
+    if header.startswith(b'PK\x03\x04'):
+        return _zip_document(path, header)
+    if header.startswith(OLE2_MAGIC):
+        return 'doc'
+    if header.startswith(b'{\\rtf'):
+        return 'rtf'
+    if _is_text(header):
+        return 'txt'
+    return None
+
+
+def sniff_file(path):
+    """
+    Identify path from its content and return a FileInfo, or None if the
+    format is not one Kommverters handles.
+    """
+    with open(path, 'rb') as f:
+        header = f.read(HEADER_SIZE)
+        fmt = _image_format(header)
+        if fmt is None:
+            fmt = _document_format(path, header)
+            if fmt is None:
+                return None
+            return FileInfo(fmt, 'document', None, None, None)
+
+        try:
+            if fmt == 'png':
+                width, height, mode = _png(header)
+            elif fmt == 'jpg':
+                width, height, mode = _jpeg(f, header)
+            elif fmt == 'gif':
+                width, height, mode = _gif(header)
+            elif fmt == 'webp':
+                width, height, mode = _webp(header)
+            elif fmt == 'bmp':
+                width, height, mode = _bmp(header)
+            else:
+                width, height, mode = _tiff(f, header)
+        except (struct.error, IndexError):
+            # Truncated header: the magic matched, the fields did not
+            width = height = mode = None
+    return FileInfo(fmt, 'image', width, height, mode)
+
+
+def detect_format(path):
+    """Return the canonical format of path from its content, or from its extension if unknown."""
+    try:
+        info = sniff_file(path)
+    except OSError:
+        info = None
+    return info.format if info else extension_format(path)
@@ -0,0 +1,135 @@
+"""
+Encode an image so the output fits a byte budget.
+
+Trial encodes run in memory on a thread pool; Pillow releases the GIL
+while encoding, so the trials really run in parallel. Each round encodes
+one quality per worker, spread evenly over the range still in play, so a
+round shrinks the range by a factor of workers + 1 (plain bisection with
+one worker). If even the lowest quality is too big, the image is scaled
+down by the square root of the overshoot and searched again. Only the
+chosen candidate is written to disk.
+"""
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+import math
+import os
+
+from convertions.images import PIL_FORMATS, open_image, scaled_size
+from convertions.instrument import stage
+from convertions.pipeline import run_pipeline
+from convertions.progress import report_progress
+from convertions.sniff import TARGET_SIZE_FORMATS
+
+MIN_QUALITY = 5
+MAX_QUALITY = 95
+MIN_SCALE = 0.05
+# Shrink a little more than the size ratio suggests, so the next search usually fits
+SCALE_MARGIN = 0.95
+MAX_SCALE_STEPS = 6
+
+# size in bytes, the quality and scale used, and how many trial encodes it took
+SizeSearchResult = namedtuple('SizeSearchResult', ['size', 'quality', 'scale', 'trials'])
+
+
+def _encode(img, target_format, quality):
+    # save() stores its options on the image, so concurrent trials each need their own
+    img = img.copy()
+    buffer = BytesIO()
+    options = {'quality': quality}
+    if target_format in ['jpg', 'jpeg']:
+        options['optimize'] = True
+    img.save(buffer, format=PIL_FORMATS[target_format], **options)
+    return buffer.getvalue()
+
+
+def _candidates(fits, fails, count):
+    """Up to count qualities spread evenly strictly between fits and fails."""
+    span = fails - fits
+    qualities = {fits + round(span * i / (count + 1)) for i in range(1, count + 1)}
+    return sorted(q for q in qualities if fits < q < fails)
+
+
+def search_quality(img, target_format, max_bytes, executor, workers, is_cancelled=None):
+    """
+    Find the highest quality whose encoding of img fits in max_bytes.
+    Returns (quality, data, trials); quality is None if nothing fits, and
+    data is then the MIN_QUALITY encoding, the smallest one tried.
+    """
+    # Highest quality known to fit and lowest known not to, just outside the range at first
+    fits, fails = MIN_QUALITY - 1, MAX_QUALITY + 1
+    best = smallest = None
+    trials = 0
+    while fails - fits > 1:
+        report_progress(None, 0.0, is_cancelled)
+        qualities = _candidates(fits, fails, workers)
+        encoded = list(executor.map(lambda q: _encode(img, target_format, q), qualities))
+        trials += len(qualities)
+        for quality, data in zip(qualities, encoded):
+            if len(data) <= max_bytes:
+                if quality > fits:
+                    fits, best = quality, data
+            elif quality < fails:
+                fails = quality
+                if quality == MIN_QUALITY:
+                    smallest = data
+        # Sizes are not strictly monotonic in quality; keep the bounds ordered
+        if fits >= fails:
+            fails = fits + 1
+    if best is None:
+        return None, smallest, trials
+    return fits, best, trials
+
+
+def encode_to_size(input_path, output_path, target_format, max_bytes, scale=1.0,
+                   allow_downscale=True, workers=None, progress=None, is_cancelled=None):
+    """
+    Save input_path as target_format (JPEG or WEBP) at the highest quality
+    that fits in max_bytes, scaling down further if allowed and needed.
+    Returns a SizeSearchResult.
+    """
+    target_format = target_format.lower()
+    if target_format not in TARGET_SIZE_FORMATS:
+        raise ValueError(f"Target size needs a format with a quality setting, not {target_format}")
+    if max_bytes <= 0:
+        raise ValueError("Target size must be greater than 0")
+
+    try:
+        report_progress(progress, 0.0, is_cancelled)
+        with stage('open'):
+            source, (width, height) = open_image(input_path, scale)
+        with stage('decode'):
+            source.load()
+        report_progress(progress, 0.2, is_cancelled)
+
+        workers = workers or os.cpu_count() or 1
+        trials = 0
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for step in range(MAX_SCALE_STEPS):
+                img = run_pipeline(source, scaled_size(width, height, scale), target_format)
+                # The trial encodes run on the pool, so cpu here covers only this thread
+                with stage('encode'):
+                    quality, data, spent = search_quality(img, target_format, max_bytes, executor,
+                                                          workers, is_cancelled)
+                trials += spent
+                report_progress(progress, 0.2 + 0.7 * (step + 1) / MAX_SCALE_STEPS, is_cancelled)
+                if quality is not None:
+                    break
+                if not allow_downscale or scale <= MIN_SCALE:
+                    break
+                scale = max(MIN_SCALE, scale * math.sqrt(max_bytes / len(data)) * SCALE_MARGIN)
+
+        if quality is None:
+            raise ValueError(f"Cannot fit {os.path.basename(input_path)} in {max_bytes} bytes "
+                             f"(smallest was {len(data)} bytes after {trials} trial encodes)")
+
+        with stage('write'), open(output_path, 'wb') as f:
+            f.write(data)
+        report_progress(progress, 1.0)
+        print(f"Fit {input_path} in {len(data)} bytes at quality {quality}, scale {scale:.2f} "
+              f"({trials} trial encodes)")
+        return SizeSearchResult(len(data), quality, scale, trials)
+
+    except Exception as e:
+        print(f"Conversion failed: {e}")
+        raise
@@ -0,0 +1,724 @@
+"""
+Streaming converters between plain text, RTF, ODT and DOCX, and from plain
+text to PDF, in pure Python.
+
+A reader turns its input into Paragraphs one at a time and a writer streams
+them into the output, so memory stays flat however large the input is:
+text is read line by line, RTF is tokenized a chunk at a time, and the XML
+inside ODT and DOCX files is parsed incrementally, every paragraph dropped
+from the tree once it is handed on. ZIP members are compressed as they are
+written and PDF pages are written as soon as they are full.
+
+Only what every one of these formats can hold is carried over: paragraphs,
+headings, bold, italic and underline, tabs and line breaks. Lists and
+tables come out as their paragraphs; images, notes and comments are left
+out.
+"""
+from collections import namedtuple
+from array import array
+import codecs
+import os
+import re
+import zipfile
+import zlib
+from xml.etree.ElementTree import iterparse, parse
+
+from convertions.progress import report_progress
+
+# text holds '\t' for tabs and '\n' for line breaks
+Run = namedtuple('Run', ['text', 'bold', 'italic', 'underline'])
+# heading is the outline level 1-6, 0 for body text
+Paragraph = namedtuple('Paragraph', ['runs', 'heading'])
+
+READ_SIZE = 1 << 20
+WRITE_SIZE = 1 << 16
+# Longer lines of text are split into several paragraphs
+MAX_LINE_LENGTH = 8192
+# Paragraphs between progress reports
+REPORT_EVERY = 4096
+
+# Characters XML 1.0 cannot hold are dropped, the rest escaped in one pass
+XML_ESCAPES = {ord('&'): '&amp;', ord('<'): '&lt;', ord('>'): '&gt;'}
+XML_ESCAPES.update((code, None) for code in range(32) if chr(code) not in '\t\n')
+
+
+def _xml_text(text):
+    return text.translate(XML_ESCAPES)
+
+
+def _write_parts(f, start, parts, end):
+    """Write start, every string of parts and end to the binary stream f, WRITE_SIZE at a time."""
+    f.write(start.encode('utf-8'))
+    buffer = []
+    size = 0
+    for part in parts:
+        buffer.append(part)
+        size += len(part)
+        if size >= WRITE_SIZE:
+            f.write(''.join(buffer).encode('utf-8'))
+            buffer = []
+            size = 0
+    buffer.append(end)
+    f.write(''.join(buffer).encode('utf-8'))
+
+
+def _needs_zip64(input_path):
+    """
+    Whether an output member may pass 2 GB. Word refuses some ZIP64 files, so
+    it is only used for inputs big enough to get there, with every short line
+    of text becoming a paragraph of markup.
+    """
+    return os.path.getsize(input_path) > zipfile.ZIP64_LIMIT // 64
+
+
+# Plain text
+
+def _text_encoding(path):
+    """UTF-8 or UTF-16 going by the BOM, else UTF-8 if the first MB decodes as UTF-8, else cp1252."""
+    with open(path, 'rb') as f:
+        sample = f.read(READ_SIZE)
+    if sample.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig'
+    if sample.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return 'utf-16'
+    try:
+        # Incremental, so a character cut off at the end of the sample is fine
+        codecs.getincrementaldecoder('utf-8')().decode(sample)
+    except UnicodeDecodeError:
+        return 'cp1252'
+    return 'utf-8'
+
+
+def text_lines(path, report):
+    """Yield the lines of a text file without their line ends, calling report(fraction read) now and then."""
+    size = max(os.path.getsize(path), 1)
+    with open(path, encoding=_text_encoding(path), errors='replace', newline=None) as f:
+        count = 0
+        for line in iter(lambda: f.readline(MAX_LINE_LENGTH), ''):
+            yield line[:-1] if line.endswith('\n') else line
+            count += 1
+            if count % REPORT_EVERY == 0:
+                report(f.buffer.tell() / size)
+
+
+def read_text(path, report):
+    """Every line of a text file as a Paragraph."""
+    for line in text_lines(path, report):
+        yield Paragraph([Run(line, False, False, False)], 0)
+
+
+# RTF
+
+RTF_TOKEN = re.compile(rb"\\([a-zA-Z]{1,32})(-?\d{1,10})? ?|\\'([0-9a-fA-F]{2})|\\([^a-zA-Z])|([{}])|[\r\n]+"
+                       rb"|([^\\{}\r\n]+)")
+# A control word is at most this long, so tokens starting further from the end of a chunk are complete
+RTF_TOKEN_MARGIN = 48
+# Groups that hold no body text
+RTF_SKIP_DESTINATIONS = {
+    'fonttbl', 'colortbl', 'stylesheet', 'info', 'pict', 'object', 'header', 'headerl', 'headerr',
+    'headerf', 'footer', 'footerl', 'footerr', 'footerf', 'footnote', 'annotation', 'fldinst',
+    'themedata', 'colorschememapping', 'datastore', 'latentstyles', 'listtable', 'listoverridetable',
+    'rsidtbl', 'generator', 'xmlnstbl', 'filetbl', 'revtbl', 'nonshppict', 'shpinst',
+}
+RTF_CHARACTERS = {
+    'line': '\n', 'tab': '\t', 'emdash': '\u2014', 'endash': '\u2013', 'bullet': '\u2022',
+    'lquote': '\u2018', 'rquote': '\u2019', 'ldblquote': '\u201c', 'rdblquote': '\u201d',
+    'emspace': '\u2003', 'enspace': '\u2002', 'qmspace': '\u2005',
+}
+RTF_SYMBOLS = {b'~': '\u00a0', b'_': '\u2011', b'\\': '\\', b'{': '{', b'}': '}'}
+SURROGATES = re.compile('[\ud800-\udfff]')
+
+
+class _RtfParser:
+    """Turns RTF into Paragraphs, a chunk of bytes at a time."""
+
+    def __init__(self):
+        # Group state, saved on '{' and restored on '}'
+        self.skip = False
+        self.format = (False, False, False)   # bold, italic, underline
+        self.uc = 1                           # fallback characters after a \u
+        self.stack = []
+        self.codec = 'cp1252'
+        self.heading = 0
+        self.runs = []                # [[text pieces], format]
+        self.pending = bytearray()    # text in the document's code page, not decoded yet
+        self.skip_chars = 0
+        self.skip_bytes = 0
+        self.paragraphs = []
+
+    def feed(self, data, final):
+        """Parse data and return how many bytes were used; the rest comes again with the next chunk."""
+        position = 0
+        end = len(data)
+        limit = end if final else end - RTF_TOKEN_MARGIN
+        while position < end:
+            if self.skip_bytes:
+                skipped = min(self.skip_bytes, end - position)
+                self.skip_bytes -= skipped
+                position += skipped
+                continue
+            if position >= limit:
+                break
+            match = RTF_TOKEN.match(data, position)
+            if match is None:
+                # A lone backslash at the very end
+                position += 1
+                continue
+            position = match.end()
+            word, number, hex_code, symbol, brace, text = match.groups()
+            if text is not None:
+                if self.skip_chars:
+                    cut = min(self.skip_chars, len(text))
+                    self.skip_chars -= cut
+                    text = text[cut:]
+                if not self.skip:
+                    self.pending += text
+            elif hex_code is not None:
+                if self.skip_chars:
+                    self.skip_chars -= 1
+                elif not self.skip:
+                    self.pending.append(int(hex_code, 16))
+            elif word is not None or symbol is not None or brace is not None:
+                self._decode_pending()
+                if brace == b'{':
+                    self.stack.append((self.skip, self.format, self.uc))
+                    self.skip_chars = 0
+                elif brace == b'}':
+                    if self.stack:
+                        self.skip, self.format, self.uc = self.stack.pop()
+                    self.skip_chars = 0
+                elif self.skip_chars:
+                    self.skip_chars -= 1
+                elif word is not None:
+                    self._control_word(word.decode('ascii'), number)
+                else:
+                    self._control_symbol(symbol)
+        if final:
+            self._decode_pending()
+            if self.runs:
+                self._end_paragraph()
+        return position
+
+    def _control_word(self, word, number):
+        if word == 'bin':
+            self.skip_bytes = int(number or 0)
+        elif word in RTF_SKIP_DESTINATIONS:
+            self.skip = True
+        elif word == 'u':
+            code = int(number or 0)
+            if not self.skip:
+                self._add(chr(code + 65536 if code < 0 else code))
+            self.skip_chars = self.uc
+        elif word == 'uc':
+            self.uc = int(number or 1)
+        elif word == 'ansicpg':
+            try:
+                self.codec = codecs.lookup(f"cp{int(number or 1252)}").name
+            except LookupError:
+                pass
+        elif self.skip:
+            return
+        elif word in ('par', 'sect', 'page'):
+            self._end_paragraph()
+        elif word in RTF_CHARACTERS:
+            self._add(RTF_CHARACTERS[word])
+        elif word in ('b', 'i', 'ul', 'ulnone', 'uld', 'uldb', 'ulw', 'plain'):
+            bold, italic, underline = self.format
+            on = number != b'0'
+            if word == 'b':
+                bold = on
+            elif word == 'i':
+                italic = on
+            elif word == 'plain':
+                bold = italic = underline = False
+            else:
+                underline = on and word != 'ulnone'
+            self.format = (bold, italic, underline)
+        elif word == 'pard':
+            self.heading = 0
+        elif word == 'outlinelevel':
+            level = int(number or 0) + 1
+            self.heading = level if 1 <= level <= 6 else 0
+
+    def _control_symbol(self, symbol):
+        if symbol == b'*':
+            # Optional destinations are all ones without body text
+            self.skip = True
+        elif self.skip:
+            return
+        elif symbol in (b'\n', b'\r'):
+            self._end_paragraph()
+        elif symbol in RTF_SYMBOLS:
+            self._add(RTF_SYMBOLS[symbol])
+
+    def _decode_pending(self):
+        if self.pending:
+            self._add(self.pending.decode(self.codec, 'replace'))
+            self.pending.clear()
+
+    def _add(self, text):
+        if self.runs and self.runs[-1][1] == self.format:
+            self.runs[-1][0].append(text)
+        else:
+            self.runs.append(([text], self.format))
+
+    def _end_paragraph(self):
+        runs = []
+        for pieces, (bold, italic, underline) in self.runs:
+            text = ''.join(pieces)
+            if SURROGATES.search(text):
+                # Characters outside the BMP come as two \u surrogates
+                text = text.encode('utf-16-le', 'surrogatepass').decode('utf-16-le', 'replace')
+            runs.append(Run(text, bold, italic, underline))
+        self.paragraphs.append(Paragraph(runs, self.heading))
+        self.runs = []
+
+
+def read_rtf(path, report):
+    """Every paragraph of an RTF file, parsed READ_SIZE bytes at a time."""
+    size = max(os.path.getsize(path), 1)
+    parser = _RtfParser()
+    with open(path, 'rb') as f:
+        data = b''
+        while True:
+            chunk = f.read(READ_SIZE)
+            data += chunk
+            used = parser.feed(data, final=not chunk)
+            data = data[used:]
+            yield from parser.paragraphs
+            parser.paragraphs = []
+            if not chunk:
+                break
+            report(f.tell() / size)
+
+
+# ODT and DOCX, read with iterparse
+
+def _read_paragraphs(stream, size, paragraph_tags, make_paragraph, report, on_end=None):
+    """
+    Yield make_paragraph(element) for every paragraph element of an XML
+    stream that is not inside another paragraph. Elements are removed from
+    the tree once they end outside a paragraph, so it never grows.
+    on_end(element, parent) sees every element ending outside a paragraph.
+    """
+    stack = []
+    depth = 0   # open paragraph elements
+    count = 0
+    for event, element in iterparse(stream, ('start', 'end')):
+        if event == 'start':
+            stack.append(element)
+            if element.tag in paragraph_tags:
+                depth += 1
+            continue
+        stack.pop()
+        if element.tag in paragraph_tags:
+            depth -= 1
+            if depth:
+                # In a text box or note of another paragraph
+                continue
+            yield make_paragraph(element)
+            count += 1
+            if count % REPORT_EVERY == 0:
+                report(stream.tell() / size)
+        elif depth:
+            continue
+        elif on_end is not None:
+            on_end(element, stack[-1] if stack else None)
+        if stack:
+            stack[-1].remove(element)
+
+
+ODT_OFFICE = '{urn:oasis:names:tc:opendocument:xmlns:office:1.0}'
+ODT_TEXT = '{urn:oasis:names:tc:opendocument:xmlns:text:1.0}'
+ODT_STYLE = '{urn:oasis:names:tc:opendocument:xmlns:style:1.0}'
+ODT_FO = '{urn:oasis:names:tc:opendocument:xmlns:xsl-fo-compatible:1.0}'
+ODT_DRAW = '{urn:oasis:names:tc:opendocument:xmlns:drawing:1.0}'
+ODT_PARAGRAPHS = {ODT_TEXT + 'p', ODT_TEXT + 'h'}
+ODT_SKIP = {ODT_TEXT + 'note', ODT_OFFICE + 'annotation', ODT_DRAW + 'frame'}
+ODT_MIMETYPE = 'application/vnd.oasis.opendocument.text'
+
+
+def _odt_format(properties):
+    """(bold, italic, underline) of a style:text-properties element."""
+    weight = properties.get(ODT_FO + 'font-weight', 'normal')
+    return (weight == 'bold' or (weight.isdigit() and int(weight) >= 600),
+            properties.get(ODT_FO + 'font-style', 'normal') in ('italic', 'oblique'),
+            properties.get(ODT_STYLE + 'text-underline-style', 'none') != 'none')
+
+
+def _odt_runs(element, fmt, styles, runs):
+    if element.text:
+        runs.append(Run(element.text, *fmt))
+    for child in element:
+        tag = child.tag
+        if tag == ODT_TEXT + 's':
+            runs.append(Run(' ' * int(child.get(ODT_TEXT + 'c', 1)), *fmt))
+        elif tag == ODT_TEXT + 'tab':
+            runs.append(Run('\t', *fmt))
+        elif tag == ODT_TEXT + 'line-break':
+            runs.append(Run('\n', *fmt))
+        elif tag not in ODT_SKIP:
+            # Spans, links, fields: their own style if they have one
+            _odt_runs(child, styles.get(child.get(ODT_TEXT + 'style-name'), fmt), styles, runs)
+        if child.tail:
+            runs.append(Run(child.tail, *fmt))
+
+
+def read_odt(path, report):
+    """Every paragraph and heading of an ODT document, text styles resolved from its automatic styles."""
+    # Only automatic styles are read; the ones they inherit from live in styles.xml
+    styles = {}
+
+    def style_end(element, parent):
+        if element.tag == ODT_STYLE + 'text-properties' and parent is not None and parent.tag == ODT_STYLE + 'style':
+            styles[parent.get(ODT_STYLE + 'name')] = _odt_format(element)
+
+    def make_paragraph(element):
+        runs = []
+        heading = 0
+        fmt = styles.get(element.get(ODT_TEXT + 'style-name'), (False, False, False))
+        if element.tag == ODT_TEXT + 'h':
+            heading = min(max(int(element.get(ODT_TEXT + 'outline-level', 1)), 1), 6)
+            # The weight of a heading style belongs to the heading level, not to its text
+            fmt = (False, False, False)
+        _odt_runs(element, fmt, styles, runs)
+        return Paragraph(runs, heading)
+
+    with zipfile.ZipFile(path) as archive, archive.open('content.xml') as f:
+        size = max(archive.getinfo('content.xml').file_size, 1)
+        yield from _read_paragraphs(f, size, ODT_PARAGRAPHS, make_paragraph, report, style_end)
+
+
+W = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+# Children of paragraphs whose text is not part of the document
+DOCX_SKIP = {W + 'pPr', W + 'del', W + 'moveFrom'}
+HEADING_NAME = re.compile(r'heading\s*(\d)$', re.IGNORECASE)
+
+
+def _on(element):
+    """Whether a toggle property such as w:b is present and not switched off."""
+    return element is not None and element.get(W + 'val', 'true') not in ('0', 'false', 'off', 'none')
+
+
+def _docx_runs(element, runs):
+    for child in element:
+        tag = child.tag
+        if tag == W + 'r':
+            properties = child.find(W + 'rPr')
+            fmt = ((False, False, False) if properties is None else
+                   (_on(properties.find(W + 'b')), _on(properties.find(W + 'i')), _on(properties.find(W + 'u'))))
+            for part in child:
+                if part.tag == W + 't':
+                    if part.text:
+                        runs.append(Run(part.text, *fmt))
+                elif part.tag == W + 'tab':
+                    runs.append(Run('\t', *fmt))
+                elif part.tag in (W + 'br', W + 'cr'):
+                    runs.append(Run('\n', *fmt))
+                elif part.tag == W + 'noBreakHyphen':
+                    runs.append(Run('\u2011', *fmt))
+        elif tag not in DOCX_SKIP:
+            # Hyperlinks, insertions, simple fields, smart tags
+            _docx_runs(child, runs)
+
+
+def _docx_heading_styles(archive):
+    """{style id: outline level} of the heading styles, which are named 'heading N' in every language."""
+    try:
+        f = archive.open('word/styles.xml')
+    except KeyError:
+        return {}
+    levels = {}
+    with f:
+        for style in parse(f).getroot().iter(W + 'style'):
+            name = style.find(W + 'name')
+            outline = style.find(f'{W}pPr/{W}outlineLvl')
+            match = HEADING_NAME.match(name.get(W + 'val', '')) if name is not None else None
+            if match:
+                levels[style.get(W + 'styleId')] = int(match.group(1))
+            elif outline is not None:
+                levels[style.get(W + 'styleId')] = int(outline.get(W + 'val', 9)) + 1
+    return {style_id: level for style_id, level in levels.items() if 1 <= level <= 6}
+
+
+def read_docx(path, report):
+    """Every paragraph of a DOCX document's body, with headings from its paragraph styles."""
+    def make_paragraph(element):
+        runs = []
+        _docx_runs(element, runs)
+        heading = 0
+        properties = element.find(W + 'pPr')
+        if properties is not None:
+            style = properties.find(W + 'pStyle')
+            outline = properties.find(W + 'outlineLvl')
+            if outline is not None:
+                level = int(outline.get(W + 'val', 9)) + 1
+                heading = level if 1 <= level <= 6 else 0
+            elif style is not None:
+                heading = headings.get(style.get(W + 'val'), 0)
+        return Paragraph(runs, heading)
+
+    with zipfile.ZipFile(path) as archive:
+        headings = _docx_heading_styles(archive)
+        with archive.open('word/document.xml') as f:
+            size = max(archive.getinfo('word/document.xml').file_size, 1)
+            yield from _read_paragraphs(f, size, {W + 'p'}, make_paragraph, report)
+
+
+# Writers
+
+DOCX_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/word/document.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+    '<Override PartName="/word/styles.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.styles+xml"/>'
+    '</Types>')
+DOCX_RELATIONSHIPS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Target="word/document.xml" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>'
+    '</Relationships>')
+DOCX_DOCUMENT_RELATIONSHIPS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" Target="styles.xml" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles"/>'
+    '</Relationships>')
+# Heading sizes in points, by level
+HEADING_SIZES = [20, 16, 14, 13, 12, 11]
+DOCX_STYLES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    f'<w:styles xmlns:w="{W[1:-1]}">'
+    '<w:style w:type="paragraph" w:default="1" w:styleId="Normal"><w:name w:val="Normal"/>'
+    '<w:rPr><w:sz w:val="22"/></w:rPr></w:style>'
+    '<w:style w:type="paragraph" w:styleId="PlainText"><w:name w:val="Plain Text"/>'
+    '<w:basedOn w:val="Normal"/><w:pPr><w:spacing w:after="0" w:line="240" w:lineRule="auto"/></w:pPr>'
+    '<w:rPr><w:rFonts w:ascii="Courier New" w:hAnsi="Courier New" w:cs="Courier New"/>'
+    '<w:sz w:val="20"/></w:rPr></w:style>'
+    + ''.join(f'<w:style w:type="paragraph" w:styleId="Heading{level}"><w:name w:val="heading {level}"/>'
+              f'<w:basedOn w:val="Normal"/><w:next w:val="Normal"/>'
+              f'<w:pPr><w:keepNext/><w:spacing w:before="240" w:after="60"/><w:outlineLvl w:val="{level - 1}"/>'
+              f'</w:pPr><w:rPr><w:b/><w:sz w:val="{size * 2}"/></w:rPr></w:style>'
+              for level, size in enumerate(HEADING_SIZES, 1))
+    + '</w:styles>')
+DOCX_DOCUMENT_START = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    f'<w:document xmlns:w="{W[1:-1]}"><w:body>')
+# A4 with 2 cm margins, in twentieths of a point
+DOCX_DOCUMENT_END = ('<w:sectPr><w:pgSz w:w="11906" w:h="16838"/>'
+                     '<w:pgMar w:top="1134" w:right="1134" w:bottom="1134" w:left="1134" '
+                     'w:header="709" w:footer="709" w:gutter="0"/></w:sectPr></w:body></w:document>')
+DOCX_TEXT_BREAKS = {ord('\t'): '</w:t><w:tab/><w:t xml:space="preserve">',
+                    ord('\n'): '</w:t><w:br/><w:t xml:space="preserve">'}
+
+
+def _docx_paragraphs(paragraphs, monospace):
+    body_properties = '<w:pPr><w:pStyle w:val="PlainText"/></w:pPr>' if monospace else ''
+    for paragraph in paragraphs:
+        parts = [f'<w:p><w:pPr><w:pStyle w:val="Heading{paragraph.heading}"/></w:pPr>' if paragraph.heading
+                 else '<w:p>' + body_properties]
+        for run in paragraph.runs:
+            if not run.text:
+                continue
+            parts.append('<w:r>')
+            if run.bold or run.italic or run.underline:
+                parts.append('<w:rPr>' + ('<w:b/>' if run.bold else '') + ('<w:i/>' if run.italic else '')
+                             + ('<w:u w:val="single"/>' if run.underline else '') + '</w:rPr>')
+            parts.append('<w:t xml:space="preserve">' + _xml_text(run.text).translate(DOCX_TEXT_BREAKS)
+                         + '</w:t></w:r>')
+        parts.append('</w:p>')
+        yield ''.join(parts)
+
+
+def write_docx(paragraphs, output_path, monospace=False, zip64=False):
+    """Write paragraphs to a DOCX file, plain text paragraphs in Courier New if monospace."""
+    with zipfile.ZipFile(output_path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr('[Content_Types].xml', DOCX_CONTENT_TYPES)
+        archive.writestr('_rels/.rels', DOCX_RELATIONSHIPS)
+        archive.writestr('word/_rels/document.xml.rels', DOCX_DOCUMENT_RELATIONSHIPS)
+        archive.writestr('word/styles.xml', DOCX_STYLES)
+        with archive.open('word/document.xml', 'w', force_zip64=zip64) as f:
+            _write_parts(f, DOCX_DOCUMENT_START, _docx_paragraphs(paragraphs, monospace), DOCX_DOCUMENT_END)
+
+
+ODT_NAMESPACES = ('xmlns:office="urn:oasis:names:tc:opendocument:xmlns:office:1.0" '
+                  'xmlns:style="urn:oasis:names:tc:opendocument:xmlns:style:1.0" '
+                  'xmlns:text="urn:oasis:names:tc:opendocument:xmlns:text:1.0" '
+                  'xmlns:fo="urn:oasis:names:tc:opendocument:xmlns:xsl-fo-compatible:1.0"')
+ODT_MANIFEST = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    '<manifest:manifest xmlns:manifest="urn:oasis:names:tc:opendocument:xmlns:manifest:1.0" '
+    'manifest:version="1.2">'
+    f'<manifest:file-entry manifest:full-path="/" manifest:version="1.2" manifest:media-type="{ODT_MIMETYPE}"/>'
+    '<manifest:file-entry manifest:full-path="content.xml" manifest:media-type="text/xml"/>'
+    '</manifest:manifest>')
+# Paragraph styles Mono and H1-H6, text styles T1-T7 for the bold (1), italic (2) and underline (4) combinations
+ODT_CONTENT_START = (
+    '<?xml version="1.0" encoding="UTF-8"?>\n'
+    f'<office:document-content {ODT_NAMESPACES} office:version="1.2"><office:automatic-styles>'
+    '<style:style style:name="Mono" style:family="paragraph"><style:paragraph-properties fo:margin-top="0cm" '
+    'fo:margin-bottom="0cm"/><style:text-properties fo:font-family="\'Courier New\'" fo:font-size="10pt"/>'
+    '</style:style>'
+    + ''.join(f'<style:style style:name="H{level}" style:family="paragraph" style:default-outline-level="{level}">'
+              f'<style:paragraph-properties fo:margin-top="0.42cm" fo:margin-bottom="0.1cm" '
+              f'fo:keep-with-next="always"/><style:text-properties fo:font-size="{size}pt" fo:font-weight="bold"/>'
+              f'</style:style>'
+              for level, size in enumerate(HEADING_SIZES, 1))
+    + ''.join(f'<style:style style:name="T{bits}" style:family="text"><style:text-properties'
+              + (' fo:font-weight="bold"' if bits & 1 else '') + (' fo:font-style="italic"' if bits & 2 else '')
+              + (' style:text-underline-style="solid" style:text-underline-width="auto" '
+                 'style:text-underline-color="font-color"' if bits & 4 else '')
+              + '/></style:style>'
+              for bits in range(1, 8))
+    + '</office:automatic-styles><office:body><office:text>')
+ODT_CONTENT_END = '</office:text></office:body></office:document-content>'
+ODT_TEXT_BREAKS = {ord('\t'): '<text:tab/>', ord('\n'): '<text:line-break/>'}
+# ODF collapses runs of spaces, all but the first are written as text:s
+ODT_SPACES = re.compile('(?<= ) +|^ +')
+
+
+def _odt_spaces(match):
+    count = len(match.group())
+    return '<text:s/>' if count == 1 else f'<text:s text:c="{count}"/>'
+
+
+def _odt_paragraphs(paragraphs, monospace):
+    body_start, body_end = ('<text:p text:style-name="Mono">', '</text:p>') if monospace else ('<text:p>', '</text:p>')
+    for paragraph in paragraphs:
+        if paragraph.heading:
+            level = paragraph.heading
+            parts = [f'<text:h text:style-name="H{level}" text:outline-level="{level}">']
+        else:
+            parts = [body_start]
+        for run in paragraph.runs:
+            if not run.text:
+                continue
+            text = ODT_SPACES.sub(_odt_spaces, _xml_text(run.text)).translate(ODT_TEXT_BREAKS)
+            bits = run.bold | run.italic << 1 | run.underline << 2
+            parts.append(f'<text:span text:style-name="T{bits}">{text}</text:span>' if bits else text)
+        parts.append('</text:h>' if paragraph.heading else body_end)
+        yield ''.join(parts)
+
+
+def write_odt(paragraphs, output_path, monospace=False, zip64=False):
+    """Write paragraphs to an ODT file, plain text paragraphs in Courier New if monospace."""
+    with zipfile.ZipFile(output_path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        # The mimetype comes first and uncompressed, so the file can be identified by its first bytes
+        archive.writestr('mimetype', ODT_MIMETYPE, compress_type=zipfile.ZIP_STORED)
+        archive.writestr('META-INF/manifest.xml', ODT_MANIFEST)
+        with archive.open('content.xml', 'w', force_zip64=zip64) as f:
+            _write_parts(f, ODT_CONTENT_START, _odt_paragraphs(paragraphs, monospace), ODT_CONTENT_END)
+
+
+# Plain text to PDF
+
+# A4 in points with 2 cm margins, in 10 pt Courier, whose glyphs are all 0.6 em wide
+PDF_PAGE_WIDTH, PDF_PAGE_HEIGHT = 595, 842
+PDF_MARGIN = 56
+PDF_FONT_SIZE = 10
+PDF_LEADING = 12
+PDF_COLUMNS = int((PDF_PAGE_WIDTH - 2 * PDF_MARGIN) / (0.6 * PDF_FONT_SIZE))
+PDF_ROWS = int((PDF_PAGE_HEIGHT - 2 * PDF_MARGIN) / PDF_LEADING)
+PDF_ESCAPES = {ord('\\'): '\\\\', ord('('): '\\(', ord(')'): '\\)', ord('\r'): None}
+# Objects 1 and 2 are written last, once the number of pages is known; page n has objects 4 + 2n and 5 + 2n
+PDF_CATALOG, PDF_PAGES, PDF_FONT, PDF_FIRST_PAGE = 1, 2, 3, 4
+
+
+class _PdfWriter:
+    """Writes a PDF of Courier text pages, each page as soon as it is full."""
+
+    def __init__(self, f):
+        self.f = f
+        self.offsets = array('q', [0] * PDF_FIRST_PAGE)   # by object number, 0 is the free list head
+        self.pages = 0
+        f.write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+        self._object(PDF_FONT, b'<< /Type /Font /Subtype /Type1 /BaseFont /Courier /Encoding /WinAnsiEncoding >>')
+
+    def _object(self, number, body):
+        if number >= len(self.offsets):
+            self.offsets.extend([0] * (number + 1 - len(self.offsets)))
+        self.offsets[number] = self.f.tell()
+        self.f.write(b'%d 0 obj\n' % number + body + b'\nendobj\n')
+
+    def page(self, lines):
+        top = PDF_PAGE_HEIGHT - PDF_MARGIN - PDF_FONT_SIZE + PDF_LEADING
+        text = ''.join(f"({line.translate(PDF_ESCAPES)}) '\n" for line in lines)
+        content = zlib.compress(f"BT /F{PDF_FONT} {PDF_FONT_SIZE} Tf {PDF_LEADING} TL {PDF_MARGIN} {top} Td\n"
+                                f"{text}ET".encode('cp1252', 'replace'))
+        number = PDF_FIRST_PAGE + 2 * self.pages
+        self._object(number, b'<< /Length %d /Filter /FlateDecode >>\nstream\n' % len(content)
+                     + content + b'\nendstream')
+        self._object(number + 1, b'<< /Type /Page /Parent %d 0 R /Contents %d 0 R >>' % (PDF_PAGES, number))
+        self.pages += 1
+
+    def close(self):
+        if not self.pages:
+            self.page([])
+        kids = b' '.join(b'%d 0 R' % (PDF_FIRST_PAGE + 2 * page + 1) for page in range(self.pages))
+        self._object(PDF_PAGES, b'<< /Type /Pages /Count %d /MediaBox [0 0 %d %d] /Resources << /Font << /F%d %d 0 R '
+                     b'>> >> /Kids [%s] >>' % (self.pages, PDF_PAGE_WIDTH, PDF_PAGE_HEIGHT, PDF_FONT, PDF_FONT, kids))
+        self._object(PDF_CATALOG, b'<< /Type /Catalog /Pages %d 0 R >>' % PDF_PAGES)
+        xref = self.f.tell()
+        self.f.write(b'xref\n0 %d\n0000000000 65535 f \n' % len(self.offsets))
+        for start in range(1, len(self.offsets), 4096):
+            self.f.write(b''.join(b'%010d 00000 n \n' % offset for offset in self.offsets[start:start + 4096]))
+        # %%%%EOF formats to the %%EOF marker
+        self.f.write(b'trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n'
+                     % (len(self.offsets), PDF_CATALOG, xref))
+
+
+def text_to_pdf(input_path, output_path, progress=None, is_cancelled=None):
+    """
+    Typeset a text file in Courier on A4 pages, wrapping long lines and
+    starting a new page at form feeds. Characters outside Windows-1252
+    print as '?'.
+    """
+    report = lambda fraction: report_progress(progress, fraction, is_cancelled)
+    with open(output_path, 'wb') as f:
+        writer = _PdfWriter(f)
+        rows = []
+        for line in text_lines(input_path, report):
+            for index, part in enumerate(line.expandtabs(8).split('\f')):
+                if index:
+                    writer.page(rows)
+                    rows = []
+                for start in range(0, max(len(part), 1), PDF_COLUMNS):
+                    rows.append(part[start:start + PDF_COLUMNS])
+                    if len(rows) == PDF_ROWS:
+                        writer.page(rows)
+                        rows = []
+        if rows:
+            writer.page(rows)
+        writer.close()
+    report_progress(progress, 1.0)
+    return True
+
+
+READERS = {'txt': read_text, 'rtf': read_rtf, 'odt': read_odt, 'docx': read_docx}
+WRITERS = {'docx': write_docx, 'odt': write_odt}
+
+
+def streams(source_format, target_format):
+    """Whether source_format is converted to target_format here, in flat memory."""
+    return (source_format in READERS and target_format in WRITERS) or (source_format, target_format) == ('txt', 'pdf')
+
+
+def convert_text_document(input_path, output_path, source_format, target_format, progress=None, is_cancelled=None):
+    """
+    Convert a TXT, RTF, ODT or DOCX file to DOCX or ODT, paragraph by
+    paragraph. progress is called with the fraction of the input read and
+    is_cancelled is checked as often.
+    """
+    if source_format not in READERS or target_format not in WRITERS:
+        raise ValueError(f"Conversion from {source_format} to {target_format} not supported")
+    report = lambda fraction: report_progress(progress, fraction, is_cancelled)
+    paragraphs = READERS[source_format](input_path, report)
+    WRITERS[target_format](paragraphs, output_path, monospace=source_format == 'txt',
+                           zip64=_needs_zip64(input_path))
+    report_progress(progress, 1.0)
+    return True
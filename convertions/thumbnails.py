@@ -0,0 +1,87 @@
+"""
+Small previews of images and of the first page of PDFs.
+
+Images are decoded at reduced size (JPEG draft plus reducing_gap), never at
+full resolution. Rendered thumbnails are stored as PNG in a size-bounded
+on-disk cache keyed by path, size and mtime, so reopening a file or a
+folder shows its previews without decoding anything.
+"""
+import hashlib
+import os
+import tempfile
+
+from PIL import Image
+
+from convertions.cache import get_cache
+from convertions.images import REDUCING_GAP
+from convertions.formats import THUMBNAIL_SIZE
+from convertions.sniff import IMAGE_FORMATS, detect_format
+
+THUMBNAIL_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "kommverters", "thumbnails")
+THUMBNAIL_CACHE_BYTES = 64 * 1024 * 1024
+
+
+def thumbnail_key(file_path, size=THUMBNAIL_SIZE):
+    """Cache key for a thumbnail: changes whenever the file is modified."""
+    stat = os.stat(file_path)
+    identity = f"{os.path.abspath(file_path)}\0{stat.st_mtime_ns}\0{stat.st_size}\0{size}"
+    return hashlib.blake2b(identity.encode(), digest_size=20).hexdigest()
+
+
+def _pdf_first_page(file_path, size):
+    try:
+        import fitz
+    except ImportError:
+        raise ImportError("PyMuPDF is required for PDF previews. Install it with: pip install PyMuPDF")
+    with fitz.open(file_path) as doc:
+        page = doc[0]
+        zoom = size / max(page.rect.width, page.rect.height)
+        pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+        return Image.frombytes('RGB', (pix.width, pix.height), pix.samples)
+
+
+def render_thumbnail(file_path, size=THUMBNAIL_SIZE):
+    """
+    Return a PIL image that fits in size x size, or None if file_path has
+    no visual preview (documents other than PDF).
+    """
+    source_format = detect_format(file_path)
+    if source_format == 'pdf':
+        return _pdf_first_page(file_path, size)
+    if source_format not in IMAGE_FORMATS:
+        return None
+
+    # Closed once the first frame is loaded; animations keep their file open otherwise
+    with Image.open(file_path) as source:
+        img = source
+        if img.format == 'JPEG':
+            img.draft(img.mode, (int(size * REDUCING_GAP), int(size * REDUCING_GAP)))
+        if img.mode not in ('RGB', 'RGBA', 'L', 'LA'):
+            img = img.convert('RGBA')
+        img.thumbnail((size, size), Image.LANCZOS, reducing_gap=REDUCING_GAP)
+        img.load()
+    return img
+
+
+def get_thumbnail(file_path, size=THUMBNAIL_SIZE, cache_dir=THUMBNAIL_CACHE_DIR,
+                  max_bytes=THUMBNAIL_CACHE_BYTES):
+    """
+    Return the path of a PNG thumbnail of file_path, rendering and caching
+    it on a miss. Returns None if the file has no preview.
+    """
+    cache = get_cache(cache_dir, max_bytes)
+    key = thumbnail_key(file_path, size)
+    path = cache.lookup(key)
+    if path is not None:
+        return path
+
+    img = render_thumbnail(file_path, size)
+    if img is None:
+        return None
+    fd, temp_path = tempfile.mkstemp(suffix='.png')
+    os.close(fd)
+    try:
+        img.save(temp_path, format='PNG')
+        return cache.store(key, temp_path)
+    finally:
+        os.remove(temp_path)
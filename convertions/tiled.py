@@ -0,0 +1,398 @@
+"""
+Bounded-memory image conversion.
+
+The source is processed in horizontal bands: each band is decoded,
+flattened, resampled and handed to a streaming encoder before the next
+one is read, so the working set stays under a memory ceiling instead of
+growing with the full raster.
+
+Sources stored as uncompressed rows (raw TIFF strips, BMP, PPM) or as
+several small strips are decoded band by band. Other sources (PNG,
+compressed TIFF, JPEG) have to be decoded whole, but the flattening,
+resampling and encoding still run per band without extra full-size
+copies; JPEG sources use draft mode to decode at reduced size first.
+
+PNG and TIFF output is written row by row. Pillow cannot encode JPEG
+incrementally, so JPEG output is assembled at output size and saved once.
+Any other target falls back to convert_image.
+"""
+import math
+import os
+import struct
+import zlib
+
+from PIL import Image, ImageChops, ImageFile
+
+from convertions.images import (
+    PIL_FORMATS, convert_image, flatten_for_format, has_transparency, open_image, scaled_size
+)
+from convertions.instrument import stage
+from convertions.progress import report_progress
+
+DEFAULT_MEMORY_LIMIT = 256 * 1024 * 1024
+
+# Bytes per pixel for the modes a band can be processed in
+MODE_BYTES = {'L': 1, 'LA': 2, 'RGB': 3, 'RGBA': 4, 'CMYK': 4}
+
+# Bits per pixel for raw layouts that can be sliced into rows
+RAWMODE_BITS = {
+    '1': 1, 'L': 8, 'P': 8, 'LA': 16, 'RGB': 24, 'BGR': 24, 'BGR;24': 24,
+    'RGBA': 32, 'RGBX': 32, 'BGRA': 32, 'BGRX': 32, 'CMYK': 32
+}
+
+# Rough number of band-sized buffers alive at once (source, working copy, output)
+BAND_COPIES = 3
+
+# Output targets that tiled conversion can write
+TILED_FORMATS = ['png', 'tiff', 'jpg', 'jpeg']
+
+_Tile = getattr(ImageFile, '_Tile', None)
+
+
+def _make_tile(codec, extents, offset, args):
+    if _Tile is not None:
+        return _Tile(codec, extents, offset, args)
+    return (codec, extents, offset, args)
+
+
+class _StreamingBandReader:
+    """Decode only the rows of a band, by rewriting the decoder tile list."""
+
+    def __init__(self, input_path, tiles, size, mode):
+        self.input_path = input_path
+        self.tiles = tiles
+        self.width, self.height = size
+        self.mode = mode
+
+    @classmethod
+    def open(cls, input_path, band_limit):
+        """Return a reader, or None if the layout cannot be read band by band."""
+        img = Image.open(input_path)
+        if getattr(img, 'use_load_libtiff', False) or getattr(img, 'n_frames', 1) > 1:
+            return None
+        tiles = []
+        for codec, extents, offset, args in img.tile:
+            x0, y0, x1, y1 = extents
+            if codec == 'raw' and (x0, x1) == (0, img.width):
+                args = tuple(args) if isinstance(args, (tuple, list)) else (args,)
+                rawmode = args[0]
+                stride = args[1] if len(args) > 1 else 0
+                orientation = args[2] if len(args) > 2 else 1
+                if not stride:
+                    bits = RAWMODE_BITS.get(rawmode)
+                    if bits is None:
+                        return None
+                    stride = (img.width * bits + 7) // 8
+                if orientation not in (1, -1):
+                    return None
+                tiles.append(('raw', extents, offset, (rawmode, stride, orientation)))
+            elif (x1 - x0) * (y1 - y0) * MODE_BYTES.get(img.mode, 4) <= band_limit:
+                # Compressed strips are decoded whole, which is fine while they are small
+                tiles.append((codec, extents, offset, args))
+            else:
+                return None
+        if not tiles:
+            return None
+        return cls(input_path, tiles, img.size, img.mode)
+
+    def read(self, top, bottom):
+        """Decode source rows [top, bottom) into a new image."""
+        selected = []
+        for codec, (x0, y0, x1, y1), offset, args in self.tiles:
+            if y1 <= top or y0 >= bottom:
+                continue
+            if codec == 'raw':
+                # Raw rows can be addressed directly, keep only the rows we need
+                rawmode, stride, orientation = args
+                start, end = max(y0, top), min(y1, bottom)
+                if orientation == 1:
+                    offset += (start - y0) * stride
+                else:
+                    offset += (y1 - end) * stride
+                y0, y1 = start, end
+            selected.append((codec, (x0, y0, x1, y1), offset, args))
+
+        band_top = min(tile[1][1] for tile in selected)
+        band_bottom = max(tile[1][3] for tile in selected)
+        # Opening from a file object keeps Pillow from memory-mapping the
+        # whole source, which would page every band into memory
+        with open(self.input_path, 'rb') as fp:
+            img = Image.open(fp)
+            img._size = (self.width, band_bottom - band_top)
+            if hasattr(img, '_tile_size'):
+                # TIFF allocates its decode buffer from this, not from size
+                img._tile_size = img._size
+            img.tile = [
+                _make_tile(codec, (x0, y0 - band_top, x1, y1 - band_top), offset, args)
+                for codec, (x0, y0, x1, y1), offset, args in selected
+            ]
+            img.load()
+        if (band_top, band_bottom) == (top, bottom):
+            return img
+        return img.crop((0, top - band_top, self.width, bottom - band_top))
+
+
+class _DecodedBandReader:
+    """Fallback reader: decode the whole source once and hand out bands of it."""
+
+    def __init__(self, img):
+        img.load()
+        self.img = img
+        self.width, self.height = img.size
+        self.mode = img.mode
+
+    def read(self, top, bottom):
+        return self.img.crop((0, top, self.width, bottom))
+
+
+class _PngWriter:
+    """Write 8-bit PNG rows as they arrive, using the Sub filter on every row."""
+
+    COLOR_TYPES = {'L': 0, 'RGB': 2, 'LA': 4, 'RGBA': 6}
+
+    def __init__(self, output_path, size, mode, compress_level=6):
+        self.fp = open(output_path, 'wb')
+        self.width, self.height = size
+        self.compressor = zlib.compressobj(compress_level)
+        self.fp.write(b'\x89PNG\r\n\x1a\n')
+        self._chunk(b'IHDR', struct.pack('>IIBBBBB', self.width, self.height, 8, self.COLOR_TYPES[mode], 0, 0, 0))
+
+    def _chunk(self, kind, data):
+        self.fp.write(struct.pack('>I', len(data)))
+        self.fp.write(kind)
+        self.fp.write(data)
+        self.fp.write(struct.pack('>I', zlib.crc32(data, zlib.crc32(kind)) & 0xffffffff))
+
+    def write(self, band):
+        # Sub filter: each byte minus the same channel of the pixel to its left,
+        # computed for the whole band at once by Pillow
+        shifted = Image.new(band.mode, band.size)
+        shifted.paste(band.crop((0, 0, band.width - 1, band.height)), (1, 0))
+        filtered = ImageChops.subtract_modulo(band, shifted).tobytes()
+        row_bytes = band.width * MODE_BYTES[band.mode]
+        rows = b''.join(
+            b'\x01' + filtered[i:i + row_bytes] for i in range(0, len(filtered), row_bytes)
+        )
+        data = self.compressor.compress(rows)
+        if data:
+            self._chunk(b'IDAT', data)
+
+    def abort(self):
+        self.fp.close()
+        os.remove(self.fp.name)
+
+    def close(self):
+        self._chunk(b'IDAT', self.compressor.flush())
+        self._chunk(b'IEND', b'')
+        self.fp.close()
+
+
+class _TiffWriter:
+    """Write an uncompressed, contiguous TIFF strip by strip."""
+
+    PHOTOMETRIC = {'L': 1, 'RGB': 2, 'RGBA': 2, 'CMYK': 5}
+    STRIP_BYTES = 64 * 1024
+
+    def __init__(self, output_path, size, mode):
+        self.width, self.height = size
+        self.mode = mode
+        self.row_bytes = self.width * MODE_BYTES[mode]
+        if self.row_bytes * self.height > 0xffffffff - 4096:
+            raise ValueError("Output is too large for a classic TIFF file")
+        self.fp = open(output_path, 'wb')
+        # Header with a placeholder IFD offset, patched in close()
+        self.fp.write(b'II*\x00' + struct.pack('<I', 0))
+        self.data_start = self.fp.tell()
+
+    def write(self, band):
+        self.fp.write(band.tobytes())
+
+    def abort(self):
+        self.fp.close()
+        os.remove(self.fp.name)
+
+    def close(self):
+        rows_per_strip = max(1, self.STRIP_BYTES // self.row_bytes)
+        strip_count = math.ceil(self.height / rows_per_strip)
+        strip_bytes = rows_per_strip * self.row_bytes
+        total = self.row_bytes * self.height
+        offsets = [self.data_start + i * strip_bytes for i in range(strip_count)]
+        counts = [min(strip_bytes, total - i * strip_bytes) for i in range(strip_count)]
+        samples = MODE_BYTES[self.mode]
+
+        # Out-of-line values are written first, the IFD points at them
+        if self.fp.tell() % 2:
+            self.fp.write(b'\x00')
+        bits_offset = self.fp.tell()
+        self.fp.write(struct.pack(f'<{samples}H', *([8] * samples)))
+        offsets_offset = self.fp.tell()
+        self.fp.write(struct.pack(f'<{strip_count}I', *offsets))
+        counts_offset = self.fp.tell()
+        self.fp.write(struct.pack(f'<{strip_count}I', *counts))
+
+        entries = [
+            (256, 4, 1, self.width),
+            (257, 4, 1, self.height),
+            (258, 3, samples, bits_offset if samples > 2 else 8),
+            (259, 3, 1, 1),
+            (262, 3, 1, self.PHOTOMETRIC[self.mode]),
+            (273, 4, strip_count, offsets_offset if strip_count > 1 else offsets[0]),
+            (277, 3, 1, samples),
+            (278, 4, 1, rows_per_strip),
+            (279, 4, strip_count, counts_offset if strip_count > 1 else counts[0]),
+            (284, 3, 1, 1),
+        ]
+        if self.mode == 'RGBA':
+            entries.append((338, 3, 1, 2))  # unassociated alpha
+
+        ifd_offset = self.fp.tell()
+        self.fp.write(struct.pack('<H', len(entries)))
+        for tag, kind, count, value in entries:
+            if kind == 3 and count == 1:
+                self.fp.write(struct.pack('<HHIHH', tag, kind, count, value, 0))
+            else:
+                self.fp.write(struct.pack('<HHII', tag, kind, count, value))
+        self.fp.write(struct.pack('<I', 0))
+        self.fp.seek(4)
+        self.fp.write(struct.pack('<I', ifd_offset))
+        self.fp.close()
+
+
+class _CanvasWriter:
+    """Collect bands into one output-size image and save it at the end."""
+
+    def __init__(self, output_path, size, mode, save_format):
+        self.output_path = output_path
+        self.save_format = save_format
+        self.canvas = Image.new(mode, size)
+        self.y = 0
+
+    def write(self, band):
+        self.canvas.paste(band, (0, self.y))
+        self.y += band.height
+
+    def abort(self):
+        self.canvas = None
+
+    def close(self):
+        self.canvas.save(self.output_path, format=self.save_format)
+
+
+def _working_mode(mode, transparent, target_format):
+    """
+    Mode the bands are resampled in: keep alpha where the output can use it.
+    transparent is has_transparency() of the source, as in resample_mode().
+    """
+    if target_format == 'png':
+        if mode in ('1', 'L') and not transparent:
+            return 'L'
+        if mode == 'LA':
+            return 'LA'
+        return 'RGBA' if transparent else 'RGB'
+    if target_format == 'tiff':
+        if mode in ('1', 'L') and not transparent:
+            return 'L'
+        if mode == 'CMYK':
+            return 'CMYK'
+        return 'RGBA' if transparent else 'RGB'
+    # JPEG: resample with alpha so flattening matches convert_image
+    return 'RGBA' if transparent else 'RGB'
+
+
+def convert_image_tiled(input_path, output_path, target_format, scale=1.0,
+                        memory_limit=DEFAULT_MEMORY_LIMIT, progress=None, is_cancelled=None):
+    """
+    Convert an image band by band so the working set stays near memory_limit
+    bytes. Targets other than PNG, TIFF and JPEG fall back to convert_image.
+    """
+    target_format = target_format.lower()
+    if target_format == 'tif':
+        target_format = 'tiff'
+    if target_format not in TILED_FORMATS:
+        return convert_image(input_path, output_path, target_format, scale,
+                             progress=progress, is_cancelled=is_cancelled)
+
+    try:
+        report_progress(progress, 0.0, is_cancelled)
+        with stage('open'):
+            probe, (width, height) = open_image(input_path, scale)
+        # Animations stream frame by frame already
+        animated = getattr(probe, 'is_animated', False) and target_format == 'png'
+        # Unscaled palettes stay palettes in convert_image, at a byte per pixel
+        kept_palette = probe.mode == 'P' and scale == 1.0 and target_format not in ('jpg', 'jpeg')
+        if animated or kept_palette or probe.mode not in ('1', 'L', 'LA', 'P', 'PA', 'RGB', 'RGBA', 'CMYK'):
+            return convert_image(input_path, output_path, target_format, scale,
+                                 progress=progress, is_cancelled=is_cancelled)
+        out_width, out_height = scaled_size(width, height, scale)
+        work_mode = _working_mode(probe.mode, has_transparency(probe), target_format)
+
+        # Size the bands so a few band-sized buffers fit in the budget
+        source_row_bytes = probe.width * MODE_BYTES[work_mode]
+        band_limit = max(memory_limit // BAND_COPIES, source_row_bytes)
+
+        reader = None
+        if probe.size == (width, height):
+            with stage('open'):
+                reader = _StreamingBandReader.open(input_path, band_limit)
+        if reader is None:
+            decoded_bytes = probe.width * probe.height * MODE_BYTES.get(probe.mode, 4)
+            if decoded_bytes > memory_limit:
+                print(f"{os.path.basename(input_path)} cannot be decoded in bands, "
+                      f"decoding {decoded_bytes // (1024 * 1024)} MB at once")
+            reader = _DecodedBandReader(probe)
+        report_progress(progress, 0.1, is_cancelled)
+
+        # Output rows per band, leaving room for the resampling margin
+        y_ratio = reader.height / out_height
+        margin = math.ceil(3 * max(1.0, y_ratio)) + 1
+        band_source_rows = max(band_limit // source_row_bytes, 2 * margin + 1)
+        band_rows = max(1, int((band_source_rows - 2 * margin) / y_ratio))
+
+        out_mode = work_mode
+        if target_format in ['jpg', 'jpeg']:
+            writer = _CanvasWriter(output_path, (out_width, out_height), 'RGB', PIL_FORMATS[target_format])
+        elif target_format == 'png':
+            writer = _PngWriter(output_path, (out_width, out_height), out_mode)
+        else:
+            writer = _TiffWriter(output_path, (out_width, out_height), out_mode)
+
+        try:
+            for out_top in range(0, out_height, band_rows):
+                out_bottom = min(out_top + band_rows, out_height)
+                # Multiply before dividing so the last band ends exactly on the edge
+                source_top = out_top * reader.height / out_height
+                source_bottom = out_bottom * reader.height / out_height
+                read_top = max(0, math.floor(source_top) - margin)
+                read_bottom = min(reader.height, math.ceil(source_bottom) + margin)
+
+                with stage('decode'):
+                    band = reader.read(read_top, read_bottom)
+                with stage('resize'):
+                    if band.mode != work_mode:
+                        band = band.convert(work_mode)
+                    if (out_width, out_height) == (reader.width, reader.height):
+                        band = band.crop((0, out_top - read_top, out_width, out_bottom - read_top))
+                    else:
+                        # box keeps the sampling positions identical to a whole-image resize
+                        band = band.resize(
+                            (out_width, out_bottom - out_top), Image.LANCZOS,
+                            box=(0, source_top - read_top, reader.width, source_bottom - read_top)
+                        )
+                with stage('flatten'):
+                    band = flatten_for_format(band, target_format)
+                with stage('encode'):
+                    writer.write(band)
+                report_progress(progress, 0.1 + 0.85 * out_bottom / out_height, is_cancelled)
+        except BaseException:
+            # Never leave a truncated file behind
+            writer.abort()
+            raise
+        with stage('write'):
+            writer.close()
+
+        report_progress(progress, 1.0)
+        return True
+
+    except Exception as e:
+        print(f"Conversion failed: {e}")
+        raise
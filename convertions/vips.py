@@ -0,0 +1,189 @@
+"""
+Optional libvips backend for convert_image.
+
+libvips runs decode, resize and encode as one demand-driven pipeline: the
+encoder pulls strips through the resize from the decoder, on every core,
+so a huge image is never held in memory whole. Pillow's lower overhead
+per call wins on small images, so convert_image hands an image to libvips
+only when pyvips is installed (pip install pyvips[binary]) and the image
+has at least VIPS_MIN_PIXELS. KOMMVERTERS_IMAGE_BACKEND=pillow or vips
+overrides the choice.
+
+libvips covers the cases whose output it can keep equivalent to Pillow's:
+single-frame L, LA, RGB and RGBA images written as JPG, PNG, WEBP or TIFF,
+with the same encoder settings and no metadata. compare_backends() measures
+the difference; benchmarks/backends.py checks it stays above
+VIPS_TOLERANCE_DB on the benchmark corpus.
+"""
+from contextlib import contextmanager
+import math
+import os
+
+from convertions.images import OPAQUE_FORMATS, scaled_size
+from convertions.instrument import current_recorder, stage
+from convertions.progress import ConversionCancelled, report_progress
+
+BACKEND_ENV = 'KOMMVERTERS_IMAGE_BACKEND'
+
+# From about full HD up libvips is faster even on one core (benchmarks/backends.py)
+VIPS_MIN_PIXELS = 1920 * 1080
+
+# Lowest PSNR in dB between the two backends' outputs that counts as
+# equivalent. The resamplers alone differ by less than 1/255 (over 48 dB);
+# lossy encoders turn that into up to 5 dB more.
+VIPS_TOLERANCE_DB = 35.0
+
+# Source modes libvips loads as the same bands Pillow does
+VIPS_MODES = ('L', 'LA', 'RGB', 'RGBA')
+
+# Target format -> libvips saver and the options that match Pillow's defaults
+VIPS_SAVERS = {
+    'jpg': ('jpegsave', {'Q': 75}),
+    'jpeg': ('jpegsave', {'Q': 75}),
+    'png': ('pngsave', {'compression': 6}),
+    'webp': ('webpsave', {'Q': 80}),
+    'tiff': ('tiffsave', {'compression': 'none'}),
+    'tif': ('tiffsave', {'compression': 'none'}),
+}
+
+_pyvips = None
+
+
+def load_pyvips():
+    """Return the pyvips module, or None if it or libvips is not installed."""
+    global _pyvips
+    if _pyvips is None:
+        try:
+            import pyvips
+            _pyvips = pyvips
+        except (ImportError, OSError):
+            # pyvips raises OSError when it cannot load the libvips library
+            _pyvips = False
+    return _pyvips or None
+
+
+def choose_backend(mode, width, height, target_format, animated=False):
+    """Return 'vips' or 'pillow' for converting an image with this header."""
+    choice = os.environ.get(BACKEND_ENV, 'auto').lower()
+    if (choice == 'pillow' or animated or mode not in VIPS_MODES
+            or target_format.lower() not in VIPS_SAVERS or load_pyvips() is None):
+        return 'pillow'
+    if choice == 'vips' or width * height >= VIPS_MIN_PIXELS:
+        return 'vips'
+    return 'pillow'
+
+
+def image_backend(input_path, target_format):
+    """The backend convert_image will pick for input_path, from its header; part of cache keys."""
+    from convertions.sniff import sniff_file
+    info = sniff_file(input_path)
+    if info is None or info.kind != 'image' or info.width is None:
+        return 'pillow'
+    return choose_backend(info.mode, info.width, info.height, target_format)
+
+
+def convert_image_vips(input_path, output_path, target_format, scale=1.0, progress=None, is_cancelled=None):
+    """
+    convert_image() on libvips: the same output size, modes and encoder
+    settings. progress follows the pipeline as libvips evaluates it, and
+    is_cancelled is polled while it runs.
+    """
+    pyvips = load_pyvips()
+    if pyvips is None:
+        raise ImportError("pyvips is not installed. Install it with: pip install pyvips[binary]")
+    try:
+        report_progress(progress, 0.0, is_cancelled)
+        target_format = target_format.lower()
+        saver, options = VIPS_SAVERS[target_format]
+        recorder = current_recorder()
+        if recorder is not None:
+            recorder.details['backend'] = 'vips'
+
+        with stage('open'):
+            # Only the header is read here; pixels are decoded as the encoder asks for them
+            img = pyvips.Image.new_from_file(input_path, access='sequential')
+            size = scaled_size(img.width, img.height, scale)
+            if size != (img.width, img.height):
+                # thumbnail() shrinks on load where the format allows (JPEG like draft()),
+                # then resamples with lanczos3 on premultiplied alpha, as Pillow does
+                img = pyvips.Image.thumbnail(input_path, size[0], height=size[1], size='force',
+                                             no_rotate=True)
+            if target_format in OPAQUE_FORMATS and img.hasalpha():
+                img = img.flatten(background=[255] * (img.bands - 1))
+        report_progress(progress, 0.3, is_cancelled)
+
+        if progress is not None or is_cancelled is not None:
+            img.set_progress(True)
+
+            def on_eval(image, status):
+                if is_cancelled is not None and is_cancelled():
+                    image.set_kill(True)
+                elif progress is not None:
+                    progress(0.3 + 0.7 * status.percent / 100)
+
+            img.signal_connect('eval', on_eval)
+
+        # Pillow writes no metadata unless asked to
+        if pyvips.at_least_libvips(8, 15):
+            options = dict(options, keep='none')
+        else:
+            options = dict(options, strip=True)
+        with stage('encode'):
+            try:
+                getattr(img, saver)(output_path, **options)
+            except pyvips.Error:
+                if is_cancelled is not None and is_cancelled():
+                    raise ConversionCancelled("Conversion cancelled")
+                raise
+        report_progress(progress, 1.0)
+        return True
+
+    except Exception as e:
+        print(f"Conversion failed: {e}")
+        raise
+
+
+@contextmanager
+def use_backend(name):
+    """Force convert_image onto the 'pillow' or 'vips' backend inside the with block."""
+    previous = os.environ.get(BACKEND_ENV)
+    os.environ[BACKEND_ENV] = name
+    try:
+        yield
+    finally:
+        if previous is None:
+            os.environ.pop(BACKEND_ENV, None)
+        else:
+            os.environ[BACKEND_ENV] = previous
+
+
+def output_psnr(first_path, second_path):
+    """PSNR in dB between two image files of the same size (inf means identical)."""
+    from PIL import Image, ImageChops, ImageStat
+
+    with Image.open(first_path) as first, Image.open(second_path) as second:
+        if first.size != second.size:
+            raise ValueError(f"Output sizes differ: {first.size} vs {second.size}")
+        mode = 'RGBA' if 'A' in first.mode + second.mode else 'RGB'
+        diff = ImageChops.difference(first.convert(mode), second.convert(mode))
+    mse = sum(v * v for v in ImageStat.Stat(diff).rms) / len(mode)
+    if mse == 0:
+        return math.inf
+    return 10 * math.log10(255 ** 2 / mse)
+
+
+def compare_backends(input_path, target_format, scale=1.0):
+    """
+    Convert input_path with both backends and return the PSNR in dB
+    between the two outputs.
+    """
+    import tempfile
+    from convertions.images import convert_image
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        outputs = []
+        for backend in ('pillow', 'vips'):
+            outputs.append(os.path.join(temp_dir, f"{backend}.{target_format}"))
+            with use_backend(backend):
+                convert_image(input_path, outputs[-1], target_format, scale)
+        return output_psnr(*outputs)
@@ -2,16 +2,20 @@ from PySide6.QtWidgets import (
     QApplication, QMainWindow, QLabel, QWidget, QVBoxLayout,
     QHBoxLayout, QPushButton, QFileDialog, QComboBox, QLineEdit
 )
-from PySide6.QtCore import Qt
+from PySide6.QtCore import Qt, QTimer
 from PySide6.QtGui import QDragEnterEvent, QDropEvent, QPixmap
 import os
 
+from convertions.formats import collect_files
+
 class DropLabel(QWidget):
-    def __init__(self, switch_to_convertion_screen, parent=None):
+    def __init__(self, switch_to_convertion_screen, switch_to_queue_screen=None, parent=None):
         super().__init__(parent)
         self.setAcceptDrops(True)
         self.switch_to_convertion_screen = switch_to_convertion_screen  # Function to switch screen
+        self.switch_to_queue_screen = switch_to_queue_screen  # Used when several files are dropped
         self.uploaded_file_path = ""  # Store full file path
+        self.uploaded_file_paths = []  # Every file from the last drop or selection
 
         self.setStyleSheet("""
             QWidget {
@@ -41,11 +45,8 @@ class DropLabel(QWidget):
         self.container_layout = QVBoxLayout(self.main_container)
         self.container_layout.setAlignment(Qt.AlignmentFlag.AlignCenter)
 
-        # Icon
+        # Icon, decoded once the window is on screen so it does not delay the first paint
         self.icon = QLabel()
-        pixmap = QPixmap("image.png")  # Load the provided icon
-        pixmap = pixmap.scaled(420, 180, Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation)
-        self.icon.setPixmap(pixmap)
         self.icon.setAlignment(Qt.AlignmentFlag.AlignCenter)
         self.icon.setStyleSheet("""
             QLabel {
@@ -78,28 +79,63 @@ class DropLabel(QWidget):
         layout.addWidget(self.main_container)
         layout.addWidget(self.success_container)
 
+        QTimer.singleShot(0, self.load_icon)
+
+    def load_icon(self):
+        """Load and scale the provided icon."""
+        pixmap = QPixmap("image.png")
+        pixmap = pixmap.scaled(420, 180, Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.SmoothTransformation)
+        self.icon.setPixmap(pixmap)
+
+    def reset(self):
+        """Show the drop area again after coming back from another screen."""
+        self.main_container.setVisible(True)
+        self.success_container.setVisible(False)
+        self.success_container.setText("File Uploaded")
+
     def mousePressEvent(self, event):
         """Trigger browse_file when the container is clicked."""
         self.browse_file()
 
     def browse_file(self):
-        file_path, _ = QFileDialog.getOpenFileName(self, "Select a File")
-        if file_path:
-            self.uploaded_file_path = file_path  # Store file path
-            self.show_success()
+        file_paths, _ = QFileDialog.getOpenFileNames(self, "Select Files")
+        if file_paths:
+            self.set_uploaded_files(file_paths)
 
     def dragEnterEvent(self, event: QDragEnterEvent):
         if event.mimeData().hasUrls():
             event.acceptProposedAction()
 
     def dropEvent(self, event: QDropEvent):
-        urls = event.mimeData().urls()
-        if urls:
-            self.uploaded_file_path = urls[0].toLocalFile()  # Store file path
-            self.show_success()
+        paths = [url.toLocalFile() for url in event.mimeData().urls() if url.isLocalFile()]
+        if paths:
+            self.set_uploaded_files(paths)
+
+    def set_uploaded_files(self, paths):
+        """
+        Switch screen for the dropped files. Folders and several files go to
+        the queue screen as they are, which walks them on a worker thread.
+        """
+        if len(paths) == 1 and os.path.isfile(paths[0]):
+            # A single file keeps working even if its extension is unknown
+            files = paths
+        elif self.switch_to_queue_screen:
+            files = paths
+        else:
+            files = collect_files(paths)
+        if not files:
+            return
+        self.uploaded_file_paths = files
+        self.uploaded_file_path = files[0]  # Store file path
+        self.show_success()
 
     def show_success(self):
         """Hide main container, show success message, and switch screen."""
         self.main_container.setVisible(False)
         self.success_container.setVisible(True)
-        self.switch_to_convertion_screen(self.uploaded_file_path)  # Pass full file path
\ No newline at end of file
+        single_file = len(self.uploaded_file_paths) == 1 and os.path.isfile(self.uploaded_file_path)
+        if not single_file and self.switch_to_queue_screen:
+            self.success_container.setText("Files Uploaded")
+            self.switch_to_queue_screen(self.uploaded_file_paths)
+        else:
+            self.switch_to_convertion_screen(self.uploaded_file_path)  # Pass full file path
\ No newline at end of file
@@ -1,32 +1,123 @@
-from PySide6.QtWidgets import QApplication, QMainWindow, QLabel, QVBoxLayout, QWidget
+import time
+_process_start = time.perf_counter()
+
+import importlib
+import json
+import os
+import threading
+
+from PySide6.QtWidgets import QApplication, QMainWindow, QStackedWidget
+from PySide6.QtCore import QEvent, QTimer, Signal
 from drop_screen import DropLabel
-from convertion_screen import ConversionScreen
-from PySide6.QtCore import Qt
+
+# Imported on a background thread after the first paint, so the first
+# conversion does not pay for them. Missing optional libraries are skipped.
+PREWARM_MODULES = [
+    'PIL.Image',
+    'convertions.images',
+    'convertions.estimate',
+    'convertions.tiled',
+    'convertions.thumbnails',
+    'pdf2docx',
+]
+
+# Set by benchmarks/startup.py: print startup timings and quit
+BENCHMARK_ENV = "KOMMVERTERS_STARTUP_BENCHMARK"
+# Wall-clock launch time from the benchmark, so interpreter startup is counted
+LAUNCH_TIME_ENV = "KOMMVERTERS_LAUNCH_TIME"
+
+
+def elapsed_since_launch():
+    """Seconds since the process was launched, or since main.py started running."""
+    launch_time = os.environ.get(LAUNCH_TIME_ENV)
+    if launch_time:
+        return time.time() - float(launch_time)
+    return time.perf_counter() - _process_start
+
+
+def prewarm(on_done):
+    """Import the heavy converter modules, then call on_done (from the worker thread)."""
+    for name in PREWARM_MODULES:
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            pass
+    on_done()
+
 
 class MainWindow(QMainWindow):
+    prewarmed = Signal()
+
     def __init__(self):
         super().__init__()
         self.setWindowTitle("Kommverters")
         self.setMinimumSize(600, 400)
+        self.timings = {}
+
+        # Screens live in a stack and are reused instead of recreated
+        self.stack = QStackedWidget()
+        self.setCentralWidget(self.stack)
+
+        # Only the drop screen is built before the window is shown
+        self.drop_label = DropLabel(self.show_convertion_screen, self.show_queue_screen)
+        self.drop_label.installEventFilter(self)
+        self.stack.addWidget(self.drop_label)
+        self.convertion_screen = None
+        self.queue_screen = None
+
+        self.prewarmed.connect(self.on_prewarmed)
+
+    def eventFilter(self, watched, event):
+        if watched is self.drop_label and event.type() == QEvent.Type.Paint and 'first_paint' not in self.timings:
+            self.timings['first_paint'] = elapsed_since_launch()
+            # Let this paint finish before doing any deferred work
+            QTimer.singleShot(0, self.after_first_paint)
+        return super().eventFilter(watched, event)
+
+    def after_first_paint(self):
+        """Warm up the converters in the background and build the conversion screen."""
+        threading.Thread(target=prewarm, args=(self.prewarmed.emit,), daemon=True).start()
+        self.get_convertion_screen()
+
+    def on_prewarmed(self):
+        self.timings['interactive'] = elapsed_since_launch()
+        if os.environ.get(BENCHMARK_ENV):
+            print(json.dumps(self.timings), flush=True)
+            QApplication.quit()
+
+    def get_convertion_screen(self):
+        if self.convertion_screen is None:
+            from convertion_screen import ConversionScreen
+            self.convertion_screen = ConversionScreen(self.show_drop_screen)
+            self.stack.addWidget(self.convertion_screen)
+        return self.convertion_screen
+
+    def get_queue_screen(self):
+        if self.queue_screen is None:
+            from queue_screen import QueueScreen
+            self.queue_screen = QueueScreen(self.show_drop_screen)
+            self.stack.addWidget(self.queue_screen)
+        return self.queue_screen
 
-        # Create the initial drop screen
-        self.drop_label = DropLabel(self.show_convertion_screen)
-        
-        # Set the initial central widget
-        self.setCentralWidget(self.drop_label)
-        
     def show_convertion_screen(self, file_path):
-        # Create a new conversion screen instance each time
-        self.convertion_screen = ConversionScreen(self.show_drop_screen)
-        self.convertion_screen.set_file(file_path)
-        self.setCentralWidget(self.convertion_screen)
+        screen = self.get_convertion_screen()
+        screen.set_file(file_path)
+        self.stack.setCurrentWidget(screen)
+
+    def show_queue_screen(self, file_paths):
+        """Show the queue screen for several files at once"""
+        screen = self.get_queue_screen()
+        screen.set_files(file_paths)
+        self.stack.setCurrentWidget(screen)
 
     def show_drop_screen(self):
-        """Create a new drop label and set it as central widget"""
-        self.drop_label = DropLabel(self.show_convertion_screen)
-        self.setCentralWidget(self.drop_label)
-
-app = QApplication([])
-window = MainWindow()
-window.show()
-app.exec()
\ No newline at end of file
+        """Reset the drop screen and bring it back to the front"""
+        self.drop_label.reset()
+        self.stack.setCurrentWidget(self.drop_label)
+
+
+if __name__ == "__main__":
+    app = QApplication([])
+    window = MainWindow()
+    window.show()
+    app.exec()
@@ -0,0 +1,524 @@
+from PySide6.QtWidgets import (
+    QWidget, QVBoxLayout, QHBoxLayout, QLabel, QPushButton, QComboBox,
+    QListView, QProgressBar, QFileDialog, QStyledItemDelegate, QStyle,
+    QStyleOptionProgressBar, QApplication
+)
+from PySide6.QtCore import Qt, QAbstractListModel, QModelIndex, QObject, QSize, QThreadPool, QTimer, Signal
+from PySide6.QtGui import QColor
+import os
+import time
+
+from conversion_worker import ConversionWorker, ScanWorker
+from convertions.formats import unique_output_path
+from convertion_screen import CONVERSION_FORMATS
+from thumbnail_service import thumbnail_service
+
+# Job states
+PENDING = "Pending"
+RUNNING = "Converting"
+DONE = "Done"
+FAILED = "Failed"
+CANCELLED = "Cancelled"
+
+# Edge of the preview drawn at the start of each row
+ICON_SIZE = 40
+
+STATUS_COLORS = {
+    PENDING: "#888888",
+    RUNNING: "#FFFFFF",
+    DONE: "#44CC66",
+    FAILED: "#FF4444",
+    CANCELLED: "#888888",
+}
+
+ProgressRole = Qt.ItemDataRole.UserRole + 1
+StatusRole = Qt.ItemDataRole.UserRole + 2
+
+
+class ConversionJob:
+    """One file in the queue and its current state."""
+
+    def __init__(self, input_path: str, source_format: str, input_size: int):
+        self.input_path = input_path
+        self.source_format = source_format  # Sniffed by the ScanWorker, off the GUI thread
+        self.input_size = input_size
+        self.output_path = ""
+        self.status = PENDING
+        self.progress = 0
+        self.error = ""
+        self.summary = ""  # Per-stage breakdown of the finished conversion
+        self.worker = None
+
+
+class JobListModel(QAbstractListModel):
+    """
+    Model over the job list. QListView only asks for the rows it paints,
+    so thousands of jobs cost no widgets, and only visible rows request
+    thumbnails from the service.
+    """
+
+    def __init__(self, jobs=None, thumbnails=None, parent=None):
+        super().__init__(parent)
+        self.jobs = jobs or []
+        self.rows_by_path = {}
+        self.thumbnails = thumbnails
+        if thumbnails is not None:
+            thumbnails.thumbnail_ready.connect(self.thumbnail_ready)
+
+    def rowCount(self, parent=QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self.jobs)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        job = self.jobs[index.row()]
+        if role == Qt.ItemDataRole.DisplayRole:
+            return os.path.basename(job.input_path)
+        if role == Qt.ItemDataRole.ToolTipRole:
+            details = job.error or job.summary
+            return f"{job.input_path}\n{details}" if details else job.input_path
+        if role == Qt.ItemDataRole.DecorationRole and self.thumbnails is not None:
+            return self.thumbnails.request(job.input_path)
+        if role == Qt.ItemDataRole.ForegroundRole:
+            return QColor(STATUS_COLORS[job.status])
+        if role == ProgressRole:
+            return job.progress
+        if role == StatusRole:
+            return job.status
+        return None
+
+    def set_jobs(self, jobs) -> None:
+        self.beginResetModel()
+        if self.thumbnails is not None:
+            self.thumbnails.cancel_pending()
+        self.jobs = jobs
+        self.rows_by_path = {}
+        for row, job in enumerate(jobs):
+            self.rows_by_path.setdefault(job.input_path, []).append(row)
+        self.endResetModel()
+
+    def add_jobs(self, jobs) -> None:
+        """Append rows; the job list is shared with the scheduler, which sees them too."""
+        if not jobs:
+            return
+        first = len(self.jobs)
+        self.beginInsertRows(QModelIndex(), first, first + len(jobs) - 1)
+        for row, job in enumerate(jobs, first):
+            self.jobs.append(job)
+            self.rows_by_path.setdefault(job.input_path, []).append(row)
+        self.endInsertRows()
+
+    def job_changed(self, row: int) -> None:
+        index = self.index(row)
+        self.dataChanged.emit(index, index)
+
+    def thumbnail_ready(self, file_path: str) -> None:
+        for row in self.rows_by_path.get(file_path, []):
+            index = self.index(row)
+            self.dataChanged.emit(index, index, [Qt.ItemDataRole.DecorationRole])
+
+
+class JobDelegate(QStyledItemDelegate):
+    """Paint each row as file name, status text and a progress bar."""
+
+    def paint(self, painter, option, index):
+        super().paint(painter, option, index)
+        status = index.data(StatusRole)
+        rect = option.rect
+
+        bar = QStyleOptionProgressBar()
+        bar.rect = rect.adjusted(rect.width() // 2, 4, -110, -4)
+        bar.minimum = 0
+        bar.maximum = 100
+        bar.progress = index.data(ProgressRole)
+        bar.textVisible = False
+        QApplication.style().drawControl(QStyle.ControlElement.CE_ProgressBar, bar, painter)
+
+        painter.save()
+        painter.setPen(index.data(Qt.ItemDataRole.ForegroundRole))
+        text_rect = rect.adjusted(rect.width() - 100, 0, 0, 0)
+        painter.drawText(text_rect, Qt.AlignmentFlag.AlignVCenter | Qt.AlignmentFlag.AlignLeft, status)
+        painter.restore()
+
+    def sizeHint(self, option, index):
+        size = super().sizeHint(option, index)
+        size.setHeight(max(size.height(), ICON_SIZE + 4))
+        return size
+
+
+class QueueScheduler(QObject):
+    """
+    Run queued jobs on a thread pool, at most max_workers at a time, with
+    the same target format and scale for every job.
+    """
+    job_changed = Signal(int)
+    stats_changed = Signal()
+    all_done = Signal()
+
+    def __init__(self, jobs, max_workers=None, parent=None):
+        super().__init__(parent)
+        self.jobs = jobs
+        self.thread_pool = QThreadPool(self)
+        if max_workers:
+            self.thread_pool.setMaxThreadCount(max_workers)
+        self.target_format = ""
+        self.scale = 1.0
+        self.output_directory = ""
+        self.next_row = 0
+        self.running = 0
+        self.finished = 0
+        self.failed = 0
+        self.done_bytes = 0
+        self.started_at = 0.0
+        self.stopped = True
+        self.claimed_outputs = set()
+        # Worker signal objects -> job row, so slots can stay bound methods
+        # and are disconnected automatically if the scheduler is destroyed
+        self.rows = {}
+
+    def start(self, target_format: str, scale: float, output_directory: str = "") -> None:
+        self.target_format = target_format
+        self.scale = scale
+        self.output_directory = output_directory
+        self.next_row = 0
+        self.running = 0
+        self.finished = 0
+        self.failed = 0
+        self.done_bytes = 0
+        self.started_at = time.perf_counter()
+        self.stopped = False
+        self.claimed_outputs = set()
+        for row, job in enumerate(self.jobs):
+            if job.status != DONE:
+                job.status, job.progress, job.error = PENDING, 0, ""
+                self.job_changed.emit(row)
+        self._fill()
+
+    def cancel(self) -> None:
+        """Stop scheduling new jobs and cancel the ones in flight."""
+        self.stopped = True
+        for row, job in enumerate(self.jobs):
+            if job.status == RUNNING and job.worker is not None:
+                job.worker.cancel()
+            elif job.status == PENDING:
+                job.status = CANCELLED
+                self.job_changed.emit(row)
+        self._check_done()
+
+    def _output_path(self, job) -> str:
+        directory = self.output_directory if self.output_directory else os.path.dirname(job.input_path)
+        base_name = os.path.splitext(os.path.basename(job.input_path))[0]
+        output_path = os.path.join(directory, f"{base_name}.{self.target_format}")
+        # Two inputs with the same name must not write the same output
+        return unique_output_path(output_path, self.claimed_outputs)
+
+    def _fill(self) -> None:
+        """Start pending jobs until every worker thread is busy."""
+        while not self.stopped and self.running < self.thread_pool.maxThreadCount() and self.next_row < len(self.jobs):
+            row = self.next_row
+            self.next_row += 1
+            job = self.jobs[row]
+            if job.status == DONE:
+                continue
+
+            job.output_path = self._output_path(job)
+            if os.path.realpath(job.output_path) == os.path.realpath(job.input_path):
+                self._finish(row, FAILED, "Output would overwrite the input file")
+                continue
+
+            job.status = RUNNING
+            job.worker = ConversionWorker(job.input_path, job.output_path, job.source_format,
+                                          self.target_format, self.scale)
+            self.rows[job.worker.signals] = row
+            job.worker.signals.progress.connect(self._on_progress)
+            job.worker.signals.finished.connect(self._on_finished)
+            job.worker.signals.failed.connect(self._on_failed)
+            job.worker.signals.cancelled.connect(self._on_cancelled)
+            self.running += 1
+            self.job_changed.emit(row)
+            self.thread_pool.start(job.worker)
+        self._check_done()
+
+    def _finish(self, row: int, status: str, error: str = "") -> None:
+        job = self.jobs[row]
+        if job.worker is not None:
+            self.rows.pop(job.worker.signals, None)
+            job.worker = None
+            self.running -= 1
+        job.status = status
+        job.error = error
+        self.finished += 1
+        if status == DONE:
+            job.progress = 100
+            self.done_bytes += job.input_size
+        elif status == FAILED:
+            self.failed += 1
+        self.job_changed.emit(row)
+        self.stats_changed.emit()
+
+    def _sender_row(self):
+        return self.rows.get(self.sender())
+
+    def _on_progress(self, percent: int) -> None:
+        row = self._sender_row()
+        if row is not None:
+            self.jobs[row].progress = percent
+            self.job_changed.emit(row)
+
+    def _on_finished(self, output_path: str) -> None:
+        row = self._sender_row()
+        if row is not None:
+            self.jobs[row].summary = self.jobs[row].worker.summary
+            self._finish(row, DONE)
+            self._fill()
+
+    def _on_failed(self, message: str, missing_library: bool) -> None:
+        row = self._sender_row()
+        if row is not None:
+            self._finish(row, FAILED, message)
+            self._fill()
+
+    def _on_cancelled(self) -> None:
+        row = self._sender_row()
+        if row is not None:
+            self._finish(row, CANCELLED)
+            self._fill()
+
+    def _check_done(self) -> None:
+        if self.running == 0 and (self.stopped or self.next_row >= len(self.jobs)):
+            self.stopped = True
+            self.all_done.emit()
+
+    def is_running(self) -> bool:
+        return not self.stopped
+
+    def throughput(self):
+        """Return (files per second, bytes per second) since start()."""
+        elapsed = max(time.perf_counter() - self.started_at, 1e-9)
+        done = self.finished - self.failed
+        return done / elapsed, self.done_bytes / elapsed
+
+
+class QueueScreen(QWidget):
+    """Convert many files with one set of format and size settings."""
+
+    def __init__(self, go_back_callback=None):
+        super().__init__()
+        self.go_back_callback = go_back_callback
+        self.setStyleSheet("background-color: #111; color: white;")
+        self.output_directory = ""
+        self.jobs = []
+        self.total_size = 0
+        self.scan_worker = None
+        self.scan_generation = 0
+
+        self.layout = QVBoxLayout(self)
+        self.layout.setContentsMargins(50, 50, 50, 50)
+
+        # Header with the back button on the right
+        header_layout = QHBoxLayout()
+        self.header_label = QLabel("Kommverters")
+        self.header_label.setStyleSheet(
+            "font-size: 32px; font-weight: bold; color: #FF8800; background-color: transparent;"
+        )
+        self.close_button = QPushButton("✕")
+        self.close_button.setFixedSize(30, 30)
+        self.close_button.setStyleSheet("""
+            QPushButton {
+                color: #FF8800;
+                font-size: 18px;
+                font-weight: bold;
+                background-color: #333;
+                border: 1px solid #FF8800;
+                border-radius: 15px;
+            }
+            QPushButton:hover {
+                color: white;
+                background-color: #FF8800;
+            }
+        """)
+        self.close_button.setCursor(Qt.CursorShape.PointingHandCursor)
+        self.close_button.clicked.connect(self.go_back)
+        header_layout.addWidget(self.header_label)
+        header_layout.addStretch()
+        header_layout.addWidget(self.close_button)
+        self.layout.addLayout(header_layout)
+
+        self.summary_label = QLabel("")
+        self.summary_label.setStyleSheet("font-size: 16px; color: #FFFFFF;")
+        self.layout.addWidget(self.summary_label)
+
+        # Virtualized job list
+        self.model = JobListModel(thumbnails=thumbnail_service())
+        self.list_view = QListView()
+        self.list_view.setModel(self.model)
+        self.list_view.setIconSize(QSize(ICON_SIZE, ICON_SIZE))
+        self.list_view.setItemDelegate(JobDelegate(self.list_view))
+        self.list_view.setUniformItemSizes(True)
+        self.list_view.setStyleSheet("background-color: #222; border-radius: 10px; padding: 5px;")
+        self.layout.addWidget(self.list_view, 1)
+
+        # Options shared by the whole queue
+        options_layout = QHBoxLayout()
+        self.format_label = QLabel("Format:")
+        self.format_label.setStyleSheet("color: #3c83cf; font-size: 15px;")
+        self.desired_format = QComboBox()
+        self.desired_format.addItems(CONVERSION_FORMATS)
+        self.desired_format.setStyleSheet("background-color: #333; color: white;")
+        self.size_label = QLabel("Size:")
+        self.size_label.setStyleSheet("color: #3c83cf; font-size: 15px;")
+        self.size_combo = QComboBox()
+        self.size_combo.addItems(["1", "0.8", "0.6", "0.4", "0.2"])
+        self.size_combo.setStyleSheet("background-color: #333; color: white;")
+        self.file_source = QComboBox()
+        self.file_source.addItems(["Same Folder", "Browse..."])
+        self.file_source.setStyleSheet("background-color: #333; color: white;")
+        self.file_source.currentIndexChanged.connect(self.update_output_path)
+        options_layout.addWidget(self.format_label)
+        options_layout.addWidget(self.desired_format, 1)
+        options_layout.addWidget(self.size_label)
+        options_layout.addWidget(self.size_combo, 1)
+        options_layout.addWidget(self.file_source, 1)
+        self.layout.addLayout(options_layout)
+
+        # Aggregate progress and throughput
+        self.total_progress = QProgressBar()
+        self.total_progress.setStyleSheet("""
+            QProgressBar {
+                background-color: #333;
+                color: white;
+                border-radius: 5px;
+                text-align: center;
+            }
+            QProgressBar::chunk {
+                background-color: #FF8800;
+                border-radius: 5px;
+            }
+        """)
+        self.throughput_label = QLabel("")
+        self.throughput_label.setStyleSheet("color: #FF8800; font-size: 15px; background-color: transparent;")
+        self.layout.addWidget(self.total_progress)
+        self.layout.addWidget(self.throughput_label)
+
+        self.convert_button = QPushButton("Convert All")
+        self.convert_button.setStyleSheet("""
+            QPushButton {
+                background-color: #FF8800;
+                color: white;
+                padding: 10px 20px;
+                border-radius: 5px;
+                font-size: 16px;
+            }
+            QPushButton:hover {
+                background-color: #FFA500;
+            }
+        """)
+        self.convert_button.clicked.connect(self.toggle_conversion)
+        self.layout.addWidget(self.convert_button)
+
+        self.scheduler = QueueScheduler([], parent=self)
+        self.stats_timer = QTimer(self)
+        self.stats_timer.setInterval(500)
+        self.stats_timer.timeout.connect(self.update_stats)
+
+    def set_files(self, paths) -> None:
+        """
+        Reset the queue and fill it from files and folders. The folders are
+        walked and every file sniffed on a worker thread; rows are added as
+        they are found, and converting can start once the walk is done.
+        """
+        self.scheduler.cancel()
+        if self.scan_worker is not None:
+            self.scan_worker.cancel()
+        self.scan_generation += 1
+        self.jobs = []
+        self.total_size = 0
+        self.model.set_jobs(self.jobs)
+        self.scheduler = QueueScheduler(self.jobs, parent=self)
+        self.scheduler.job_changed.connect(self.model.job_changed)
+        self.scheduler.stats_changed.connect(self.update_stats)
+        self.scheduler.all_done.connect(self.on_all_done)
+        self.summary_label.setText("Looking for files...")
+        self.total_progress.setRange(0, 1)
+        self.total_progress.setValue(0)
+        self.throughput_label.setText("")
+        self.convert_button.setText("Convert All")
+        self.convert_button.setEnabled(False)
+
+        self.scan_worker = ScanWorker(self.scan_generation, paths)
+        self.scan_worker.signals.found.connect(self.on_files_found)
+        self.scan_worker.signals.finished.connect(self.on_scan_finished)
+        QThreadPool.globalInstance().start(self.scan_worker)
+
+    def on_files_found(self, generation: int, entries) -> None:
+        if generation != self.scan_generation:
+            return
+        jobs = [ConversionJob(path, source_format, size) for path, source_format, size in entries]
+        self.total_size += sum(job.input_size for job in jobs)
+        self.model.add_jobs(jobs)
+        self.summary_label.setText(f"{len(self.jobs)} files, {self.format_file_size(self.total_size)} so far...")
+        self.total_progress.setRange(0, max(len(self.jobs), 1))
+
+    def on_scan_finished(self, generation: int) -> None:
+        if generation != self.scan_generation:
+            return
+        self.scan_worker = None
+        if self.jobs:
+            self.summary_label.setText(f"{len(self.jobs)} files, {self.format_file_size(self.total_size)}")
+        else:
+            self.summary_label.setText("No supported files found")
+        self.convert_button.setEnabled(bool(self.jobs))
+
+    def toggle_conversion(self) -> None:
+        if self.scheduler.is_running():
+            self.scheduler.cancel()
+            return
+        if not self.jobs:
+            return
+        target_format = self.desired_format.currentText().lower()
+        scale = float(self.size_combo.currentText())
+        self.scheduler.start(target_format, scale, self.output_directory)
+        if self.scheduler.is_running():
+            self.convert_button.setText("Cancel")
+            self.stats_timer.start()
+        self.update_stats()
+
+    def update_stats(self) -> None:
+        scheduler = self.scheduler
+        self.total_progress.setValue(scheduler.finished)
+        files_per_second, bytes_per_second = scheduler.throughput()
+        self.throughput_label.setText(
+            f"{scheduler.finished}/{len(self.jobs)} done, {scheduler.failed} failed - "
+            f"{files_per_second:.1f} files/s, {self.format_file_size(int(bytes_per_second))}/s"
+        )
+
+    def on_all_done(self) -> None:
+        self.stats_timer.stop()
+        self.update_stats()
+        self.convert_button.setText("Convert All")
+
+    def update_output_path(self) -> None:
+        """Update the output directory based on the file source selection."""
+        if self.file_source.currentText() == "Browse...":
+            directory = QFileDialog.getExistingDirectory(self, "Select Output Directory")
+            if directory:
+                self.output_directory = directory
+        else:
+            self.output_directory = ""
+
+    def format_file_size(self, size_bytes: int) -> str:
+        """Return a human-readable file size."""
+        if size_bytes < 1024:
+            return f"{size_bytes} B"
+        elif size_bytes < 1024 * 1024:
+            return f"{size_bytes / 1024:.1f} KB"
+        return f"{size_bytes / (1024 * 1024):.1f} MB"
+
+    def go_back(self):
+        self.scheduler.cancel()
+        if self.scan_worker is not None:
+            self.scan_worker.cancel()
+            self.scan_worker = None
+        self.scan_generation += 1
+        if self.go_back_callback:
+            self.go_back_callback()
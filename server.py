@@ -0,0 +1,485 @@
+"""
+Local HTTP conversion service for Kommverters.
+
+Other tools can convert files without starting Python and Pillow for each
+one: the service keeps a pool of worker processes with the converters
+already imported, and every request is converted by the same worker
+function as batch.py. Only the standard library is used, and like
+batch.py it does not import PySide6.
+
+Uploads are streamed to a temporary file as they arrive and the output is
+streamed back from disk, so neither is held in memory whole. Requests are
+limited in upload size and conversion time, and at most --max-jobs
+conversions are running or queued at once; beyond that the service answers
+503 with Retry-After instead of queueing without bound. Clients that send
+"Expect: 100-continue" (curl does for large files) get 413 and 503 before
+uploading anything. With --memory-budget an uploaded file waits until its
+estimated peak memory fits next to the conversions already running.
+
+Endpoints:
+    POST /convert?format=webp&scale=0.5   body: the file, returns the output
+        optional: pages=1-3,7 (PDF), max_size=200 (KB, JPG/WEBP), name=photo.png,
+        dpi=300 (PDF to image, which needs a single page, e.g. pages=1)
+    GET  /formats?from=png                conversion targets as JSON
+    GET  /health                          "ok" once the workers are warm
+    GET  /metrics                         request counters and latencies as JSON
+
+Example:
+    python server.py --port 8765 --workers 4
+    curl --data-binary @photo.png "http://127.0.0.1:8765/convert?format=webp" -o photo.webp
+"""
+import argparse
+import asyncio
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import json
+import mimetypes
+import os
+import shutil
+import signal
+import sys
+import tempfile
+import time
+from urllib.parse import parse_qs, urlsplit
+
+from batch import convert_one, format_rate, percentile
+from convertions.admission import AdmissionQueue, estimate_memory, set_pixel_limit
+from convertions.cache import DEFAULT_CACHE_DIR, DEFAULT_MAX_BYTES
+from convertions.documents import DEFAULT_DPI, parse_page_range, pdf_page_count
+from convertions.registry import conversion_targets
+from convertions.sniff import TARGET_SIZE_FORMATS, canonical_format, detect_format, format_kind
+
+DEFAULT_PORT = 8765
+
+# Uploads and outputs are copied in chunks of this size
+CHUNK_SIZE = 64 * 1024
+# Request line plus headers
+MAX_HEADER_BYTES = 64 * 1024
+# Seconds an idle keep-alive connection, or a stalled upload, is kept open
+IDLE_TIMEOUT = 30
+
+# Request latencies kept for the percentiles in /metrics
+LATENCY_WINDOW = 1000
+
+STATUS_TEXT = {
+    200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+    408: 'Request Timeout', 411: 'Length Required', 413: 'Payload Too Large',
+    415: 'Unsupported Media Type', 422: 'Unprocessable Entity', 500: 'Internal Server Error',
+    503: 'Service Unavailable', 504: 'Gateway Timeout'
+}
+
+Request = namedtuple('Request', ['method', 'path', 'query', 'headers', 'keep_alive'])
+
+
+class HttpError(Exception):
+    """Answered with status and message as a plain text response."""
+
+    def __init__(self, status, message, headers=None):
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+
+def warm_up():
+    """Import the converters in a worker, so the first request does not pay for it."""
+    from PIL import Image
+    import convertions.images
+    import convertions.pipeline
+    import convertions.registry
+    Image.init()
+    return os.getpid()
+
+
+async def read_request(reader):
+    """Read a request line and headers. Returns None when the client closed the connection."""
+    try:
+        head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), IDLE_TIMEOUT)
+    except asyncio.TimeoutError:
+        # An idle keep-alive connection
+        return None
+    except asyncio.IncompleteReadError as e:
+        if e.partial.strip():
+            raise HttpError(400, "Incomplete request")
+        return None
+    except asyncio.LimitOverrunError:
+        raise HttpError(400, "Request headers too large")
+
+    lines = head.decode('latin-1').split('\r\n')
+    try:
+        method, target, version = lines[0].split(' ')
+    except ValueError:
+        raise HttpError(400, "Malformed request line")
+    headers = {}
+    for line in lines[1:]:
+        if line:
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+    url = urlsplit(target)
+    query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+    connection = headers.get('connection', '').lower()
+    keep_alive = connection != 'close' if version == 'HTTP/1.1' else connection == 'keep-alive'
+    return Request(method, url.path, query, headers, keep_alive)
+
+
+async def read_body(reader, headers, f, max_bytes):
+    """Copy the request body to the file f in chunks and return its size."""
+    async def read(count):
+        return await asyncio.wait_for(reader.readexactly(count), IDLE_TIMEOUT)
+
+    size = 0
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+        while True:
+            line = await asyncio.wait_for(reader.readuntil(b'\r\n'), IDLE_TIMEOUT)
+            try:
+                chunk_size = int(line.split(b';')[0], 16)
+            except ValueError:
+                raise HttpError(400, "Malformed chunk")
+            if chunk_size == 0:
+                # Skip trailers up to the blank line
+                while await asyncio.wait_for(reader.readuntil(b'\r\n'), IDLE_TIMEOUT) != b'\r\n':
+                    pass
+                return size
+            size += chunk_size
+            if size > max_bytes:
+                raise HttpError(413, f"Upload larger than {max_bytes // (1024 * 1024)} MB")
+            while chunk_size:
+                data = await read(min(chunk_size, CHUNK_SIZE))
+                f.write(data)
+                chunk_size -= len(data)
+            await read(2)
+
+    if 'content-length' not in headers:
+        raise HttpError(411, "Send Content-Length or a chunked body")
+    try:
+        length = int(headers['content-length'])
+    except ValueError:
+        raise HttpError(400, "Malformed Content-Length")
+    if length > max_bytes:
+        raise HttpError(413, f"Upload larger than {max_bytes // (1024 * 1024)} MB")
+    while size < length:
+        data = await read(min(length - size, CHUNK_SIZE))
+        f.write(data)
+        size += len(data)
+    return size
+
+
+async def send_response(writer, status, body=b'', content_type='text/plain; charset=utf-8',
+                        headers=None, keep_alive=True):
+    lines = [f"HTTP/1.1 {status} {STATUS_TEXT.get(status, '')}",
+             f"Content-Type: {content_type}",
+             f"Content-Length: {len(body)}",
+             f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+    lines += [f"{name}: {value}" for name, value in (headers or {}).items()]
+    writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + body)
+    await writer.drain()
+
+
+async def send_file(writer, path, content_type, headers, keep_alive=True):
+    """Stream a file as a 200 response, one chunk at a time."""
+    lines = ["HTTP/1.1 200 OK",
+             f"Content-Type: {content_type}",
+             f"Content-Length: {os.path.getsize(path)}",
+             f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+    lines += [f"{name}: {value}" for name, value in headers.items()]
+    writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(CHUNK_SIZE)
+            if not data:
+                break
+            writer.write(data)
+            # Waits while the client is slower than the disk, so the buffer stays small
+            await writer.drain()
+
+
+class ConversionServer:
+    """Serves conversions from a pool of warm worker processes."""
+
+    def __init__(self, workers=None, max_jobs=None, max_upload=512 * 1024 * 1024, timeout=300,
+                 cache_dir=DEFAULT_CACHE_DIR, cache_bytes=DEFAULT_MAX_BYTES, temp_dir=None,
+                 memory_budget=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.max_jobs = max_jobs or self.workers * 4
+        self.max_upload = max_upload
+        self.timeout = timeout
+        self.cache_dir = cache_dir
+        self.cache_bytes = cache_bytes
+        self.temp_dir = temp_dir
+        self.memory_budget = memory_budget
+        # Waiters are futures, resolved once their conversion may start
+        self.admission = AdmissionQueue(memory_budget)
+        self.executor = None
+        self.ready = False
+        self.jobs = 0
+        self.counters = {'requests': 0, 'converted': 0, 'failed': 0, 'rejected': 0, 'cached': 0,
+                         'bytes_in': 0, 'bytes_out': 0}
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.started = time.time()
+
+    async def start(self, host='127.0.0.1', port=DEFAULT_PORT):
+        if self.memory_budget:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=set_pixel_limit,
+                                                initargs=(self.memory_budget,))
+        else:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        server = await asyncio.start_server(self.handle_connection, host, port, limit=MAX_HEADER_BYTES)
+        # One warm-up per worker; submitted together, so the pool starts them all
+        loop = asyncio.get_running_loop()
+        pids = await asyncio.gather(*[loop.run_in_executor(self.executor, warm_up)
+                                      for _ in range(self.workers)])
+        self.ready = True
+        print(f"Serving on http://{host}:{server.sockets[0].getsockname()[1]} with "
+              f"{len(set(pids))} warm workers", file=sys.stderr, flush=True)
+        return server
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+
+    def metrics(self):
+        elapsed = time.time() - self.started
+        return dict(self.counters, uptime=elapsed, workers=self.workers, jobs=self.jobs,
+                    max_jobs=self.max_jobs, memory_budget=self.memory_budget,
+                    memory_in_use=self.admission.in_use, memory_waiting=len(self.admission),
+                    latency_p50=percentile(self.latencies, 0.5),
+                    latency_p95=percentile(self.latencies, 0.95),
+                    throughput=format_rate(self.counters['converted'], self.counters['bytes_in'], elapsed))
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request = None
+                try:
+                    request = await read_request(reader)
+                    if request is None:
+                        break
+                    self.counters['requests'] += 1
+                    await self.handle(request, reader, writer)
+                except HttpError as e:
+                    # The body may be partly unread, so the connection cannot be reused
+                    await send_response(writer, e.status, f"{e}\n".encode(), headers=e.headers,
+                                        keep_alive=False)
+                    break
+                except asyncio.TimeoutError:
+                    await send_response(writer, 408, b"Timed out reading the request\n", keep_alive=False)
+                    break
+                if not request.keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def handle(self, request, reader, writer):
+        if request.path == '/convert':
+            if request.method != 'POST':
+                raise HttpError(405, "Use POST", {'Allow': 'POST'})
+            await self.convert(request, reader, writer)
+            return
+        if request.method != 'GET':
+            raise HttpError(405, "Use GET", {'Allow': 'GET'})
+        if request.path == '/health':
+            if not self.ready:
+                raise HttpError(503, "Warming up")
+            await send_response(writer, 200, b"ok\n", keep_alive=request.keep_alive)
+        elif request.path == '/formats':
+            source_format = canonical_format(request.query.get('from', ''))
+            body = json.dumps({'from': source_format, 'targets': conversion_targets(source_format)})
+            await send_response(writer, 200, body.encode(), 'application/json', keep_alive=request.keep_alive)
+        elif request.path == '/metrics':
+            await send_response(writer, 200, json.dumps(self.metrics(), indent=2).encode(),
+                                'application/json', keep_alive=request.keep_alive)
+        else:
+            raise HttpError(404, f"No such endpoint: {request.path}")
+
+    def _options(self, query):
+        """Validate the conversion parameters of a request."""
+        if 'format' not in query:
+            raise HttpError(400, "Missing format parameter")
+        target_format = canonical_format(query['format'])
+        try:
+            scale = float(query.get('scale', 1.0))
+            max_bytes = int(query['max_size']) * 1024 if 'max_size' in query else None
+            dpi = float(query.get('dpi', DEFAULT_DPI))
+        except ValueError:
+            raise HttpError(400, "scale, max_size and dpi must be numbers")
+        if scale <= 0 or dpi <= 0:
+            raise HttpError(400, "scale and dpi must be greater than 0")
+        if max_bytes is not None and (max_bytes < 1 or target_format not in TARGET_SIZE_FORMATS):
+            raise HttpError(400, "max_size needs format jpg or webp and at least 1 KB")
+        return target_format, scale, max_bytes, dpi
+
+    def _wake(self):
+        """Let the conversions waiting for memory start, as far as the budget allows."""
+        admitted = self.admission.admit()
+        while admitted:
+            abandoned = False
+            for waiter, cost in admitted:
+                if waiter.cancelled():
+                    # Its request went away while waiting
+                    self.admission.release(cost)
+                    abandoned = True
+                else:
+                    waiter.set_result(None)
+            admitted = self.admission.admit() if abandoned else []
+
+    def _release(self, cost):
+        self.admission.release(cost)
+        self._wake()
+
+    async def _admit(self, cost):
+        """Wait until a conversion estimated at cost bytes fits in the memory budget."""
+        waiter = asyncio.get_running_loop().create_future()
+        self.admission.add(waiter, cost)
+        self._wake()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if not waiter.cancelled():
+                # Admitted just as the request was cancelled
+                self._release(cost)
+            raise
+
+    async def convert(self, request, reader, writer):
+        start = time.perf_counter()
+        expects_continue = request.headers.get('expect', '').lower() == '100-continue'
+        try:
+            target_format, scale, max_bytes, dpi = self._options(request.query)
+        except HttpError:
+            if not expects_continue:
+                # Read the upload first, or the client sees a reset instead of the error
+                with open(os.devnull, 'wb') as f:
+                    await read_body(reader, request.headers, f, self.max_upload)
+            raise
+        if self.jobs >= self.max_jobs:
+            # Refuse without reading the upload, the client retries later
+            self.counters['rejected'] += 1
+            raise HttpError(503, "Too many conversions in progress", {'Retry-After': '1'})
+        if expects_continue:
+            # The client waits for this before sending a large upload
+            writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+
+        self.jobs += 1
+        work_dir = tempfile.mkdtemp(prefix="kommverters-serve-", dir=self.temp_dir)
+        try:
+            name = os.path.basename(request.query.get('name', '')) or 'upload'
+            input_path = os.path.join(work_dir, 'input' + os.path.splitext(name)[1].lower())
+            with open(input_path, 'wb') as f:
+                self.counters['bytes_in'] += await read_body(reader, request.headers, f, self.max_upload)
+
+            source_format = detect_format(input_path)
+            if target_format not in conversion_targets(source_format):
+                raise HttpError(415, f"Conversion from {source_format or 'unknown'} to {target_format} "
+                                     f"not supported")
+            page_range = request.query.get('pages', '')
+            if source_format == 'pdf' and (page_range or format_kind(target_format) == 'image'):
+                try:
+                    pages = parse_page_range(page_range, pdf_page_count(input_path))
+                except ValueError as e:
+                    raise HttpError(400, str(e))
+                # A response carries one file, and PDF pages become one image each
+                if format_kind(target_format) == 'image' and len(pages) != 1:
+                    raise HttpError(400, "PDF to image needs a single page, e.g. pages=1")
+
+            cost = 0
+            if self.memory_budget:
+                cost = estimate_memory(input_path, target_format, scale, page_range=page_range)
+            await self._admit(cost)
+            output_path = os.path.join(work_dir, f"output.{target_format}")
+            loop = asyncio.get_running_loop()
+            submitted = self.executor.submit(convert_one, input_path, output_path, target_format, scale, None,
+                                             page_range, 1, self.cache_dir, self.cache_bytes, max_bytes,
+                                             dpi=dpi)
+            # The memory is in use until the worker is done, even after a 504
+            submitted.add_done_callback(lambda _: loop.call_soon_threadsafe(self._release, cost))
+            job = asyncio.wrap_future(submitted)
+            try:
+                result = await asyncio.wait_for(job, self.timeout)
+            except asyncio.TimeoutError:
+                # The worker finishes the job in the background; its output is discarded
+                self.counters['failed'] += 1
+                raise HttpError(504, f"Conversion took longer than {self.timeout}s")
+            if result['error']:
+                self.counters['failed'] += 1
+                raise HttpError(422, f"Conversion failed: {result['error']}")
+
+            self.counters['converted'] += 1
+            self.counters['cached'] += result['cached']
+            self.counters['bytes_out'] += result['output_size']
+            download_name = f"{os.path.splitext(name)[0]}.{target_format}"
+            content_type = mimetypes.guess_type(download_name)[0] or 'application/octet-stream'
+            await send_file(writer, output_path, content_type, {
+                'Content-Disposition': f'attachment; filename="{download_name}"',
+                'X-Conversion-Seconds': f"{result['seconds']:.3f}",
+                'X-Cache': 'hit' if result['cached'] else 'miss',
+            }, request.keep_alive)
+            self.latencies.append(time.perf_counter() - start)
+        finally:
+            self.jobs -= 1
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+
+async def serve(server, host, port):
+    listener = await server.start(host, port)
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, listener.close)
+    except NotImplementedError:
+        # No signal handlers in the Windows event loop; Ctrl+C still stops the service
+        pass
+    async with listener:
+        try:
+            await listener.serve_forever()
+        except asyncio.CancelledError:
+            pass
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Serve conversions over HTTP on this machine.")
+    parser.add_argument("--host", default="127.0.0.1", help="Address to listen on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"Port (default: {DEFAULT_PORT})")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--max-jobs", type=int, default=None,
+                        help="Conversions running or queued at once, more get 503 (default: 4 per worker)")
+    parser.add_argument("--memory-budget", type=int, default=None,
+                        help="Only start conversions while their estimated peak memory fits in this many MB")
+    parser.add_argument("--max-upload", type=int, default=512, help="Largest upload in MB (default: 512)")
+    parser.add_argument("--timeout", type=float, default=300,
+                        help="Seconds a conversion may take before 504 (default: 300)")
+    parser.add_argument("--temp-dir", default=None, help="Keep uploads and outputs here while converting")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR,
+                        help=f"Reuse earlier outputs stored here (default: {DEFAULT_CACHE_DIR})")
+    parser.add_argument("--no-cache", action="store_true", help="Always convert, ignoring the cache")
+    args = parser.parse_args(argv)
+    if args.workers is not None and args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.max_jobs is not None and args.max_jobs < 1:
+        parser.error("--max-jobs must be at least 1")
+    if args.memory_budget is not None and args.memory_budget < 1:
+        parser.error("--memory-budget must be at least 1 MB")
+    if args.max_upload < 1:
+        parser.error("--max-upload must be at least 1 MB")
+    if args.timeout <= 0:
+        parser.error("--timeout must be greater than 0")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    server = ConversionServer(args.workers, args.max_jobs, args.max_upload * 1024 * 1024, args.timeout,
+                              None if args.no_cache else args.cache_dir, temp_dir=args.temp_dir,
+                              memory_budget=args.memory_budget * 1024 * 1024 if args.memory_budget else None)
+    try:
+        asyncio.run(serve(server, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,7 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# The scripts live at the top of the tree, not in a package
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
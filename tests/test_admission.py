@@ -0,0 +1,101 @@
+"""
+Admission of jobs under a memory budget.
+"""
+from PIL import Image
+
+from convertions.admission import AdmissionQueue, estimate_memory, no_pixel_limit, set_pixel_limit
+
+
+def queue_of(budget, *costs, max_bypass=8):
+    queue = AdmissionQueue(budget, max_bypass)
+    for index, cost in enumerate(costs):
+        queue.add(f"job{index}", cost)
+    return queue
+
+
+def jobs(admitted):
+    return [job for job, _ in admitted]
+
+
+def test_first_fit_packs_small_jobs_around_large_ones():
+    queue = queue_of(100, 60, 60, 30, 10)
+    assert jobs(queue.admit()) == ['job0', 'job2', 'job3']
+    assert (queue.in_use, queue.running, queue.peak, len(queue)) == (100, 3, 100, 1)
+
+    queue.release(60, True)
+    assert jobs(queue.admit()) == ['job1']
+    assert queue.in_use == 100
+
+
+def test_slots_limit_admission():
+    queue = queue_of(None, 10, 10, 10)
+    assert jobs(queue.admit(2)) == ['job0', 'job1']
+    assert jobs(queue.admit(0)) == []
+    assert jobs(queue.admit()) == ['job2']
+
+
+def test_no_budget_admits_everything():
+    queue = queue_of(None, 10 ** 12, 10 ** 12)
+    assert len(queue.admit()) == 2
+    queue.release(10 ** 12, True)
+    assert queue.solo == 0
+
+
+def test_bypass_limit_holds_the_queue():
+    queue = queue_of(100, 50, max_bypass=1)
+    queue.admit()
+    queue.add('large', 80)
+    queue.add('small1', 10)
+    queue.add('small2', 10)
+    # large may be overtaken once, then nothing passes it
+    assert jobs(queue.admit()) == ['small1']
+    assert jobs(queue.admit()) == []
+
+    queue.release(50, True)
+    assert jobs(queue.admit()) == ['large', 'small2']
+    assert queue.in_use == 100
+
+
+def test_job_over_budget_runs_alone():
+    queue = queue_of(100, 10, 150, 10, 10)
+    # job1 waits for the running jobs to finish; smaller ones pass it meanwhile
+    assert jobs(queue.admit()) == ['job0', 'job2', 'job3']
+    queue.release(10, True)
+    queue.release(10, True)
+    assert jobs(queue.admit()) == []
+    queue.release(10, True)
+    assert jobs(queue.admit()) == ['job1']
+    queue.add('job4', 10)
+    assert jobs(queue.admit()) == []
+    assert queue.peak == 150
+
+    queue.release(150, True)
+    assert queue.solo == 1
+    assert jobs(queue.admit()) == ['job4']
+
+
+def test_failed_job_over_budget_is_not_counted():
+    queue = queue_of(100, 150)
+    assert jobs(queue.admit()) == ['job0']
+    queue.release(150, False)
+    assert (queue.solo, queue.in_use, queue.running) == (0, 0, 0)
+
+
+def test_pixel_limit_follows_budget():
+    limit = Image.MAX_IMAGE_PIXELS
+    try:
+        set_pixel_limit(8 * 1000)
+        assert Image.MAX_IMAGE_PIXELS == 1000
+        with no_pixel_limit():
+            assert Image.MAX_IMAGE_PIXELS is None
+        assert Image.MAX_IMAGE_PIXELS == 1000
+    finally:
+        Image.MAX_IMAGE_PIXELS = limit
+
+
+def test_estimate_follows_output_size(tmp_path):
+    path = tmp_path / 'large.png'
+    Image.new('RGB', (2000, 1500)).save(path)
+    full = estimate_memory(str(path), 'webp')
+    assert full > 2000 * 1500 * 3
+    assert estimate_memory(str(path), 'webp', scale=0.25) < full
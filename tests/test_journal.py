@@ -0,0 +1,105 @@
+"""
+Resuming batches from the SQLite journal.
+"""
+import io
+import os
+import sqlite3
+
+from PIL import Image
+
+from batch import run_batch
+from convertions.journal import Journal, input_stamp, is_done, job_params
+
+
+def make_inputs(directory, count=3):
+    paths = []
+    for index in range(count):
+        path = os.path.join(directory, f"image{index}.png")
+        Image.new('RGB', (40 + index, 30), (index * 60, 100, 200)).save(path)
+        paths.append(path)
+    return paths
+
+
+def run(paths, output_dir, journal_path, **options):
+    stream = io.StringIO()
+    results = run_batch(paths, 'jpg', workers=1, output_directory=str(output_dir),
+                        journal_path=str(journal_path), stream=stream, **options)
+    return results, stream.getvalue()
+
+
+def attempts(journal_path, input_path):
+    with sqlite3.connect(journal_path) as db:
+        return db.execute("SELECT attempts, state FROM jobs WHERE input = ?",
+                          (os.path.abspath(input_path),)).fetchone()
+
+
+def test_rerun_skips_done_jobs(tmp_path):
+    paths = make_inputs(tmp_path)
+    journal_path = tmp_path / 'journal.db'
+    results, _ = run(paths, tmp_path / 'out', journal_path)
+    assert sorted(result['input'] for result in results) == sorted(paths)
+    assert not any(result['error'] for result in results)
+
+    results, log = run(paths, tmp_path / 'out', journal_path)
+    assert results == []
+    assert "Skipping 3 files" in log
+    assert attempts(journal_path, paths[0]) == (1, 'done')
+
+
+def test_changed_input_and_missing_output_convert_again(tmp_path):
+    paths = make_inputs(tmp_path)
+    journal_path = tmp_path / 'journal.db'
+    results, _ = run(paths, tmp_path / 'out', journal_path)
+
+    Image.new('RGB', (80, 60), 'white').save(paths[0])
+    stat = os.stat(paths[0])
+    os.utime(paths[0], ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    os.remove(next(result['output'] for result in results if result['input'] == paths[1]))
+
+    results, log = run(paths, tmp_path / 'out', journal_path)
+    assert sorted(result['input'] for result in results) == sorted(paths[:2])
+    assert "Skipping 1 files" in log
+    with Image.open(next(result['output'] for result in results if result['input'] == paths[0])) as img:
+        assert img.size == (80, 60)
+    assert attempts(journal_path, paths[0]) == (2, 'done')
+
+
+def test_other_settings_are_other_jobs(tmp_path):
+    paths = make_inputs(tmp_path, 2)
+    journal_path = tmp_path / 'journal.db'
+    run(paths, tmp_path / 'out', journal_path)
+    results, _ = run(paths, tmp_path / 'out', journal_path, scale=0.5)
+    assert len(results) == 2
+
+
+def test_failed_jobs_are_retried(tmp_path):
+    paths = make_inputs(tmp_path, 1)
+    broken = tmp_path / 'broken.png'
+    broken.write_bytes(b'\x89PNG\r\n\x1a\n' + b'\0' * 64)
+    journal_path = tmp_path / 'journal.db'
+    results, _ = run(paths + [str(broken)], tmp_path / 'out', journal_path)
+    assert [result['input'] for result in results if result['error']] == [str(broken)]
+
+    results, _ = run(paths + [str(broken)], tmp_path / 'out', journal_path)
+    assert [result['input'] for result in results] == [str(broken)]
+    assert attempts(journal_path, broken) == (2, 'failed')
+
+
+def test_interrupted_job_is_not_done(tmp_path):
+    source = tmp_path / 'a.png'
+    Image.new('RGB', (4, 4)).save(source)
+    output = tmp_path / 'a.jpg'
+    output.write_bytes(b'partial')
+    params = job_params('jpg', scale=1.0)
+    stamp = input_stamp(source)
+    with Journal(str(tmp_path / 'journal.db'), batch_size=1000, batch_seconds=1000) as journal:
+        journal.started(source, params, output, stamp)
+        assert journal.counts(params) == {'running': 1, 'done': 0, 'failed': 0}
+        assert not is_done(journal.completed(params), source, stamp)
+
+        journal.finished(source, params, {'output': str(output), 'output_size': 7, 'seconds': 0.1,
+                                          'error': None}, stamp)
+        completed = journal.completed(params)
+        assert is_done(completed, source, stamp)
+        assert not is_done(completed, source, (stamp[0] + 1, stamp[1]))
+        assert journal.completed(job_params('png', scale=1.0)) == {}
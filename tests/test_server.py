@@ -0,0 +1,201 @@
+"""
+The conversion service, run on localhost on a free port.
+"""
+import asyncio
+import http.client
+import io
+import json
+import socket
+import threading
+
+from PIL import Image
+import pytest
+
+from batch import percentile
+from server import ConversionServer
+
+
+def png_bytes(size=(64, 48)):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, (200, 40, 40)).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+@pytest.fixture(scope='module')
+def service(tmp_path_factory):
+    """A running ConversionServer with one worker and room for one job."""
+    server = ConversionServer(workers=1, max_jobs=1, timeout=60,
+                              cache_dir=str(tmp_path_factory.mktemp('cache')),
+                              temp_dir=str(tmp_path_factory.mktemp('work')))
+    loop = asyncio.new_event_loop()
+    started = threading.Event()
+    state = {}
+
+    def run():
+        asyncio.set_event_loop(loop)
+        try:
+            listener = loop.run_until_complete(server.start('127.0.0.1', 0))
+        except BaseException as e:
+            state['error'] = e
+            started.set()
+            return
+        state['port'] = listener.sockets[0].getsockname()[1]
+        started.set()
+        loop.run_forever()
+        listener.close()
+        loop.run_until_complete(listener.wait_closed())
+        loop.close()
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    assert started.wait(60), "server did not start"
+    if 'error' in state:
+        raise state['error']
+    state['server'] = server
+    yield state
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join(10)
+    server.close()
+
+
+def request(service, method, path, body=None, headers=None, encode_chunked=False):
+    connection = http.client.HTTPConnection('127.0.0.1', service['port'], timeout=30)
+    try:
+        connection.request(method, path, body, headers or {}, encode_chunked=encode_chunked)
+        response = connection.getresponse()
+        return response.status, dict(response.getheaders()), response.read()
+    finally:
+        connection.close()
+
+
+def send_head(service, path, length, expect_continue=True):
+    """Open a raw connection and send the head of a POST, without its body."""
+    sock = socket.create_connection(('127.0.0.1', service['port']), timeout=30)
+    head = f"POST {path} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {length}\r\n"
+    if expect_continue:
+        head += "Expect: 100-continue\r\n"
+    sock.sendall((head + "\r\n").encode('latin-1'))
+    return sock
+
+
+def read_interim(sock):
+    """Read one response head that carries no body, e.g. 100 Continue."""
+    data = b''
+    while b'\r\n\r\n' not in data:
+        chunk = sock.recv(1)
+        if not chunk:
+            break
+        data += chunk
+    return data.decode('latin-1').split('\r\n')[0]
+
+
+def read_response(sock):
+    response = http.client.HTTPResponse(sock)
+    response.begin()
+    return response.status, dict(response.getheaders()), response.read()
+
+
+def test_health_and_formats(service):
+    assert request(service, 'GET', '/health')[:1] == (200,)
+    status, _, body = request(service, 'GET', '/formats?from=png')
+    assert status == 200
+    assert 'webp' in json.loads(body)['targets']
+
+
+def test_convert_and_cache(service):
+    upload = png_bytes()
+    status, headers, body = request(service, 'POST', '/convert?format=webp&name=red.png', upload)
+    assert status == 200
+    assert headers['X-Cache'] == 'miss'
+    assert headers['Content-Disposition'] == 'attachment; filename="red.webp"'
+    with Image.open(io.BytesIO(body)) as img:
+        assert (img.format, img.size) == ('WEBP', (64, 48))
+
+    status, headers, cached = request(service, 'POST', '/convert?format=webp&name=red.png', upload)
+    assert status == 200
+    assert headers['X-Cache'] == 'hit'
+    assert cached == body
+
+
+def test_scale(service):
+    status, _, body = request(service, 'POST', '/convert?format=jpg&scale=0.5', png_bytes())
+    assert status == 200
+    with Image.open(io.BytesIO(body)) as img:
+        assert img.size == (32, 24)
+
+
+def test_unsupported_conversion(service):
+    status, _, body = request(service, 'POST', '/convert?format=png&name=notes.txt', b"just text\n")
+    assert status == 415
+    assert b"not supported" in body
+
+
+def test_bad_options_refused_before_upload(service):
+    sock = send_head(service, '/convert?format=webp&scale=zero', 1024)
+    try:
+        status, _, body = read_response(sock)
+    finally:
+        sock.close()
+    assert status == 400
+    assert b"numbers" in body
+
+
+def test_expect_continue(service):
+    upload = png_bytes()
+    sock = send_head(service, '/convert?format=png', len(upload))
+    try:
+        assert read_interim(sock) == "HTTP/1.1 100 Continue"
+        sock.sendall(upload)
+        status, _, body = read_response(sock)
+    finally:
+        sock.close()
+    assert status == 200
+    with Image.open(io.BytesIO(body)) as img:
+        assert img.format == 'PNG'
+
+
+def test_busy_server_refuses_before_upload(service):
+    upload = png_bytes()
+    # The first request holds the only job slot while its upload is pending
+    first = send_head(service, '/convert?format=gif', len(upload))
+    try:
+        assert read_interim(first) == "HTTP/1.1 100 Continue"
+        second = send_head(service, '/convert?format=gif', len(upload))
+        try:
+            status, headers, _ = read_response(second)
+        finally:
+            second.close()
+        assert status == 503
+        assert headers['Retry-After'] == '1'
+
+        first.sendall(upload)
+        assert read_response(first)[0] == 200
+    finally:
+        first.close()
+    assert service['server'].counters['rejected'] >= 1
+
+
+def test_chunked_upload(service):
+    upload = png_bytes((300, 200))
+    chunks = [upload[offset:offset + 1000] for offset in range(0, len(upload), 1000)]
+    status, _, body = request(service, 'POST', '/convert?format=bmp', iter(chunks),
+                              {'Content-Type': 'image/png'}, encode_chunked=True)
+    assert status == 200
+    with Image.open(io.BytesIO(body)) as img:
+        assert (img.format, img.size) == ('BMP', (300, 200))
+
+
+def test_metrics(service):
+    assert request(service, 'POST', '/convert?format=tiff', png_bytes())[0] == 200
+    status, _, body = request(service, 'GET', '/metrics')
+    assert status == 200
+    metrics = json.loads(body)
+    assert metrics['converted'] >= 1
+    assert metrics['latency_p50'] is not None
+
+
+def test_percentile():
+    assert percentile([], 0.5) is None
+    assert percentile([3, 1, 2], 0.5) == 2
+    assert percentile(list(range(100)), 0.95) == 95
+    assert percentile([7], 0.95) == 7
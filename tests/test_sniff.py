@@ -0,0 +1,97 @@
+"""
+Format sniffing, checked against what Pillow reads from the same files.
+"""
+import random
+import zipfile
+
+from PIL import Image
+import pytest
+
+from convertions.sniff import FileInfo, detect_format, sniff_file
+
+# (Pillow format, mode saved, save options)
+IMAGES = [
+    ('PNG', '1', {}), ('PNG', 'L', {}), ('PNG', 'I;16', {}), ('PNG', 'LA', {}), ('PNG', 'RGB', {}),
+    ('PNG', 'RGBA', {}), ('PNG', 'P', {}),
+    ('JPEG', 'L', {}), ('JPEG', 'RGB', {}), ('JPEG', 'CMYK', {}), ('JPEG', 'RGB', {'progressive': True}),
+    # An ICC profile pushes the frame header past the first read
+    ('JPEG', 'RGB', {'icc_profile': b'\0' * 20000}),
+    ('GIF', 'P', {}),
+    ('BMP', '1', {}), ('BMP', 'P', {}), ('BMP', 'RGB', {}), ('BMP', 'RGBA', {}),
+    ('WEBP', 'RGB', {}), ('WEBP', 'RGB', {'lossless': True}), ('WEBP', 'RGBA', {}),
+    ('WEBP', 'RGBA', {'lossless': True}),
+    ('TIFF', '1', {}), ('TIFF', 'L', {}), ('TIFF', 'LA', {}), ('TIFF', 'RGB', {}), ('TIFF', 'RGBA', {}),
+    ('TIFF', 'P', {}), ('TIFF', 'CMYK', {}), ('TIFF', 'RGB', {'compression': 'tiff_lzw'}),
+]
+
+EXTENSIONS = {'PNG': 'png', 'JPEG': 'jpg', 'GIF': 'gif', 'BMP': 'bmp', 'WEBP': 'webp', 'TIFF': 'tiff'}
+
+
+@pytest.mark.parametrize('pillow_format, mode, options', IMAGES)
+def test_image_header_matches_pillow(tmp_path, pillow_format, mode, options):
+    fmt = EXTENSIONS[pillow_format]
+    # No extension, so only the content can tell
+    path = tmp_path / 'image'
+    Image.new(mode, (123, 45)).save(path, format=pillow_format, **options)
+    with Image.open(path) as img:
+        expected = FileInfo(fmt, 'image', img.width, img.height, img.mode)
+    assert sniff_file(path) == expected
+
+
+def write_zip(path, entries):
+    with zipfile.ZipFile(path, 'w') as archive:
+        for name, data in entries:
+            # The ODT mimetype entry is stored first and uncompressed
+            archive.writestr(name, data, zipfile.ZIP_STORED if name == 'mimetype' else zipfile.ZIP_DEFLATED)
+
+
+DOCUMENTS = [
+    (b'%PDF-1.7\n%\xe2\xe3\xcf\xd3\n1 0 obj\n', 'pdf'),
+    (b'\xef\xbb\xbf\r\n  %PDF-1.4\n', 'pdf'),
+    (b'Notes on the %PDF-1.4 header\n', 'txt'),
+    (b'{\\rtf1\\ansi\\deff0 {\\fonttbl}Hello}', 'rtf'),
+    (b'\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1' + b'\0' * 504, 'doc'),
+    ('Zeile mit Umlauten: äöü\n\tund Tabs\n'.encode(), 'txt'),
+    (b'\x00\x01\x02binary\x00', None),
+    (b'', None),
+]
+
+
+@pytest.mark.parametrize('data, fmt', DOCUMENTS)
+def test_document_magic(tmp_path, data, fmt):
+    path = tmp_path / 'document'
+    path.write_bytes(data)
+    info = sniff_file(path)
+    assert (info.format if info else None) == fmt
+    if info:
+        assert info == FileInfo(fmt, 'document', None, None, None)
+
+
+@pytest.mark.parametrize('entries, fmt', [
+    ([('[Content_Types].xml', '<Types/>'), ('word/document.xml', '<w:document/>')], 'docx'),
+    # word/ only in the central directory, past the first read
+    ([('media/image1.png', random.Random(0).randbytes(8000)), ('word/document.xml', '<w:document/>')], 'docx'),
+    ([('mimetype', 'application/vnd.oasis.opendocument.text'), ('content.xml', '<office:document/>')], 'odt'),
+    ([('readme.txt', 'just an archive')], None),
+])
+def test_zip_documents(tmp_path, entries, fmt):
+    path = tmp_path / 'archive'
+    write_zip(path, entries)
+    info = sniff_file(path)
+    assert (info.format if info else None) == fmt
+
+
+def test_truncated_header_keeps_format(tmp_path):
+    path = tmp_path / 'cut.png'
+    path.write_bytes(b'\x89PNG\r\n\x1a\n\0\0\0\rIHDR\0\0')
+    assert sniff_file(path) == FileInfo('png', 'image', None, None, None)
+
+
+def test_detect_format_falls_back_to_extension(tmp_path):
+    renamed = tmp_path / 'photo.txt'
+    Image.new('RGB', (8, 8)).save(renamed, format='JPEG')
+    assert detect_format(renamed) == 'jpg'
+    unknown = tmp_path / 'scan.JPEG'
+    unknown.write_bytes(b'\x00' * 16)
+    assert detect_format(unknown) == 'jpg'
+    assert detect_format(tmp_path / 'missing.tif') == 'tiff'
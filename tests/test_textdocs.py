@@ -0,0 +1,118 @@
+"""
+Round trips between plain text, RTF, ODT and DOCX, and text to PDF.
+"""
+import pytest
+
+from convertions.sniff import sniff_file
+from convertions.textdocs import PDF_ROWS, READERS, convert_text_document, text_to_pdf
+
+TEXT = (
+    "Kommverters notes\n"
+    "\n"
+    "Tabs\tstay\ttabs, and  runs   of spaces stay too.\n"
+    "  Leading spaces, <markup> & ampersands\n"
+    "Umlaute äöüß, € and 😀\n"
+)
+
+RTF = (
+    rb"{\rtf1\ansi\ansicpg1252\deff0{\fonttbl{\f0 Times;}}{\*\generator test;}"
+    rb"\pard\outlinelevel0 Chapter one\par" b"\r\n"
+    rb"\pard Plain, {\b bold}, {\i italic}, {\ul underlined}, {\b\i both}.\par" b"\r\n"
+    rb"Tab\tab and\line break, M\'e4rz, \u8364? and \u-10179?\u-8704?\par" b"\r\n"
+    rb"\pard\outlinelevel1 Section\par" b"\r\n"
+    rb"\pard Last}"
+)
+
+
+def read(path, fmt):
+    return list(READERS[fmt](str(path), lambda fraction: None))
+
+
+def normalized(paragraphs):
+    """(heading, [(text, bold, italic, underline)]) with empty runs dropped and equal neighbours merged."""
+    result = []
+    for paragraph in paragraphs:
+        runs = []
+        for run in paragraph.runs:
+            if not run.text:
+                continue
+            if runs and runs[-1][1:] == tuple(run[1:]):
+                runs[-1] = (runs[-1][0] + run.text,) + runs[-1][1:]
+            else:
+                runs.append(tuple(run))
+        result.append((paragraph.heading, runs))
+    return result
+
+
+def convert(tmp_path, source, source_format, target_format):
+    output = tmp_path / f"{source.stem}-{source_format}.{target_format}"
+    fractions = []
+    assert convert_text_document(str(source), str(output), source_format, target_format, fractions.append)
+    assert fractions[-1] == 1.0
+    assert sniff_file(output).format == target_format
+    return output
+
+
+@pytest.fixture
+def text_file(tmp_path):
+    path = tmp_path / 'notes.txt'
+    path.write_text(TEXT, encoding='utf-8')
+    return path
+
+
+@pytest.fixture
+def rtf_file(tmp_path):
+    path = tmp_path / 'letter.rtf'
+    path.write_bytes(RTF)
+    return path
+
+
+def test_read_rtf(rtf_file):
+    assert normalized(read(rtf_file, 'rtf')) == [
+        (1, [("Chapter one", False, False, False)]),
+        (0, [("Plain, ", False, False, False), ("bold", True, False, False), (", ", False, False, False),
+             ("italic", False, True, False), (", ", False, False, False), ("underlined", False, False, True),
+             (", ", False, False, False), ("both", True, True, False), (".", False, False, False)]),
+        (0, [("Tab\tand\nbreak, März, € and \U0001f600", False, False, False)]),
+        (2, [("Section", False, False, False)]),
+        (0, [("Last", False, False, False)]),
+    ]
+
+
+@pytest.mark.parametrize('target_format', ['docx', 'odt'])
+def test_text_round_trip(tmp_path, text_file, target_format):
+    output = convert(tmp_path, text_file, 'txt', target_format)
+    lines = [''.join(run.text for run in paragraph.runs) for paragraph in read(output, target_format)]
+    assert lines == TEXT.splitlines()
+
+
+@pytest.mark.parametrize('target_format', ['docx', 'odt'])
+def test_rtf_round_trip(tmp_path, rtf_file, target_format):
+    output = convert(tmp_path, rtf_file, 'rtf', target_format)
+    assert normalized(read(output, target_format)) == normalized(read(rtf_file, 'rtf'))
+
+
+@pytest.mark.parametrize('first, second', [('docx', 'odt'), ('odt', 'docx')])
+def test_office_round_trip(tmp_path, rtf_file, first, second):
+    expected = normalized(read(rtf_file, 'rtf'))
+    middle = convert(tmp_path, rtf_file, 'rtf', first)
+    output = convert(tmp_path, middle, first, second)
+    assert normalized(read(output, second)) == expected
+    back = convert(tmp_path, output, second, first)
+    assert normalized(read(back, first)) == expected
+
+
+def test_unsupported_conversion(tmp_path, text_file):
+    with pytest.raises(ValueError):
+        convert_text_document(str(text_file), str(tmp_path / 'out.rtf'), 'txt', 'rtf')
+
+
+def test_text_to_pdf_pages(tmp_path):
+    source = tmp_path / 'long.txt'
+    # One page and a line, then a form feed starts a third page
+    source.write_text("\n".join(f"line {index}" for index in range(PDF_ROWS + 1)) + "\n\fafter the break\n")
+    output = tmp_path / 'long.pdf'
+    assert text_to_pdf(str(source), str(output))
+    data = output.read_bytes()
+    assert data.startswith(b'%PDF-') and data.rstrip().endswith(b'%%EOF')
+    assert b'/Count 3' in data
@@ -0,0 +1,68 @@
+from PySide6.QtCore import QObject, QThreadPool, Signal
+from PySide6.QtGui import QImage, QPixmap
+from collections import OrderedDict
+
+from conversion_worker import ThumbnailWorker
+from convertions.formats import THUMBNAIL_SIZE
+
+# Thumbnails are disk-bound and small, two threads keep up without
+# competing with conversions for the CPU
+THUMBNAIL_WORKERS = 2
+# Pixmaps kept in memory, the disk cache holds the rest
+MEMORY_ITEMS = 512
+
+_service = None
+
+
+class ThumbnailService(QObject):
+    """
+    Hand out preview pixmaps without blocking the GUI thread.
+    request() returns the pixmap at once if it is in memory, otherwise it
+    queues a background render and thumbnail_ready fires when it is loaded.
+    """
+    thumbnail_ready = Signal(str)   # source path
+
+    def __init__(self, size: int = THUMBNAIL_SIZE, parent=None):
+        super().__init__(parent)
+        self.size = size
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(THUMBNAIL_WORKERS)
+        self.pixmaps = OrderedDict()   # path -> QPixmap, or None if there is no preview
+        self.workers = {}              # path -> ThumbnailWorker in flight
+        self.priority = 0
+
+    def request(self, file_path: str):
+        """Return the thumbnail if it is ready, otherwise schedule it and return None."""
+        if file_path in self.pixmaps:
+            self.pixmaps.move_to_end(file_path)
+            return self.pixmaps[file_path]
+        if file_path not in self.workers:
+            worker = ThumbnailWorker(file_path, self.size)
+            worker.signals.ready.connect(self._on_ready)
+            self.workers[file_path] = worker
+            # The newest requests are for what is on screen now, run them first
+            self.priority += 1
+            self.pool.start(worker, self.priority)
+        return None
+
+    def cancel_pending(self) -> None:
+        """Drop requests that have not started, e.g. when the file list is replaced."""
+        for file_path, worker in list(self.workers.items()):
+            if self.pool.tryTake(worker):
+                del self.workers[file_path]
+
+    def _on_ready(self, file_path: str, image: QImage) -> None:
+        self.workers.pop(file_path, None)
+        self.pixmaps[file_path] = None if image.isNull() else QPixmap.fromImage(image)
+        self.pixmaps.move_to_end(file_path)
+        while len(self.pixmaps) > MEMORY_ITEMS:
+            self.pixmaps.popitem(last=False)
+        self.thumbnail_ready.emit(file_path)
+
+
+def thumbnail_service() -> ThumbnailService:
+    """Return the application's shared ThumbnailService."""
+    global _service
+    if _service is None:
+        _service = ThumbnailService()
+    return _service
@@ -0,0 +1,589 @@
+"""
+Watch-folder daemon for Kommverters.
+
+Converts every file that lands in an inbox directory into an outbox,
+following per-folder rules. Like batch.py it does not import PySide6, and
+files are converted by the same worker function.
+
+A file is picked up once it has settled: no change event for --settle
+seconds and the same size and mtime as when it was last seen, so files
+still being copied in are never converted. On Linux the changes come from
+inotify; elsewhere, or with --poll, the inboxes are rescanned every second.
+
+Conversions run on a bounded process pool. When more files are waiting
+than --max-pending, the daemon stops reading change events until the
+backlog drains. The kernel keeps queueing them meanwhile, and if its queue
+overflows the inboxes are rescanned instead. With --memory-budget a
+settled file only starts once its estimated peak memory fits in the
+budget next to the conversions already running. Outputs keep the whole
+source name, e.g. photo.jpg.webp; they are written under a hidden
+temporary name and renamed into the outbox once complete.
+
+Example:
+    python watch.py inbox/ --outbox outbox/ --format webp --scale 0.5
+    python watch.py --rules rules.json --metrics metrics.json
+
+A rules file lists rules per inbox; the first rule whose patterns match a
+file name applies to it:
+    {"rules": [
+        {"inbox": "in", "outbox": "out/web", "format": "webp", "scale": 0.5,
+         "patterns": ["*.jpg", "*.png"]},
+        {"inbox": "in", "outbox": "out/docs", "format": "docx", "patterns": ["*.pdf"]}
+    ]}
+"""
+import argparse
+from collections import deque, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+import ctypes
+import ctypes.util
+import fnmatch
+import json
+import os
+import select
+import signal
+import struct
+import sys
+import time
+
+from batch import convert_one, percentile
+from convertions.admission import AdmissionQueue, estimate_memory, set_pixel_limit
+from convertions.cache import DEFAULT_CACHE_DIR, DEFAULT_MAX_BYTES
+from convertions.registry import TARGET_FORMATS, conversion_targets
+from convertions.sniff import canonical_format, detect_format, format_kind
+
+# One rule for files in inbox whose names match one of patterns
+Rule = namedtuple('Rule', ['inbox', 'outbox', 'target_format', 'scale', 'patterns'])
+
+# Names of files that are still being written by browsers and copy tools
+PARTIAL_SUFFIXES = ('.part', '.partial', '.tmp', '.crdownload', '.download', '~')
+
+# inotify event bits, from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+EVENT_HEADER = struct.Struct('iIII')
+
+# Detection-to-output latencies kept for the percentiles
+LATENCY_WINDOW = 1000
+
+
+def load_rules(path):
+    """Read rules from a JSON file like the one in the module docstring."""
+    with open(path, encoding='utf-8') as f:
+        config = json.load(f)
+    rules = []
+    for entry in config.get('rules', []):
+        try:
+            rules.append(make_rule(entry['inbox'], entry['outbox'], entry['format'],
+                                   entry.get('scale', 1.0), entry.get('patterns', ['*'])))
+        except KeyError as e:
+            raise ValueError(f"Rule {entry} is missing {e.args[0]!r}")
+    if not rules:
+        raise ValueError(f"No rules in {path}")
+    inboxes = {}
+    for rule in rules:
+        # Outputs are named after the source file alone, so inboxes cannot share an outbox
+        inbox = inboxes.setdefault(rule.outbox, rule.inbox)
+        if inbox != rule.inbox:
+            raise ValueError(f"Outbox {rule.outbox} is shared by inboxes {inbox} and {rule.inbox}")
+    return rules
+
+
+def make_rule(inbox, outbox, target_format, scale=1.0, patterns=('*',)):
+    """Validate one rule and create its outbox."""
+    target_format = canonical_format(target_format)
+    if target_format not in TARGET_FORMATS:
+        raise ValueError(f"Unsupported target format: {target_format}")
+    if scale <= 0:
+        raise ValueError("Scale must be greater than 0")
+    if not os.path.isdir(inbox):
+        raise ValueError(f"Inbox {inbox} is not a directory")
+    inbox, outbox = os.path.realpath(inbox), os.path.realpath(outbox)
+    if inbox == outbox:
+        # Outputs would be picked up as new inputs
+        raise ValueError(f"Outbox {outbox} must not be the inbox")
+    os.makedirs(outbox, exist_ok=True)
+    return Rule(inbox, outbox, target_format, float(scale), [p.lower() for p in patterns])
+
+
+def match_rule(rules, path):
+    """Return the first rule that applies to path, or None."""
+    name = os.path.basename(path)
+    if name.startswith('.') or name.lower().endswith(PARTIAL_SUFFIXES):
+        return None
+    directory = os.path.dirname(path)
+    for rule in rules:
+        if rule.inbox == directory and any(fnmatch.fnmatch(name.lower(), p) for p in rule.patterns):
+            return rule
+    return None
+
+
+def output_path_for(rule, path):
+    """
+    The output of path in the rule's outbox, e.g. 'photo.jpg.webp'. The
+    source extension stays in the name, so 'photo.jpg' and 'photo.png'
+    never write the same file.
+    """
+    return os.path.join(rule.outbox, f"{os.path.basename(path)}.{rule.target_format}")
+
+
+def first_output_path(rule, path):
+    """The file convert_one writes first for path; PDF pages are numbered."""
+    output_path = output_path_for(rule, path)
+    if detect_format(path) == 'pdf' and format_kind(rule.target_format) == 'image':
+        from convertions.documents import page_output_paths, pdf_page_count
+        page_count = pdf_page_count(path)
+        output_path = page_output_paths(output_path, range(page_count), page_count)[0]
+    return output_path
+
+
+def is_converted(rule, path):
+    """True if the outbox already holds an output newer than path."""
+    try:
+        return os.path.getmtime(first_output_path(rule, path)) >= os.path.getmtime(path)
+    except (OSError, ImportError, RuntimeError, ValueError):
+        return False
+
+
+class InotifyWatcher:
+    """Change events for a set of directories from Linux inotify, through ctypes."""
+
+    def __init__(self, directories):
+        libc_name = ctypes.util.find_library('c')
+        if libc_name is None:
+            raise OSError("libc not found")
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(self._libc, 'inotify_init1'):
+            raise OSError("inotify is not available")
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._directories = {}
+        for directory in directories:
+            wd = self._libc.inotify_add_watch(self.fd, os.fsencode(directory), WATCH_MASK)
+            if wd < 0:
+                errno = ctypes.get_errno()
+                os.close(self.fd)
+                raise OSError(errno, f"Cannot watch {directory}: {os.strerror(errno)}")
+            self._directories[wd] = directory
+
+    def read(self, timeout):
+        """
+        Wait up to timeout seconds and return [(path, closed)] for changed
+        files, closed meaning the writer finished. Returns None if the
+        kernel queue overflowed and events were lost.
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return []
+        changes = []
+        overflowed = False
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                overflowed = True
+            elif name and not mask & IN_ISDIR and wd in self._directories:
+                changes.append((os.path.join(self._directories[wd], os.fsdecode(name)),
+                                bool(mask & (IN_CLOSE_WRITE | IN_MOVED_TO))))
+        return None if overflowed else changes
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PollingWatcher:
+    """Change events found by comparing directory listings, for systems without inotify."""
+
+    def __init__(self, directories, interval=1.0):
+        self.directories = list(directories)
+        self.interval = interval
+        # Files already there are the start-up rescan's business
+        self._seen = self._scan()
+
+    def _scan(self):
+        current = {}
+        for directory in self.directories:
+            try:
+                entries = list(os.scandir(directory))
+            except OSError:
+                continue
+            for entry in entries:
+                try:
+                    if not entry.is_file():
+                        continue
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                current[entry.path] = (stat.st_size, stat.st_mtime_ns)
+        return current
+
+    def read(self, timeout):
+        time.sleep(min(timeout, self.interval))
+        current = self._scan()
+        # Polling cannot see the writer close a file, the settle time covers it
+        changes = [(path, False) for path, signature in current.items() if self._seen.get(path) != signature]
+        self._seen = current
+        return changes
+
+    def close(self):
+        pass
+
+
+class Debouncer:
+    """Holds changed files back until they have stopped changing for settle seconds."""
+
+    def __init__(self, settle):
+        self.settle = settle
+        # path -> (time of the last change, (size, mtime) at that time)
+        self._pending = {}
+
+    def __len__(self):
+        return len(self._pending)
+
+    def __contains__(self, path):
+        return path in self._pending
+
+    def touch(self, path, now, closed=False):
+        try:
+            stat = os.stat(path)
+        except OSError:
+            # Deleted or renamed away before it settled
+            self._pending.pop(path, None)
+            return
+        # A finished write only needs the settle time to catch a quick rewrite
+        seen = now - self.settle / 2 if closed else now
+        self._pending[path] = (seen, (stat.st_size, stat.st_mtime_ns))
+
+    def settled(self, now):
+        """Remove and return the files that stopped changing."""
+        ready = []
+        for path, (seen, signature) in list(self._pending.items()):
+            if now - seen < self.settle:
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                del self._pending[path]
+                continue
+            if (stat.st_size, stat.st_mtime_ns) != signature:
+                # Still being written without events reaching us, wait another round
+                self._pending[path] = (now, (stat.st_size, stat.st_mtime_ns))
+                continue
+            del self._pending[path]
+            ready.append(path)
+        return ready
+
+
+class Metrics:
+    """Counters and latencies of the daemon, reported as a dict."""
+
+    def __init__(self):
+        self.started = time.time()
+        self.detected = 0
+        self.converted = 0
+        self.failed = 0
+        self.skipped = 0
+        self.cached = 0
+        self.rescans = 0
+        self.paused_seconds = 0.0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self.waits = deque(maxlen=LATENCY_WINDOW)
+        self.convert_seconds = deque(maxlen=LATENCY_WINDOW)
+
+    def snapshot(self, settling, queued, in_flight):
+        return {
+            'time': time.time(),
+            'uptime': time.time() - self.started,
+            # Files waiting to settle, settled but waiting for a worker, converting
+            'settling': settling,
+            'queued': queued,
+            'in_flight': in_flight,
+            'queue_depth': settling + queued,
+            'detected': self.detected,
+            'converted': self.converted,
+            'failed': self.failed,
+            'skipped': self.skipped,
+            'cached': self.cached,
+            'rescans': self.rescans,
+            'paused_seconds': self.paused_seconds,
+            # Seconds from the first change event to the output appearing
+            'latency_p50': percentile(self.latencies, 0.5),
+            'latency_p95': percentile(self.latencies, 0.95),
+            'latency_max': max(self.latencies, default=None),
+            # Seconds settled files waited for a worker
+            'wait_p50': percentile(self.waits, 0.5),
+            'wait_p95': percentile(self.waits, 0.95),
+            'convert_p50': percentile(self.convert_seconds, 0.5),
+            'convert_p95': percentile(self.convert_seconds, 0.95),
+        }
+
+
+def write_metrics(path, snapshot):
+    """Replace the metrics file atomically, so readers never see half of it."""
+    temp_path = f"{path}.tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(snapshot, f, indent=2)
+    os.replace(temp_path, path)
+
+
+def format_seconds(value):
+    return "-" if value is None else f"{value:.2f}s"
+
+
+class WatchDaemon:
+    """Turns settled inbox files into conversion jobs on a bounded process pool."""
+
+    def __init__(self, rules, workers=None, settle=2.0, max_pending=1000, poll=False,
+                 cache_dir=DEFAULT_CACHE_DIR, cache_bytes=DEFAULT_MAX_BYTES,
+                 metrics_path=None, metrics_interval=10.0, memory_budget=None, stream=sys.stderr):
+        self.rules = rules
+        self.workers = workers or os.cpu_count() or 1
+        # Keep every worker busy with one job queued behind it, no more
+        self.max_in_flight = self.workers * 2
+        self.max_pending = max_pending
+        self.memory_budget = memory_budget
+        self.cache_dir = cache_dir
+        self.cache_bytes = cache_bytes
+        self.metrics_path = metrics_path
+        self.metrics_interval = metrics_interval
+        self.stream = stream
+        self.metrics = Metrics()
+        self.debouncer = Debouncer(settle)
+        # (path, rule, first seen, settled) waiting for a worker and the memory to run
+        self.queue = AdmissionQueue(memory_budget)
+        # future -> (path, rule, first seen, settled, output path, estimated memory)
+        self.in_flight = {}
+        # path -> first change event, for files anywhere in the daemon
+        self._first_seen = {}
+        self._running = False
+
+        directories = sorted({rule.inbox for rule in rules})
+        self.watcher = None
+        if not poll:
+            try:
+                self.watcher = InotifyWatcher(directories)
+            except (OSError, AttributeError) as e:
+                self.log(f"inotify unavailable ({e}), polling instead")
+        if self.watcher is None:
+            self.watcher = PollingWatcher(directories)
+
+    def log(self, message):
+        print(time.strftime("%H:%M:%S ") + message, file=self.stream, flush=True)
+
+    def stop(self, *_):
+        self._running = False
+
+    def backlog(self):
+        return len(self.debouncer) + len(self.queue)
+
+    def snapshot(self):
+        return self.metrics.snapshot(len(self.debouncer), len(self.queue), len(self.in_flight))
+
+    def _changed(self, path, now, closed=False):
+        if match_rule(self.rules, path) is None:
+            return
+        if path not in self._first_seen:
+            self._first_seen[path] = now
+            self.metrics.detected += 1
+        self.debouncer.touch(path, now, closed)
+
+    def rescan(self, now):
+        """Pick up every matching file without an up-to-date output, after start-up or lost events."""
+        self.metrics.rescans += 1
+        for directory in sorted({rule.inbox for rule in self.rules}):
+            try:
+                names = sorted(os.listdir(directory))
+            except OSError as e:
+                self.log(f"Cannot list {directory}: {e}")
+                continue
+            for name in names:
+                path = os.path.join(directory, name)
+                rule = match_rule(self.rules, path)
+                if rule is None or path in self._first_seen or not os.path.isfile(path):
+                    continue
+                if not is_converted(rule, path):
+                    self._changed(path, now)
+
+    def _enqueue_settled(self, now):
+        for path in self.debouncer.settled(now):
+            rule = match_rule(self.rules, path)
+            source_format = detect_format(path)
+            if rule.target_format not in conversion_targets(source_format):
+                self.log(f"Skipping {path}: cannot convert {source_format} to {rule.target_format}")
+                self.metrics.skipped += 1
+                self._first_seen.pop(path, None)
+                continue
+            if any(path == job[0] for job in self.in_flight.values()):
+                # Rewritten while converting: convert again once the running job is done
+                self.debouncer.touch(path, now)
+                continue
+            cost = estimate_memory(path, rule.target_format, rule.scale) if self.memory_budget else 0
+            self.queue.add((path, rule, self._first_seen[path], now), cost)
+
+    def _dispatch(self, executor):
+        for (path, rule, first_seen, settled), cost in self.queue.admit(self.max_in_flight - len(self.in_flight)):
+            output_path = output_path_for(rule, path)
+            future = executor.submit(convert_one, path, output_path, rule.target_format, rule.scale,
+                                     cache_dir=self.cache_dir, cache_bytes=self.cache_bytes)
+            self.in_flight[future] = (path, rule, first_seen, settled, cost)
+            self.metrics.waits.append(time.monotonic() - settled)
+
+    def _collect(self, timeout):
+        if not self.in_flight:
+            return
+        done, _ = wait(list(self.in_flight), timeout=timeout, return_when=FIRST_COMPLETED)
+        for future in done:
+            path, rule, first_seen, _, cost = self.in_flight.pop(future)
+            result = future.result()
+            self.queue.release(cost, not result['error'])
+            if result['error']:
+                self.metrics.failed += 1
+                self.log(f"Failed: {path}: {result['error']}")
+            else:
+                # convert_one renamed the finished output into the outbox
+                self.metrics.converted += 1
+                self.metrics.cached += result['cached']
+                self.metrics.latencies.append(time.monotonic() - first_seen)
+                self.metrics.convert_seconds.append(result['seconds'])
+                self.log(f"Converted {path} -> {result['output']} in {result['seconds']:.2f}s"
+                         + (" (cached)" if result['cached'] else ""))
+            if path not in self.debouncer:
+                self._first_seen.pop(path, None)
+
+    def _report(self):
+        snapshot = self.snapshot()
+        if self.metrics_path:
+            write_metrics(self.metrics_path, snapshot)
+        self.log(f"Queue {snapshot['queue_depth']} ({snapshot['settling']} settling), "
+                 f"{snapshot['in_flight']} converting, {snapshot['converted']} done, "
+                 f"{snapshot['failed']} failed, latency p50 {format_seconds(snapshot['latency_p50'])} "
+                 f"p95 {format_seconds(snapshot['latency_p95'])}")
+
+    def run(self, duration=None):
+        """Watch until stopped by SIGINT/SIGTERM, or for duration seconds."""
+        self._running = True
+        start = time.monotonic()
+        last_report = start
+        paused_since = None
+        self.log(f"Watching {len({rule.inbox for rule in self.rules})} folders with "
+                 f"{self.workers} workers ({type(self.watcher).__name__})")
+        self.rescan(start)
+        initializer = set_pixel_limit if self.memory_budget else None
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=initializer,
+                                 initargs=(self.memory_budget,) if self.memory_budget else ()) as executor:
+            try:
+                while self._running and (duration is None or time.monotonic() - start < duration):
+                    now = time.monotonic()
+                    if self.backlog() < self.max_pending:
+                        if paused_since is not None:
+                            self.metrics.paused_seconds += now - paused_since
+                            paused_since = None
+                            self.log("Backlog drained, reading events again")
+                        # Short waits while anything is settling, so it is picked up on time
+                        timeout = 0.2 if len(self.debouncer) or self.in_flight else 1.0
+                        changes = self.watcher.read(timeout)
+                        now = time.monotonic()
+                        if changes is None:
+                            self.log("Event queue overflowed, rescanning")
+                            self.rescan(now)
+                        else:
+                            for path, closed in changes:
+                                self._changed(path, now, closed)
+                    else:
+                        # Backpressure: leave events queued in the kernel until the backlog drains
+                        if paused_since is None:
+                            paused_since = now
+                            self.log(f"Backlog of {self.backlog()} files, pausing event reading")
+                        self._collect(0.5)
+                    self._enqueue_settled(now)
+                    self._dispatch(executor)
+                    self._collect(0)
+                    if time.monotonic() - last_report >= self.metrics_interval:
+                        self._report()
+                        last_report = time.monotonic()
+            finally:
+                # Finish the conversions already running, leave the rest for the next start
+                for future in list(self.in_flight):
+                    future.result()
+                self._collect(0)
+                self.watcher.close()
+        self._report()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Convert files dropped into inbox folders.")
+    parser.add_argument("inboxes", nargs="*", help="Folders to watch with the --outbox/--format rule")
+    parser.add_argument("--rules", default=None, help="JSON file with per-folder rules")
+    parser.add_argument("-o", "--outbox", default=None, help="Write outputs here")
+    parser.add_argument("-f", "--format", default=None, help="Target format, e.g. png, jpg, webp, pdf, docx")
+    parser.add_argument("-s", "--scale", type=float, default=1.0, help="Scale factor for images (default: 1)")
+    parser.add_argument("-p", "--pattern", action="append", default=None,
+                        help="Only convert names matching this glob, may be repeated (default: all)")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--settle", type=float, default=2.0,
+                        help="Seconds a file must stay unchanged before it is converted (default: 2)")
+    parser.add_argument("--max-pending", type=int, default=1000,
+                        help="Stop reading events while this many files wait (default: 1000)")
+    parser.add_argument("--memory-budget", type=int, default=None,
+                        help="Only start conversions while their estimated peak memory fits in this many MB")
+    parser.add_argument("--poll", action="store_true", help="Rescan the folders instead of using inotify")
+    parser.add_argument("--metrics", default=None, help="Keep queue and latency metrics in this JSON file")
+    parser.add_argument("--metrics-interval", type=float, default=10.0,
+                        help="Seconds between metrics updates and status lines (default: 10)")
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR,
+                        help=f"Reuse earlier outputs stored here (default: {DEFAULT_CACHE_DIR})")
+    parser.add_argument("--no-cache", action="store_true", help="Always convert, ignoring the cache")
+    args = parser.parse_args(argv)
+    if bool(args.inboxes) == bool(args.rules):
+        parser.error("give either inbox folders or --rules")
+    if args.inboxes and not (args.outbox and args.format):
+        parser.error("inbox folders need --outbox and --format")
+    if args.workers is not None and args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.settle < 0:
+        parser.error("--settle must not be negative")
+    if args.max_pending < 1:
+        parser.error("--max-pending must be at least 1")
+    if args.memory_budget is not None and args.memory_budget < 1:
+        parser.error("--memory-budget must be at least 1 MB")
+    if args.metrics_interval <= 0:
+        parser.error("--metrics-interval must be greater than 0")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    try:
+        if args.rules:
+            rules = load_rules(args.rules)
+        else:
+            rules = [make_rule(inbox, args.outbox, args.format, args.scale, args.pattern or ['*'])
+                     for inbox in args.inboxes]
+    except (OSError, ValueError) as e:
+        print(f"Invalid rules: {e}", file=sys.stderr)
+        return 1
+
+    daemon = WatchDaemon(rules, args.workers, args.settle, args.max_pending, args.poll,
+                         None if args.no_cache else args.cache_dir,
+                         metrics_path=args.metrics, metrics_interval=args.metrics_interval,
+                         memory_budget=args.memory_budget * 1024 * 1024 if args.memory_budget else None)
+    signal.signal(signal.SIGINT, daemon.stop)
+    signal.signal(signal.SIGTERM, daemon.stop)
+    daemon.run()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())